@@ -0,0 +1,203 @@
+"""Benchmarks for the frame-to-MQTT hot path.
+
+Synthetic frames are generated for every node in a nodes.yaml file (by
+default benchmarks/nodes.yaml) and passed through each stage of the
+gateway's processing. For each stage this reports the throughput, the
+latency percentiles of single calls and the memory allocated.
+
+    python benchmarks/bench_hotpath.py --save results.json
+    python benchmarks/bench_hotpath.py --compare results.json
+"""
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from rfm12_mqtt_gateway.nodes import load_definitions_from_yaml  # noqa
+from rfm12_mqtt_gateway.parser import FrameParser  # noqa
+from rfm12_mqtt_gateway.textfilewriter import (  # noqa
+    TextFileWriter, BufferedTextFileWriter)
+
+TIME = '2015-06-01T12:34:56'
+
+COMMAND_VALUES = {
+    'set_time': {'hours': 12, 'minutes': 34, 'seconds': 56},
+    'set_target': {'temperature': 21.5},
+    'boost': {'minutes': 30},
+}
+
+
+def make_frames(nodes, count, seed=0):
+    """Return `count` frame strings from randomly chosen nodes"""
+    rng = random.Random(seed)
+    frames = []
+    for i in range(count):
+        node = rng.choice(nodes)
+        payload = [rng.randrange(256) for j in range(node.payload_size)]
+        frames.append(' '.join(str(b) for b in [node.id] + payload))
+    return frames
+
+
+def percentile(sorted_values, p):
+    k = min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values))))
+    return sorted_values[k]
+
+
+def measure(func, args, repeat_allocations=1000):
+    """Call func(*a) for each a in args and summarise the timings"""
+    timer = time.perf_counter
+    latencies = []
+    for a in args:
+        t0 = timer()
+        func(*a)
+        latencies.append(timer() - t0)
+
+    t0 = timer()
+    for a in args:
+        func(*a)
+    total = timer() - t0
+
+    subset = args[:repeat_allocations]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for a in subset:
+        func(*a)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'calls': len(args),
+        'calls_per_sec': len(args) / total,
+        'latency_us': {
+            'p50': 1e6 * percentile(latencies, 50),
+            'p90': 1e6 * percentile(latencies, 90),
+            'p99': 1e6 * percentile(latencies, 99),
+            'max': 1e6 * latencies[-1],
+        },
+        'alloc_peak_bytes': peak - before,
+        'retained_bytes_per_call': (current - before) / len(subset),
+    }
+
+
+def run_benchmarks(nodes, count):
+    parser = FrameParser(nodes)
+    frames = make_frames(nodes, count)
+    decoded = [parser.process_frame(f) for f in frames]
+    payloads = [(node, bytes(int(b) for b in f.split()[1:]))
+                for f, (node, values) in zip(frames, decoded)]
+    results = {}
+
+    results['process_frame'] = measure(
+        parser.process_frame, [(f,) for f in frames])
+    results['parse_payload'] = measure(
+        lambda node, p: node.parse_payload(p), payloads)
+    unpacked = [(node, node._struct.unpack(p)) for node, p in payloads]
+    results['parse_values'] = measure(
+        lambda node, x: node.parse_values(x), unpacked)
+    results['format_messages'] = measure(
+        lambda node, values: node.format_messages(TIME, values), decoded)
+
+    # Batches of 1000 are large enough to use NumPy, if installed
+    for batch_size in (100, 1000):
+        batches = [(frames[i:i + batch_size],)
+                   for i in range(0, len(frames), batch_size)]
+        results['process_frames_x{}'.format(batch_size)] = measure(
+            parser.process_frames, batches, repeat_allocations=10)
+
+    commands = [(node, k, COMMAND_VALUES[k])
+                for node in nodes for k in node.commands
+                if k in COMMAND_VALUES]
+    if commands:
+        results['encode_command'] = measure(
+            lambda node, k, v: node.encode_command(k, v),
+            [commands[i % len(commands)] for i in range(count)])
+
+    path = tempfile.mkdtemp()
+    try:
+        lines = [('{} {}'.format(TIME, f),) for f in frames]
+        writer = TextFileWriter(path, 'frames')
+        results['writeline'] = measure(writer.writeline, lines)
+        writer.close()
+        writer = BufferedTextFileWriter(path, 'buffered',
+                                        max_queued=3 * count + 1)
+        results['writeline_buffered'] = measure(writer.writeline, lines)
+        writer.close()
+    finally:
+        shutil.rmtree(path)
+
+    # Everything done by the gateway for each received line
+    def end_to_end(f):
+        node, values = parser.process_frame(f)
+        if node is not None:
+            node.format_messages(TIME, values)
+    results['end_to_end'] = measure(end_to_end, [(f,) for f in frames])
+    return results
+
+
+def print_results(results, baseline=None):
+    print('{:<22} {:>12} {:>9} {:>9} {:>9} {:>12}'.format(
+        'benchmark', 'calls/s', 'p50 us', 'p90 us', 'p99 us', 'peak alloc'))
+    for name, r in sorted(results.items()):
+        line = '{:<22} {:>12.0f} {:>9.1f} {:>9.1f} {:>9.1f} {:>12d}'.format(
+            name, r['calls_per_sec'], r['latency_us']['p50'],
+            r['latency_us']['p90'], r['latency_us']['p99'],
+            r['alloc_peak_bytes'])
+        if baseline and name in baseline:
+            ratio = r['calls_per_sec'] / baseline[name]['calls_per_sec']
+            line += ' {:6.2f}x'.format(ratio)
+            if ratio < 0.9:
+                line += ' REGRESSION'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hot path benchmarks')
+    parser.add_argument('-n', '--nodes',
+                        default=os.path.join(os.path.dirname(__file__),
+                                             'nodes.yaml'),
+                        help='node definitions file')
+    parser.add_argument('-c', '--count', type=int, default=20000,
+                        help='number of synthetic frames')
+    parser.add_argument('--save', help='save results to this JSON file')
+    parser.add_argument('--compare',
+                        help='compare with results saved in this JSON file')
+    args = parser.parse_args()
+
+    with open(args.nodes, 'rt') as f:
+        nodes = load_definitions_from_yaml(f.read())
+    print('{} nodes, {} channels, {} frames'.format(
+        len(nodes), sum(len(n.channels) for n in nodes), args.count))
+
+    results = run_benchmarks(nodes, args.count)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'rt') as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'wt') as f:
+            json.dump({
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'nodes': os.path.abspath(args.nodes),
+                'count': args.count,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,44 @@
-import argparse
-import logging
-import asyncio
-from rfm12_mqtt_gateway.gateway import EmonMQTTGateway
+import time
+STARTED = time.time()
+
+import argparse  # noqa: E402
+import logging  # noqa: E402
+import asyncio  # noqa: E402
+from rfm12_mqtt_gateway.gateway import EmonMQTTGateway  # noqa: E402
+from rfm12_mqtt_gateway.config import load_config  # noqa: E402
+from rfm12_mqtt_gateway.textfilewriter import DURABILITY_POLICIES  # noqa
 
 
 def main():
     # Set up logging
     parser = argparse.ArgumentParser(description='emon gateway')
     parser.add_argument('-L', '--log-level', default='warning')
+    parser.add_argument('-c', '--config', help='configuration file')
+    parser.add_argument('-n', '--nodes', default='nodes.yaml',
+                        help='node definitions file')
+    parser.add_argument('--reload-interval', type=float, default=5.0,
+                        help='seconds between checks for changes to the '
+                        'node definitions (0 to only reload on SIGHUP)')
+    parser.add_argument('--definitions-cache',
+                        help='cache parsed node definitions in this file '
+                        'for a faster start')
+    parser.add_argument('--frame-log-format', choices=['text', 'archive'],
+                        default='text')
+    parser.add_argument('--frame-log-durability', default='flush',
+                        choices=DURABILITY_POLICIES,
+                        help='after writing text frame logs, leave them '
+                        'buffered (none), flush them to the OS (flush) or '
+                        'also fsync them (fsync)')
+    parser.add_argument('--fsync-interval', type=float, default=10.0,
+                        help='minimum seconds between fsyncs of the frame '
+                        'log')
+    parser.add_argument('--timestamp-precision', type=int, default=0,
+                        help='decimal places of seconds in timestamps')
+    parser.add_argument('--publish-queue-size', type=int, default=10000,
+                        help='messages kept in memory while MQTT is down')
+    parser.add_argument('--publish-queue-policy', default='drop-oldest',
+                        choices=['drop-oldest', 'coalesce', 'spill'],
+                        help='what to do when the publish queue is full')
     args = parser.parse_args()
 
     numeric_level = getattr(logging, args.log_level.upper(), None)
@@ -18,7 +49,23 @@ def main():
         format="%(asctime)s %(name)s [%(levelname)s] %(message)s")
     logging.getLogger('asyncio').setLevel('WARNING')
 
-    gateway = EmonMQTTGateway()
+    config = load_config(args.config)
+    gateway = EmonMQTTGateway(
+        frame_log_format=args.frame_log_format,
+        frame_log_durability=args.frame_log_durability,
+        fsync_interval=args.fsync_interval,
+        timestamp_precision=args.timestamp_precision,
+        publish_queue_size=args.publish_queue_size,
+        publish_queue_policy=args.publish_queue_policy,
+        nodes_path=args.nodes,
+        reload_interval=args.reload_interval,
+        definitions_cache=args.definitions_cache,
+        started=STARTED,
+        sinks=config['sinks'],
+        radios=config['radios'],
+        dedup=config['dedup'],
+        mqtt_host=config['mqtt']['host'],
+        mqtt_port=config['mqtt']['port'])
     loop = asyncio.get_event_loop()
     loop.run_until_complete(gateway.run_input())
     loop.close()
@@ -0,0 +1,333 @@
+"""Compressed, indexed archive format for the frame log.
+
+An archive file holds the same lines as the text frame log ("<time>
+<frame>"), in zlib-compressed blocks. Each block has a header giving the
+range of times and the set of node ids it contains, so that a query can
+seek past blocks it doesn't need without decompressing them.
+"""
+
+import argparse
+import glob
+import os
+import os.path
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+FILE_MAGIC = b'RFM12ARC1\n'
+BLOCK_MAGIC = b'BLK1'
+
+# magic, first time, last time, line count, raw length, compressed length,
+# bitmap of node ids
+BLOCK_HEADER = struct.Struct('<4s26s26sIII32s')
+
+BlockInfo = namedtuple('BlockInfo', 'start end count node_ids offset length')
+
+
+def _time_string(t):
+    if t is None or isinstance(t, str):
+        return t
+    return t.isoformat()
+
+
+def _node_id(frame):
+    node_id = frame.split(' ', 1)[0]
+    if node_id.isdigit() and int(node_id) < 256:
+        return int(node_id)
+    return None
+
+
+class FrameArchiveWriter(object):
+    """Write frame log lines to daily archive files.
+
+    Lines are collected into blocks of up to `block_lines` lines. A block
+    is also written once its first line is more than `max_block_age`
+    seconds old, which limits how much is lost if the gateway stops.
+    """
+    def __init__(self, path, prefix, block_lines=1000, max_block_age=600,
+                 compression_level=6):
+        self.path = path
+        self.prefix = prefix
+        self.block_lines = block_lines
+        self.max_block_age = max_block_age
+        self.compression_level = compression_level
+        self.file = None
+        self._day = None
+        self._lines = []
+        self._node_ids = set()
+        self._block_started = None
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+    def filename_for_day(self, day):
+        return os.path.join(self.path, '{}/{}/{}-{}.rfa'.format(
+            day[0:4], day[5:7], self.prefix, day))
+
+    def writeline(self, line):
+        """Add a line "<time> <frame>", as written to the text frame log"""
+        t, frame = line.split(' ', 1)
+        if t[:10] != self._day:
+            self.flush()
+            self._open(t[:10])
+        if not self._lines:
+            self._block_started = time.monotonic()
+        self._lines.append(line)
+        self._node_ids.add(_node_id(frame))
+        if (len(self._lines) >= self.block_lines or
+                time.monotonic() - self._block_started > self.max_block_age):
+            self.flush()
+
+    def flush(self):
+        """Write the current block to the file"""
+        if not self._lines:
+            return
+        raw = '\n'.join(self._lines).encode('ascii')
+        data = zlib.compress(raw, self.compression_level)
+        bitmap = bytearray(32)
+        for node_id in self._node_ids:
+            if node_id is not None:
+                bitmap[node_id // 8] |= 1 << (node_id % 8)
+        start = self._lines[0].split(' ', 1)[0]
+        end = self._lines[-1].split(' ', 1)[0]
+        self.file.write(BLOCK_HEADER.pack(
+            BLOCK_MAGIC, start.encode('ascii'), end.encode('ascii'),
+            len(self._lines), len(raw), len(data), bytes(bitmap)))
+        self.file.write(data)
+        self.file.flush()
+        self._lines = []
+        self._node_ids = set()
+
+    def _open(self, day):
+        if self.file is not None:
+            self.file.close()
+        fn = self.filename_for_day(day)
+        if not os.path.exists(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        file_already_existed = os.path.exists(fn)
+        self.file = open(fn, 'ab')
+        if not file_already_existed:
+            self.file.write(FILE_MAGIC)
+        self._day = day
+        logger.info("Opened %s archive %s",
+                    "existing" if file_already_existed else "new", fn)
+
+
+class BufferedFrameArchiveWriter(FrameArchiveWriter):
+    """FrameArchiveWriter which compresses and writes from a thread.
+
+    writeline() only adds the line to a queue, so the serial reader never
+    waits for compression or the disk. A block is written once it is
+    `max_block_age` seconds old even if no more lines arrive. If more
+    than `max_queued` lines are waiting, new lines are dropped.
+    """
+    def __init__(self, path, prefix, block_lines=1000, max_block_age=60,
+                 compression_level=6, max_queued=10000):
+        super().__init__(path, prefix, block_lines, max_block_age,
+                         compression_level)
+        self.dropped = 0
+        self._queue = queue.Queue(max_queued)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def writeline(self, line):
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning("Write queue full, %d lines dropped",
+                               self.dropped)
+
+    def close(self):
+        """Write any queued lines and wait for the thread to finish"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._lines:
+                timeout = max(0, self._block_started + self.max_block_age -
+                              time.monotonic())
+            try:
+                line = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                line = ''
+            if line is None:
+                break
+            try:
+                if line:
+                    FrameArchiveWriter.writeline(self, line)
+                else:
+                    self.flush()
+            except (OSError, ValueError) as err:
+                # Don't keep retrying a block which can't be written
+                logger.error("Error writing frame archive, %d lines lost: "
+                             "%s", len(self._lines), err)
+                self._lines = []
+                self._node_ids = set()
+        try:
+            FrameArchiveWriter.close(self)
+        except OSError as err:
+            logger.error("Error closing frame archive: %s", err)
+
+
+class FrameArchiveReader(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def blocks(self):
+        """Return a list of BlockInfo read from the block headers"""
+        blocks = []
+        with open(self.filename, 'rb') as f:
+            if f.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise ValueError("Not a frame archive: {}"
+                                 .format(self.filename))
+            while True:
+                header = f.read(BLOCK_HEADER.size)
+                if not header:
+                    break
+                if len(header) < BLOCK_HEADER.size:
+                    logger.warning("Truncated block header in %s",
+                                   self.filename)
+                    break
+                (magic, start, end, count, raw_length, length,
+                 bitmap) = BLOCK_HEADER.unpack(header)
+                if magic != BLOCK_MAGIC:
+                    logger.warning("Bad block at offset %d in %s",
+                                   f.tell() - BLOCK_HEADER.size,
+                                   self.filename)
+                    break
+                node_ids = frozenset(i for i in range(256)
+                                     if bitmap[i // 8] & (1 << (i % 8)))
+                blocks.append(BlockInfo(start.rstrip(b'\0').decode('ascii'),
+                                        end.rstrip(b'\0').decode('ascii'),
+                                        count, node_ids, f.tell(), length))
+                f.seek(length, os.SEEK_CUR)
+        return blocks
+
+    def query(self, start=None, end=None, node_ids=None):
+        """Yield (time, frame) for lines between `start` and `end`.
+
+        `start` and `end` are datetimes or ISO format strings, and either
+        can be None. If `node_ids` is given, only frames from those nodes
+        are returned. Blocks are decompressed only when needed.
+        """
+        start, end = _time_string(start), _time_string(end)
+        if node_ids is not None:
+            node_ids = frozenset(node_ids)
+        with open(self.filename, 'rb') as f:
+            for block in self.blocks():
+                if ((start is not None and block.end < start) or
+                        (end is not None and block.start > end) or
+                        (node_ids is not None and
+                         not (node_ids & block.node_ids))):
+                    continue
+                f.seek(block.offset)
+                data = f.read(block.length)
+                if len(data) < block.length:
+                    logger.warning("Truncated block in %s", self.filename)
+                    return
+                for line in zlib.decompress(data).decode('ascii').split('\n'):
+                    t, frame = line.split(' ', 1)
+                    if start is not None and t < start:
+                        continue
+                    if end is not None and t > end:
+                        break
+                    if node_ids is not None and \
+                            _node_id(frame) not in node_ids:
+                        continue
+                    yield t, frame
+
+
+def find_archives(path, prefix, start=None, end=None):
+    """Return archive files under `path` which may contain times in range"""
+    start, end = _time_string(start), _time_string(end)
+    pattern = os.path.join(path, '*', '*', '{}-*.rfa'.format(prefix))
+    # The pattern also matches other prefixes starting with this one,
+    # such as those of each radio's archive
+    name_re = re.compile(r'{}-(\d{{4}}-\d{{2}}-\d{{2}})\.rfa$'
+                         .format(re.escape(prefix)))
+    result = []
+    for fn in sorted(glob.glob(pattern)):
+        match = name_re.match(os.path.basename(fn))
+        if match is None:
+            continue
+        day = match.group(1)
+        if start is not None and day < start[:10]:
+            continue
+        if end is not None and day > end[:10]:
+            continue
+        result.append(fn)
+    return result
+
+
+def query_archives(filenames, start=None, end=None, node_ids=None):
+    for fn in filenames:
+        for t, frame in FrameArchiveReader(fn).query(start, end, node_ids):
+            yield t, frame
+
+
+def convert_text_log(filenames, writer):
+    """Copy text frame log files into a FrameArchiveWriter"""
+    for fn in filenames:
+        logger.info("Converting %s", fn)
+        with open(fn, 'rt') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if ' ' in line:
+                    writer.writeline(line)
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='frame log archives')
+    subparsers = parser.add_subparsers(dest='command')
+
+    convert = subparsers.add_parser(
+        'convert', help='convert text frame logs to archives')
+    convert.add_argument('output', help='archive directory')
+    convert.add_argument('files', nargs='+', help='text frame log files')
+    convert.add_argument('--prefix', default='frames')
+
+    query = subparsers.add_parser('query', help='print archived frames')
+    query.add_argument('path', help='archive directory')
+    query.add_argument('--prefix', default='frames')
+    query.add_argument('--start', help='ISO format start time')
+    query.add_argument('--end', help='ISO format end time')
+    query.add_argument('--node', type=int, action='append', dest='nodes',
+                       help='node id (may be given more than once)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'convert':
+        convert_text_log(sorted(args.files),
+                         FrameArchiveWriter(args.output, args.prefix))
+    elif args.command == 'query':
+        filenames = find_archives(args.path, args.prefix,
+                                  args.start, args.end)
+        for t, frame in query_archives(filenames, args.start, args.end,
+                                       args.nodes):
+            sys.stdout.write('{} {}\n'.format(t, frame))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""Decode many frame log files in parallel.
+
+Files are shared out to a pool of worker processes. Each worker decodes
+whole files into columns (one array of times per node, and one array of
+values per channel) and writes them to a temporary directory. These are
+then merged in time order, a chunk at a time so that years of data don't
+need to fit in memory, and written as raw little-endian float64 files:
+
+    <output>/<node>/time.f64
+    <output>/<node>/<channel>.f64
+    <output>/columns.json
+
+Node and channel names are percent-encoded in file names; columns.json
+gives the directory and channels of each node. Values which are not
+numbers are stored as NaN.
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import shutil
+import sys
+import time
+from array import array
+from urllib.parse import quote
+
+from .parser import FrameParser
+from .nodes import load_definitions_from_yaml
+from .replay import read_frame_log, decode_frames
+from .framing import iso_to_timestamp
+
+logger = logging.getLogger(__name__)
+
+_parser = None
+
+# Values read or written at once when merging
+CHUNK_SIZE = 65536
+
+# Files in the output directory which aren't nodes
+_RESERVED = ('.', '..', 'parts', 'columns.json')
+
+
+def _as_float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def decode_to_columns(parser, records):
+    """Decode frames into {node name: (times, {channel: values})}"""
+    columns = {}
+    for t, node, values in decode_frames(parser, records):
+        try:
+            times, channels = columns[node.name]
+        except KeyError:
+            times, channels = columns[node.name] = (
+                array('d'), {k: array('d') for k in node.channels})
+        times.append(iso_to_timestamp(t))
+        for k, v in values.items():
+            channels[k].append(_as_float(v))
+    return columns
+
+
+def _init_worker(definitions):
+    global _parser
+    _parser = FrameParser(load_definitions_from_yaml(definitions))
+
+
+def _decode_file(args):
+    """Decode a file into columns in `path`, and return their index"""
+    filename, path = args
+    start = time.monotonic()
+    columns = merge_columns([decode_to_columns(_parser,
+                                               read_frame_log([filename]))])
+    index = write_columns(columns, path)
+    for name, (times, channels) in columns.items():
+        index[name]['first'] = times[0]
+        index[name]['last'] = times[-1]
+    logger.info("Decoded %s in %.1f s", filename, time.monotonic() - start)
+    return index
+
+
+def merge_columns(parts):
+    """Merge a sequence of column dicts into one, sorted by time"""
+    merged = {}
+    for part in parts:
+        for name, (times, channels) in part.items():
+            if name not in merged:
+                merged[name] = (array('d'), {k: array('d') for k in channels})
+            merged_times, merged_channels = merged[name]
+            merged_times.extend(times)
+            for k, values in channels.items():
+                merged_channels[k].extend(values)
+
+    for name, (times, channels) in list(merged.items()):
+        if any(a > b for a, b in zip(times, times[1:])):
+            order = sorted(range(len(times)), key=times.__getitem__)
+            merged[name] = (
+                array('d', (times[i] for i in order)),
+                {k: array('d', (values[i] for i in order))
+                 for k, values in channels.items()})
+    return merged
+
+
+def _safe_name(name, reserved=_RESERVED):
+    """Percent-encode `name` for use as a file name.
+
+    Different names never give the same file name. Names which would
+    give one of the `reserved` names have their first character encoded.
+    """
+    safe = quote(name, safe='')
+    if safe in reserved:
+        safe = '%{:02X}'.format(ord(safe[0])) + safe[1:]
+    return safe
+
+
+def _column_filename(node_path, k):
+    # The time column can't be confused with a channel called 'time'
+    if k is None:
+        return os.path.join(node_path, 'time.f64')
+    return os.path.join(node_path,
+                        _safe_name(k, ('time',)) + '.f64')
+
+
+def _write_values(f, values):
+    if sys.byteorder != 'little':
+        values = array('d', values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def _read_values(f, n=CHUNK_SIZE):
+    values = array('d')
+    try:
+        values.fromfile(f, n)
+    except EOFError:
+        pass
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def write_columns(columns, path):
+    """Write columns to `path`, and return the index written"""
+    index = {}
+    for name, (times, channels) in columns.items():
+        node_path = os.path.join(path, _safe_name(name))
+        if not os.path.exists(node_path):
+            os.makedirs(node_path)
+        for k, values in [(None, times)] + sorted(channels.items()):
+            with open(_column_filename(node_path, k), 'wb') as f:
+                _write_values(f, values)
+        index[name] = {'path': _safe_name(name),
+                       'rows': len(times),
+                       'channels': sorted(channels)}
+    with open(os.path.join(path, 'columns.json'), 'wt') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    return index
+
+
+def _read_rows(node_path, channels):
+    """Yield (time, values) from columns written by write_columns"""
+    files = [open(_column_filename(node_path, k), 'rb')
+             for k in [None] + channels]
+    try:
+        while True:
+            chunks = [_read_values(f) for f in files]
+            if not chunks[0]:
+                break
+            for row in zip(*chunks):
+                yield row[0], row[1:]
+    finally:
+        for f in files:
+            f.close()
+
+
+def merge_column_files(parts, channels, path):
+    """Merge columns written by write_columns into `path`.
+
+    `parts` is a list of (node path, first time, last time), each sorted
+    by time. If their times don't overlap, the files are simply joined.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    parts = sorted(parts, key=lambda part: part[1])
+    columns = [None] + channels
+    if all(a[2] <= b[1] for a, b in zip(parts, parts[1:])):
+        for k in columns:
+            with open(_column_filename(path, k), 'wb') as out:
+                for node_path, first, last in parts:
+                    with open(_column_filename(node_path, k), 'rb') as f:
+                        shutil.copyfileobj(f, out)
+        return
+
+    outputs = [open(_column_filename(path, k), 'wb') for k in columns]
+    try:
+        buffers = [array('d') for k in columns]
+        rows = heapq.merge(*[_read_rows(node_path, channels)
+                             for node_path, first, last in parts],
+                           key=lambda row: row[0])
+        for t, values in rows:
+            buffers[0].append(t)
+            for buffer, v in zip(buffers[1:], values):
+                buffer.append(v)
+            if len(buffers[0]) >= CHUNK_SIZE:
+                for f, buffer in zip(outputs, buffers):
+                    _write_values(f, buffer)
+                buffers = [array('d') for k in columns]
+        for f, buffer in zip(outputs, buffers):
+            _write_values(f, buffer)
+    finally:
+        for f in outputs:
+            f.close()
+
+
+def bulk_decode(filenames, definitions, output, processes=None):
+    """Decode `filenames` using node `definitions` (YAML) into `output`"""
+    start = time.monotonic()
+    parts_path = os.path.join(output, 'parts')
+    if not os.path.exists(parts_path):
+        os.makedirs(parts_path)
+    parts = {}
+    pool = multiprocessing.Pool(processes, _init_worker, (definitions,))
+    try:
+        jobs = [(fn, os.path.join(parts_path, str(i)))
+                for i, fn in enumerate(filenames)]
+        for (fn, path), index in zip(jobs, pool.imap(_decode_file, jobs)):
+            for name, info in index.items():
+                parts.setdefault(name, []).append(
+                    (os.path.join(path, info['path']), info['first'],
+                     info['last'], info['rows'], info['channels']))
+    finally:
+        pool.close()
+        pool.join()
+
+    index = {}
+    for name, node_parts in parts.items():
+        channels = node_parts[0][4]
+        merge_column_files([part[:3] for part in node_parts], channels,
+                           os.path.join(output, _safe_name(name)))
+        index[name] = {'path': _safe_name(name),
+                       'rows': sum(part[3] for part in node_parts),
+                       'channels': channels}
+    shutil.rmtree(parts_path)
+    with open(os.path.join(output, 'columns.json'), 'wt') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+
+    frames = sum(info['rows'] for info in index.values())
+    elapsed = time.monotonic() - start
+    logger.info("Decoded %d frames from %d files in %.1f s "
+                "(%.0f frames/sec)", frames, len(filenames), elapsed,
+                frames / elapsed if elapsed else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='decode frame logs in parallel')
+    parser.add_argument('files', nargs='+',
+                        help='frame log files (.txt or .rfa)')
+    parser.add_argument('-n', '--nodes', default='nodes.yaml',
+                        help='node definitions file')
+    parser.add_argument('-o', '--output', required=True,
+                        help='output directory')
+    parser.add_argument('-j', '--processes', type=int,
+                        help='number of worker processes '
+                        '(default: number of CPUs)')
+    parser.add_argument('-L', '--log-level', default='info')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, args.log_level.upper()),
+        format="%(asctime)s %(name)s [%(levelname)s] %(message)s")
+
+    with open(args.nodes, 'rt') as f:
+        definitions = f.read()
+    bulk_decode(sorted(args.files), definitions, args.output,
+                args.processes)
+
+
+if __name__ == '__main__':
+    main()
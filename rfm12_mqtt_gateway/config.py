@@ -0,0 +1,87 @@
+"""Gateway configuration file.
+
+The configuration is a YAML mapping with these sections:
+
+    mqtt:               # MQTT server (default: localhost port 1883)
+      host: localhost
+      port: 1883
+
+    radios:             # serial ports with radios (default: /dev/ttyAMA0)
+      - name: 433mhz
+        port: /dev/ttyAMA0
+        baudrate: 9600
+      - name: 868mhz
+        port: /dev/ttyUSB0
+
+    sinks:              # outputs for decoded frames (default: mqtt only)
+      - type: mqtt
+      - type: sqlite
+        path: /mnt/stick/samples.db
+        queue_size: 10000
+
+    dedup:              # drop repeated frames (default: off)
+      window: 2.0       # seconds within which a repeated frame is dropped
+      shared: true      # coordinate with other gateways over MQTT
+      topic: /gateway/dedup
+      hold: 0.2         # seconds to wait for other gateways' claims
+
+Sink types are mqtt, stdout, csv, line_protocol, sqlite and store (the
+gateway's own rolling history, see store.py). Apart from `type` and
+`queue_size`, the options are passed to the sink.
+
+Radios are named after their port if no name is given. With more than
+one radio, frames from each are logged to separate files, and commands
+are sent on the radio their node was last heard on.
+
+Deduplication is off by default, because a node may really send the same
+payload twice in a row.
+"""
+
+import os.path
+
+DEFAULT_CONFIG = {
+    'mqtt': {'host': 'localhost', 'port': 1883},
+    'radios': [{'port': '/dev/ttyAMA0'}],
+    'sinks': [{'type': 'mqtt'}],
+    'dedup': None,
+}
+
+
+def _check_radios(radios, path):
+    if not radios:
+        raise ValueError('No radios configured in {}'.format(path))
+    checked = []
+    for radio in radios:
+        if 'port' not in radio:
+            raise ValueError('Radio without a port in {}'.format(path))
+        radio = dict(radio)
+        radio.setdefault('name', os.path.basename(radio['port']))
+        radio.setdefault('baudrate', 9600)
+        checked.append(radio)
+    names = [radio['name'] for radio in checked]
+    if len(set(names)) < len(names):
+        raise ValueError('Radio names are not unique in {}'.format(path))
+    return checked
+
+
+def load_config(path=None):
+    """Load the configuration file at `path`, filling in defaults"""
+    config = dict(DEFAULT_CONFIG)
+    if path is not None:
+        import yaml
+        with open(path, 'rt') as f:
+            data = yaml.safe_load(f) or {}
+        if not isinstance(data, dict):
+            raise ValueError('Configuration file {} should contain a mapping'
+                             .format(path))
+        unknown = set(data) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError('Unknown configuration sections in {}: {}'
+                             .format(path, ', '.join(sorted(unknown))))
+        config.update(data)
+    config['mqtt'] = dict(DEFAULT_CONFIG['mqtt'], **(config['mqtt'] or {}))
+    config['radios'] = _check_radios(config['radios'], path)
+    for sink in config['sinks']:
+        if 'type' not in sink:
+            raise ValueError('Sink without a type in {}'.format(path))
+    return config
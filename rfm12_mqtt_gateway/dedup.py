@@ -0,0 +1,103 @@
+"""Drop frames which have already been heard.
+
+When several radios, or several gateways, can hear the same node, each
+transmission is received more than once. Frames are identified by their
+text (the node id and payload bytes), and a frame seen again within
+`window` seconds is a duplicate.
+
+Gateways can also share the frames they hear by publishing claims to an
+MQTT topic. A frame is then held for `hold` seconds before it is passed
+on, and dropped if another gateway claimed it first (by time, then by
+instance name), so only one gateway publishes each transmission.
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Deduplicator(object):
+    """Pass on each frame once with `dispatch(record)`.
+
+    If `publish_claim` is given, claims are published with it and claims
+    from other gateways should be passed to handle_claim(). At most
+    `maxlen` frames are remembered.
+    """
+    def __init__(self, loop, dispatch, window=2.0, maxlen=10000,
+                 publish_claim=None, instance=None, hold=0.2):
+        self._loop = loop
+        self._dispatch = dispatch
+        self.window = window
+        self.maxlen = maxlen
+        self._publish_claim = publish_claim
+        self.instance = instance
+        self.hold = hold
+        self.duplicates = 0
+        # The earliest claim for each frame, (time, instance), and when
+        # it was first heard of here. Other gateways' clocks may be
+        # wrong, so frames are forgotten by the local time.
+        self._seen = OrderedDict()
+        # Frames waiting to see if other gateways claim them first
+        self._held = {}
+
+    def __len__(self):
+        return len(self._seen)
+
+    def _expire(self, now):
+        seen = self._seen
+        while seen:
+            frame, (claim, heard) = next(iter(seen.items()))
+            if heard + self.window > now and len(seen) < self.maxlen:
+                break
+            seen.popitem(last=False)
+
+    def submit(self, frame, record, now=None):
+        """Pass on `record` unless `frame` has been heard recently"""
+        if now is None:
+            now = time.time()
+        self._expire(now)
+        if frame in self._seen:
+            self.duplicates += 1
+            logger.debug('Dropping duplicate frame: %s', frame)
+            return
+        self._seen[frame] = ((now, self.instance), now)
+        if self._publish_claim is None:
+            self._dispatch(record)
+            return
+        self._publish_claim(json.dumps({'frame': frame, 'at': now,
+                                        'instance': self.instance}))
+        handle = self._loop.call_later(self.hold, self._release, frame)
+        self._held[frame] = (record, handle)
+
+    def handle_claim(self, payload):
+        """Note a frame claimed by another gateway"""
+        try:
+            claim = json.loads(payload.decode('utf8'))
+            frame = claim['frame']
+            key = (float(claim['at']), str(claim['instance']))
+        except (ValueError, KeyError, TypeError) as err:
+            logger.warning('Bad frame claim %r: %r', payload, err)
+            return
+        if key[1] == self.instance:
+            return
+        now = time.time()
+        self._expire(now)
+        existing = self._seen.get(frame)
+        if existing is not None:
+            if existing[0] <= key:
+                return
+            # Keep its place, in the order frames were heard here
+            now = existing[1]
+        self._seen[frame] = (key, now)
+        if frame in self._held:
+            record, handle = self._held.pop(frame)
+            handle.cancel()
+            self.duplicates += 1
+            logger.debug('Frame claimed first by %s: %s', key[1], frame)
+
+    def _release(self, frame):
+        record, handle = self._held.pop(frame)
+        self._dispatch(record)
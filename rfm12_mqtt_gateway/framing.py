@@ -0,0 +1,72 @@
+import time
+from calendar import timegm
+import logging
+
+logger = logging.getLogger(__name__)
+
+_day_starts = {}
+
+
+class LineFramer(object):
+    """Split a stream of bytes into lines.
+
+    Data can be fed in chunks of any size; feed() returns all the lines
+    completed by the chunk, decoded and stripped, with blank lines
+    removed. Partial lines are kept for the next call.
+    """
+    def __init__(self, max_line_length=1024):
+        self.max_line_length = max_line_length
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        buf = self._buffer
+        buf += data
+        end = buf.rfind(b'\n')
+        if end < 0:
+            if len(buf) > self.max_line_length:
+                logger.warning('Discarding %d bytes without a newline',
+                               len(buf))
+                del buf[:]
+            return []
+        lines = buf[:end].decode('ascii', 'replace').split('\n')
+        del buf[:end + 1]
+        return [line.strip() for line in lines if line and not line.isspace()]
+
+
+class Timestamper(object):
+    """Make ISO format UTC timestamps, with `precision` decimal places.
+
+    The date and time are only formatted again when the second changes.
+    """
+    def __init__(self, precision=0):
+        if not 0 <= precision <= 6:
+            raise ValueError('precision must be between 0 and 6')
+        self.precision = precision
+        self._second = None
+        self._formatted = None
+
+    def __call__(self, now=None):
+        if now is None:
+            now = time.time()
+        second = int(now)
+        if second != self._second:
+            self._formatted = time.strftime('%Y-%m-%dT%H:%M:%S',
+                                            time.gmtime(second))
+            self._second = second
+        if not self.precision:
+            return self._formatted
+        scale = 10 ** self.precision
+        fraction = min(int(round((now - second) * scale)), scale - 1)
+        return '{}.{:0{}d}'.format(self._formatted, fraction, self.precision)
+
+
+def iso_to_timestamp(t):
+    """Convert an ISO format UTC time string to seconds since the epoch"""
+    day = t[:10]
+    try:
+        day_start = _day_starts[day]
+    except KeyError:
+        day_start = _day_starts[day] = timegm(
+            (int(t[0:4]), int(t[5:7]), int(t[8:10]), 0, 0, 0))
+    return (day_start + 3600 * int(t[11:13]) + 60 * int(t[14:16]) +
+            float(t[17:]))
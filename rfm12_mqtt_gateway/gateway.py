@@ -1,89 +1,376 @@
 import asyncio
+import os
 import serial
-from datetime import datetime
+import signal
+import socket
+import time as _time
+from time import perf_counter
 import json
-import paho.mqtt.client as paho
 import logging
+import math
 
 from .parser import FrameParser
-from .nodes import load_definitions_from_yaml
-from .textfilewriter import TextFileWriter
+from .nodes import load_definitions
+from .textfilewriter import BufferedTextFileWriter
+from .archive import BufferedFrameArchiveWriter
+from .metrics import GatewayMetrics
+from .framing import LineFramer, Timestamper
+from .publishqueue import PublishQueue
+from .publishfilter import PublishFilter
+from .transmit import TransmitQueue
+from .dedup import Deduplicator
+from .sinks import MQTTSink, StoreSink, SinkRunner, create_sink
+from .profiler import SamplingProfiler
 
 logger = logging.getLogger('gateway')
 
+METRICS_TOPIC = '/gateway/metrics'
+COMMAND_RESULT_TOPIC = '/command_result'
+HISTORY_RESULT_TOPIC = '/history_result'
+PROFILE_TOPIC = '/gateway/profile'
+PROFILE_RESULT_TOPIC = '/gateway/profile_result'
 
-@asyncio.coroutine
-def create_read_write_streams(handle, loop=None):
+# Limits on profiles requested over MQTT
+MAX_PROFILE_SECONDS = 600.0
+MIN_PROFILE_INTERVAL = 0.001
+
+# Maximum number of messages handed to paho but not yet written
+PUBLISH_WINDOW = 100
+
+
+async def create_read_write_streams(handle, loop=None):
     if loop is None:
         loop = asyncio.get_event_loop()
 
     # Set up StreamWriter
-    writer_transport, writer_protocol = yield from loop.connect_write_pipe(
+    writer_transport, writer_protocol = await loop.connect_write_pipe(
         asyncio.streams.FlowControlMixin, handle)
     writer = asyncio.StreamWriter(writer_transport, writer_protocol, None, loop)
 
     # Set up StreamReader
     reader = asyncio.StreamReader()
     reader_protocol = asyncio.StreamReaderProtocol(reader)
-    yield from loop.connect_read_pipe(lambda: reader_protocol, handle)
+    await loop.connect_read_pipe(lambda: reader_protocol, handle)
 
     return reader, writer
 
 
+class Radio(object):
+    """A radio module on a serial port.
+
+    Each radio has its own frame log (when there is more than one) and
+    transmit queue.
+    """
+    def __init__(self, name, port, baudrate=9600):
+        self.name = name
+        self.port = port
+        self.baudrate = baudrate
+        self.writer = None
+        self.frame_log = None
+        self.transmit_queue = None
+
+    def write_line(self, line):
+        if self.writer is None:
+            raise RuntimeError('Serial port {} is not open'.format(self.port))
+        logger.debug('Writing line to %s: %s', self.name, line)
+        self.writer.write(line.encode('ascii'))
+
+    def __repr__(self):
+        return '<Radio {} on {}>'.format(self.name, self.port)
+
+
 class EmonMQTTGateway:
-    def __init__(self, loop=None):
+    def __init__(self, loop=None, frame_log_format='text',
+                 metrics_interval=60.0, timestamp_precision=0,
+                 publish_queue_size=10000,
+                 publish_queue_policy='drop-oldest',
+                 nodes_path='nodes.yaml', reload_interval=5.0,
+                 definitions_cache=None, started=None, sinks=None,
+                 radios=None, dedup=None,
+                 frame_log_path='/mnt/stick/frame_log',
+                 frame_log_durability='flush', fsync_interval=10.0,
+                 journal_path='/mnt/stick/publish_journal',
+                 mqtt_host='localhost', mqtt_port=1883, mqtt_client=None):
         if loop is None:
             loop = asyncio.get_event_loop()
         self._loop = loop
+        self._started = started if started is not None else _time.time()
+        self._first_frame = True
+        self._timestamper = Timestamper(timestamp_precision)
+
+        self.publish_queue = PublishQueue(
+            publish_queue_size, publish_queue_policy,
+            journal_path)
 
-        self.frame_log = TextFileWriter('/mnt/stick/frame_log', 'frames')
+        self.publish_filter = PublishFilter()
 
-        with open('nodes.yaml', 'rt') as f:
-            nodes = load_definitions_from_yaml(f.read())
+        self.metrics = GatewayMetrics()
+        self.metrics.publish_queue = self.publish_queue
+        self.metrics_interval = metrics_interval
+
+        if sinks is None:
+            sinks = [{'type': 'mqtt'}]
+        self.sinks = []
+        self.store = None
+        for i, config in enumerate(sinks):
+            if config['type'] == 'mqtt':
+                sink = MQTTSink(self.publish_queue, self.publish_filter,
+                                self._flush_publish_queue, self.metrics)
+            else:
+                sink = create_sink(config)
+            if isinstance(sink, StoreSink):
+                self.store = sink.store
+            self.sinks.append(SinkRunner(
+                '{}-{}'.format(config['type'], i), sink, loop,
+                config.get('queue_size', 10000)))
+        self.metrics.sinks = self.sinks
+
+        if radios is None:
+            radios = [{'name': 'ttyAMA0', 'port': '/dev/ttyAMA0'}]
+        self.radios = []
+        for config in radios:
+            radio = Radio(config['name'], config['port'],
+                          config.get('baudrate', 9600))
+            radio.transmit_queue = TransmitQueue(loop, radio.write_line,
+                                                 self._command_result)
+            # Frames from each radio are logged separately
+            prefix = ('frames' if len(radios) == 1
+                      else 'frames-{}'.format(radio.name))
+            if frame_log_format == 'archive':
+                radio.frame_log = BufferedFrameArchiveWriter(
+                    frame_log_path, prefix)
+            else:
+                radio.frame_log = BufferedTextFileWriter(
+                    frame_log_path, prefix, durability=frame_log_durability,
+                    fsync_interval=fsync_interval)
+            self.radios.append(radio)
+        # The radio each node was last heard on, by node id
+        self.node_radios = {}
+
+        # Profiles are saved alongside the frame logs
+        self.frame_log_path = frame_log_path
+        self.profiler = None
+
+        self.dedup = None
+        self.dedup_topic = None
+        if dedup is not None:
+            publish_claim = None
+            if dedup.get('shared'):
+                self.dedup_topic = dedup.get('topic', '/gateway/dedup')
+                publish_claim = self._publish_claim
+            self.dedup = Deduplicator(
+                loop, self._dispatch, dedup.get('window', 2.0),
+                publish_claim=publish_claim,
+                instance=dedup.get('instance', '{}:{}'.format(
+                    socket.gethostname(), os.getpid())),
+                hold=dedup.get('hold', 0.2))
+            self.metrics.dedup = self.dedup
+
+        self.nodes_path = nodes_path
+        self.reload_interval = reload_interval
+        self.definitions_cache = definitions_cache
+        self._nodes_mtime = os.stat(nodes_path).st_mtime
+        nodes = load_definitions(nodes_path, definitions_cache)
         self.nodes_by_name = {node.name: node for node in nodes}
         self.parser = FrameParser(nodes)
 
-        self.mqtt_client = paho.Client()
-        self.mqtt_client.on_connect = self._mqtt_on_connect
-        self.mqtt_client.on_message = self._mqtt_on_message
-        logger.info('Trying to connect to MQTT server...')
-        self.mqtt_client.connect("localhost")
-        self._mqtt_loop()
+        # The MQTT client is created once the serial port is open, unless
+        # one is given (something with the same interface as paho's
+        # Client, which connects by itself)
+        self.mqtt_host = mqtt_host
+        self.mqtt_port = mqtt_port
+        self._given_mqtt_client = mqtt_client
+        self.mqtt_client = None
+
+        self._loop.call_later(self.metrics_interval, self._publish_metrics)
+        self._loop.add_signal_handler(signal.SIGUSR1, self._dump_metrics)
+        self._loop.add_signal_handler(signal.SIGHUP, self.reload_definitions)
+        if self.reload_interval:
+            self._loop.call_later(self.reload_interval,
+                                  self._check_definitions)
 
-    @asyncio.coroutine
-    def run_input(self):
+    def reload_definitions(self):
+        """Load the node definitions again, keeping the old ones on error.
+
+        Only changed definitions are compiled again. The new definitions
+        replace the old ones in one step between frames.
+        """
+        logger.info('Reloading node definitions from %s', self.nodes_path)
+        try:
+            self._nodes_mtime = os.stat(self.nodes_path).st_mtime
+            nodes = load_definitions(self.nodes_path, self.definitions_cache,
+                                     self.nodes_by_name.values())
+        except Exception as err:
+            logger.error('Error loading node definitions, keeping the old '
+                         'ones: %s', err)
+            return False
+
+        new_by_name = {node.name: node for node in nodes}
+        for name, node in self.nodes_by_name.items():
+            if new_by_name.get(name) is not node:
+                self.publish_filter.forget(name)
+        changed = [node.name for node in nodes
+                   if self.nodes_by_name.get(node.name) is not node]
+        removed = set(self.nodes_by_name) - set(new_by_name)
+        logger.info('Loaded %d node definitions (%d changed or new, '
+                    '%d removed)', len(nodes), len(changed), len(removed))
+
+        self.nodes_by_name, self.parser = new_by_name, FrameParser(nodes)
+        return True
+
+    def _check_definitions(self):
+        try:
+            if os.stat(self.nodes_path).st_mtime != self._nodes_mtime:
+                self.reload_definitions()
+        except OSError as err:
+            logger.error('Error checking %s: %s', self.nodes_path, err)
+        self._loop.call_later(self.reload_interval, self._check_definitions)
+
+    async def run_input(self):
         # if isinstance(message, str):
         #     message = message.encode('utf8')
         # writer.write(message)
-        # yield from writer.drain()
+        # await writer.drain()
+
+        # Open serial ports
+        readers = []
+        for radio in self.radios:
+            s = serial.Serial(radio.port, radio.baudrate)
+            reader, radio.writer = await create_read_write_streams(
+                s, self._loop)
+            readers.append(self._loop.create_task(
+                self._read_radio(radio, reader)))
+        logger.info('%d serial ports open %.3f s after start',
+                    len(self.radios), _time.time() - self._started)
 
-        # Open serial port
-        s = serial.Serial('/dev/ttyAMA0', 9600)
-        reader, self.writer = yield from create_read_write_streams(s)
+        # Nothing received before this is lost, so it is safe to wait
+        # for the MQTT library now
+        self._start_mqtt()
 
+        try:
+            # A radio failing must not go unnoticed while the others
+            # carry on
+            done, pending = await asyncio.wait(
+                readers, return_when=asyncio.FIRST_EXCEPTION)
+            for reader in done:
+                reader.result()
+        finally:
+            for reader in readers:
+                reader.cancel()
+            # Write out the frames and records still queued
+            for radio in self.radios:
+                radio.frame_log.close()
+            for sink in self.sinks:
+                sink.close()
+
+    async def _read_radio(self, radio, reader):
+        # Read everything available and process all the complete lines, so
+        # a backlog of frames is handled in one go
+        framer = LineFramer()
         while True:
-            line = yield from reader.readline()
-            time = datetime.utcnow().replace(microsecond=0).isoformat()
-
-            logger.debug('Received line: %s', line)
-            self.frame_log.writeline(
-                '{} {}'.format(time, line.decode('ascii').strip()))
-
-            node, values = self.parser.process_frame(line.decode('ascii'))
-            if node is None:
-                continue
-            logger.debug('Processed frame: %s %s', node, values)
-
-            for k, v in values.items():
-                topic = '{}/{}'.format(node.name, k)
-                payload = json.dumps({
-                    'at':    time,
-                    'value': v,
-                    'units': node.channels[k].get('units', ''),
-                    'description': node.channels[k].get('description', ''),
-                })
-                logger.debug('Publishing [%s] %s', topic, payload)
-                self.mqtt_client.publish(topic, payload)
+            data = await reader.read(4096)
+            if not data:
+                logger.error('Serial port %s closed', radio.port)
+                break
+            received = perf_counter()
+            if self._first_frame:
+                self._first_frame = False
+                self.metrics.time_to_first_frame = (_time.time() -
+                                                    self._started)
+                logger.info('First data received %.3f s after start',
+                            self.metrics.time_to_first_frame)
+            time = self._timestamper()
+            for line in framer.feed(data):
+                self._process_line(line, time, received, radio)
+
+    def _start_mqtt(self):
+        client = self._given_mqtt_client
+        if client is None:
+            import paho.mqtt.client as paho
+            client = paho.Client()
+
+        client.on_connect = self._mqtt_on_connect
+        client.on_message = self._mqtt_on_message
+        client.on_publish = self._mqtt_on_publish
+        self.mqtt_client = client
+        logger.info('Trying to connect to MQTT server...')
+        if client is self._given_mqtt_client:
+            client.connect(self.mqtt_host, self.mqtt_port)
+        else:
+            from .mqtt import AsyncioMQTTAdapter
+            self._mqtt_adapter = AsyncioMQTTAdapter(client, self._loop)
+            self._mqtt_adapter.connect(self.mqtt_host, self.mqtt_port)
+
+    def _process_line(self, line, time, received, radio):
+        metrics = self.metrics
+        metrics.frames_received += 1
+        metrics.radio_frames[radio.name] += 1
+
+        logger.debug('Received line from %s: %s', radio.name, line)
+        start = perf_counter()
+        radio.frame_log.writeline('{} {}'.format(time, line))
+        logged = perf_counter()
+        metrics.frame_log_time.add(logged - start)
+
+        try:
+            node, values = self.parser.process_frame(line)
+        except ValueError as err:
+            metrics.frames_malformed += 1
+            logger.warning('Error processing frame: %s', err)
+            return
+        except RuntimeError as err:
+            logger.error('Error processing frame: %s', err)
+            return
+        except Exception as err:
+            # e.g. dividing by zero in a channel expression: one bad
+            # frame mustn't stop the radio being read
+            metrics.frames_malformed += 1
+            logger.error('Error decoding frame from node %s: %r',
+                         line.split(' ', 1)[0], err)
+            return
+        metrics.parse_time.add(perf_counter() - logged)
+        if node is None:
+            if not values:
+                metrics.frames_unknown_node += 1
+            else:
+                radio.transmit_queue.handle_response(values)
+            return
+        logger.debug('Processed frame: %s %s', node, values)
+        metrics.frames_decoded += 1
+        metrics.node_frames[node.name] += 1
+        self.node_radios[node.id] = radio
+
+        record = (time, node, values, received)
+        if self.dedup is not None:
+            self.dedup.submit(' '.join(line.split()), record)
+        else:
+            self._dispatch(record)
+
+    def _dispatch(self, record):
+        for sink in self.sinks:
+            sink.put(record)
+
+    def _publish_claim(self, payload):
+        # Claims are only useful straight away, so aren't queued
+        client = self.mqtt_client
+        if client is not None and client.is_connected():
+            client.publish(self.dedup_topic, payload)
+            self.metrics.messages_published += 1
+
+    def _flush_publish_queue(self):
+        # Hand queued messages to paho while connected, but keep the
+        # number waiting to be written small so that the backlog stays
+        # in the bounded queue during an outage.
+        metrics = self.metrics
+        queue = self.publish_queue
+        client = self.mqtt_client
+        while (client is not None and client.is_connected() and
+               metrics.publish_queue_depth < PUBLISH_WINDOW):
+            message = queue.get()
+            if message is None:
+                break
+            client.publish(*message)
+            metrics.messages_published += 1
 
     def _send_command(self, node_name, command_name, values):
         try:
@@ -105,25 +392,142 @@ class EmonMQTTGateway:
         except Exception as err:
             logger.error("Error encoding command: %r", err)
         else:
-            self._write_payload(node.id, payload)
+            self._radio_for(node).transmit_queue.submit(node, command_name,
+                                                        payload)
 
-    def _write_payload(self, node_id, payload):
-        frame = ','.join(['%02d' % x for x in payload]) + ',%ds' % node_id
-        logger.debug('Writing line: %s', frame)
-        self.writer.write(frame.encode('ascii'))
+    def _radio_for(self, node):
+        """Return the radio to send to `node` on: the one last heard on"""
+        try:
+            return self.node_radios[node.id]
+        except KeyError:
+            radio = self.radios[0]
+            logger.info("Node '%s' not heard yet, sending on %s",
+                        node.name, radio.name)
+            return radio
+
+    def _command_result(self, command, status, latency):
+        topic = '{}{}/{}'.format(COMMAND_RESULT_TOPIC, command.node.name,
+                                 command.command_name)
+        self.publish_queue.put(topic, json.dumps({
+            'status': status,
+            'latency': round(latency, 3),
+        }))
+        self._flush_publish_queue()
+
+    def _query_history(self, node_name, channel, payload):
+        request = {}
+        try:
+            if payload:
+                request = json.loads(payload.decode('utf8'))
+            resolution = request.get('resolution', 'raw')
+            rows = self.store.query(node_name, channel, resolution,
+                                    request.get('start'), request.get('end'),
+                                    request.get('limit'))
+        except Exception as err:
+            logger.error("Error querying history of %s %s: %r",
+                         node_name, channel, err)
+            result = {'error': str(err)}
+        else:
+            columns = self.store.COLUMNS['raw' if resolution == 'raw'
+                                         else 'rollup']
+            result = {'resolution': resolution, 'columns': columns,
+                      'data': rows}
+        if isinstance(request, dict) and 'id' in request:
+            result['id'] = request['id']
+        topic = '{}{}/{}'.format(HISTORY_RESULT_TOPIC, node_name, channel)
+        self.publish_queue.put(topic, json.dumps(result))
+        self._flush_publish_queue()
+
+    def _start_profile(self, payload):
+        if self.profiler is not None:
+            logger.warning('Profile requested while one is running')
+            return
+        request = {}
+        try:
+            if payload:
+                request = json.loads(payload.decode('utf8'))
+            seconds = float(request.get('seconds', 30.0))
+            interval = float(request.get('interval', 0.005))
+            if not (math.isfinite(seconds) and math.isfinite(interval)):
+                raise ValueError('seconds and interval must be finite')
+            seconds = min(seconds, MAX_PROFILE_SECONDS)
+            interval = max(interval, MIN_PROFILE_INTERVAL)
+            top = int(request.get('top', 10))
+        except (ValueError, TypeError, AttributeError) as err:
+            logger.error('Bad profile request %r: %r', payload, err)
+            return
+        logger.warning('Profiling for %g seconds', seconds)
+        self.profiler = SamplingProfiler(interval)
+        self.profiler.start()
+        self._loop.call_later(seconds, self._finish_profile, seconds, top,
+                              request.get('id'))
+
+    def _finish_profile(self, seconds, top, request_id):
+        profiler = self.profiler
+        profiler.stop()
+        filename = os.path.join(self.frame_log_path, _time.strftime(
+            'profile-%Y%m%d-%H%M%S.folded'))
+        result = profiler.summary(top)
+        result['seconds'] = seconds
+        result['file'] = filename
+        if request_id is not None:
+            result['id'] = request_id
+
+        def written(future):
+            self.profiler = None
+            if future.exception() is not None:
+                logger.error('Error saving profile: %r', future.exception())
+                result['file'] = None
+            self.publish_queue.put(PROFILE_RESULT_TOPIC, json.dumps(result))
+            self._flush_publish_queue()
+
+        # Don't wait for the frame log's disk in the event loop
+        future = self._loop.run_in_executor(None, profiler.write_collapsed,
+                                            filename)
+        future.add_done_callback(written)
 
     def _mqtt_on_connect(self, client, userdata, flags_dict, rc):
         if rc == 0:
             logger.info('Connected to MQTT server')
             # subscribe
             self.mqtt_client.subscribe('/send_command/#')
+            self.mqtt_client.subscribe(PROFILE_TOPIC)
+            if self.store is not None:
+                self.mqtt_client.subscribe('/query_history/#')
+            if self.dedup_topic is not None:
+                self.mqtt_client.subscribe(self.dedup_topic)
+            # Messages handed to paho before the connection was lost
+            # have gone
+            self.metrics.messages_sent = self.metrics.messages_published
+            self._flush_publish_queue()
         else:
+            import paho.mqtt.client as paho
             logger.error('Error connecting to MQTT server (%d): %s',
                          rc, paho.connack_string(rc))
 
+    def _mqtt_on_publish(self, client, userdata, mid):
+        self.metrics.messages_sent += 1
+        self._flush_publish_queue()
+
+    def _publish_metrics(self):
+        payload = json.dumps(self.metrics.snapshot())
+        self.publish_queue.put(METRICS_TOPIC, payload)
+        self._flush_publish_queue()
+        self._loop.call_later(self.metrics_interval, self._publish_metrics)
+
+    def _dump_metrics(self):
+        logger.warning('Metrics: %s', json.dumps(
+            self.metrics.snapshot(reset=False), indent=2, sort_keys=True))
+
     def _mqtt_on_message(self, client, userdata, message):
         logger.info('Received MQTT message [%s] "%s"',
                     message.topic, message.payload)
+        if message.topic == self.dedup_topic:
+            self.dedup.handle_claim(message.payload)
+            return
+        if message.topic == PROFILE_TOPIC:
+            self._start_profile(message.payload)
+            return
         if not message.topic.startswith('/'):
             return
         parts = message.topic[1:].split('/')
@@ -133,10 +537,9 @@ class EmonMQTTGateway:
             else:
                 self._send_command('/'.join([''] + parts[1:-1]), parts[-1],
                                    message.payload)
-
-    def _mqtt_loop(self):
-        rc = self.mqtt_client.loop(timeout=0)
-        if rc != 0:
-            logger.error('Error in MQTT loop (%d): %s',
-                         rc, paho.error_string(rc))
-        self._loop.call_later(1.0, self._mqtt_loop)
+        elif parts[0] == 'query_history' and self.store is not None:
+            if len(parts) < 3:
+                logger.error('Bad query_history topic: "%s"', message.topic)
+            else:
+                self._query_history('/'.join([''] + parts[1:-1]), parts[-1],
+                                    message.payload)
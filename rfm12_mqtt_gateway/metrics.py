@@ -0,0 +1,124 @@
+import time
+from bisect import bisect_left
+from collections import Counter
+
+
+class Histogram(object):
+    """Histogram of durations (in seconds) with fixed bins.
+
+    Adding a value only increments a bin count, so this is cheap enough
+    to use on every frame. Percentiles are given as the upper edge of
+    the bin they fall in.
+    """
+    BOUNDS = (1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3,
+              0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        target = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class GatewayMetrics(object):
+    """Counters and timings of the gateway's work"""
+    def __init__(self):
+        self.started = time.time()
+        self.frames_received = 0
+        self.frames_decoded = 0
+        self.frames_unknown_node = 0
+        self.frames_malformed = 0
+        self.messages_published = 0
+        self.messages_sent = 0
+        self.node_frames = Counter()
+        self.radio_frames = Counter()
+        self.parse_time = Histogram()
+        self.frame_log_time = Histogram()
+        self.serial_to_publish = Histogram()
+        self.publish_queue = None
+        self.time_to_first_frame = None
+        self.sinks = []
+        self.dedup = None
+        self._last_snapshot = (self.started, Counter())
+
+    @property
+    def publish_queue_depth(self):
+        return self.messages_published - self.messages_sent
+
+    def snapshot(self, reset=True):
+        """Return a dict of the current metrics.
+
+        Node frame rates (per minute) and timings cover the time since
+        the last snapshot with `reset` true, so other snapshots (e.g. for
+        debugging) don't change what is published periodically.
+        """
+        now = time.time()
+        last_time, last_counts = self._last_snapshot
+        minutes = (now - last_time) / 60.0
+        rates = {name: (n - last_counts[name]) / minutes if minutes else 0
+                 for name, n in self.node_frames.items()}
+        snapshot = {
+            'uptime': now - self.started,
+            'time_to_first_frame': self.time_to_first_frame,
+            'frames': {
+                'received': self.frames_received,
+                'decoded': self.frames_decoded,
+                'unknown_node': self.frames_unknown_node,
+                'malformed': self.frames_malformed,
+                'duplicate': (self.dedup.duplicates
+                              if self.dedup is not None else 0),
+            },
+            'node_frames_per_minute': rates,
+            'radio_frames': dict(self.radio_frames),
+            'messages': {
+                'published': self.messages_published,
+                'sent': self.messages_sent,
+                'queue_depth': self.publish_queue_depth,
+                'queued': (len(self.publish_queue)
+                           if self.publish_queue is not None else 0),
+                'dropped': (self.publish_queue.dropped
+                            if self.publish_queue is not None else 0),
+            },
+            'sinks': {sink.name: {'queued': len(sink),
+                                  'dropped': sink.dropped}
+                      for sink in self.sinks},
+            'parse_time': self.parse_time.as_dict(),
+            'frame_log_time': self.frame_log_time.as_dict(),
+            'serial_to_publish': self.serial_to_publish.as_dict(),
+        }
+        if reset:
+            self._last_snapshot = (now, Counter(self.node_frames))
+            self.parse_time = Histogram()
+            self.frame_log_time = Histogram()
+            self.serial_to_publish = Histogram()
+        return snapshot
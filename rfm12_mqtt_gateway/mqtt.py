@@ -0,0 +1,94 @@
+import logging
+import paho.mqtt.client as paho
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncioMQTTAdapter:
+    """Drive a paho MQTT client from an asyncio event loop.
+
+    The client's socket is watched by the event loop, so incoming messages
+    are handled, and outgoing messages written, as soon as the socket is
+    ready. If the connection is lost it is re-established with exponential
+    backoff between `min_delay` and `max_delay` seconds.
+    """
+    def __init__(self, client, loop, min_delay=1.0, max_delay=120.0,
+                 misc_interval=1.0):
+        self.client = client
+        self._loop = loop
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.misc_interval = misc_interval
+
+        self._delay = min_delay
+        self._reconnect_handle = None
+        self._misc_handle = None
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.on_disconnect = self._on_disconnect
+
+    def connect(self, host, port=1883, keepalive=60):
+        try:
+            self.client.connect(host, port, keepalive)
+        except OSError as err:
+            logger.error('Error connecting to MQTT server: %s', err)
+            self._schedule_reconnect()
+        self._schedule_misc()
+
+    def _reconnect(self):
+        self._reconnect_handle = None
+        logger.info('Trying to reconnect to MQTT server...')
+        try:
+            self.client.reconnect()
+        except OSError as err:
+            logger.error('Error reconnecting to MQTT server: %s', err)
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._reconnect_handle is not None:
+            return
+        logger.info('Reconnecting to MQTT server in %.1f seconds', self._delay)
+        self._reconnect_handle = self._loop.call_later(self._delay,
+                                                       self._reconnect)
+        self._delay = min(2 * self._delay, self.max_delay)
+
+    def _schedule_misc(self):
+        if self._misc_handle is None:
+            self._misc_handle = self._loop.call_later(self.misc_interval,
+                                                      self._misc)
+
+    def _misc(self):
+        # Keepalive pings are sent from here
+        self._misc_handle = None
+        if self.client.is_connected():
+            self._delay = self.min_delay
+        self.client.loop_misc()
+        self._schedule_misc()
+
+    def _on_disconnect(self, client, userdata, rc):
+        if rc != 0:
+            logger.error('Lost connection to MQTT server (%d): %s',
+                         rc, paho.error_string(rc))
+            self._schedule_reconnect()
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop.add_reader(sock, self._read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._loop.add_writer(sock, self._write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.remove_writer(sock)
+
+    def _read(self):
+        self.client.loop_read()
+
+    def _write(self):
+        self.client.loop_write()
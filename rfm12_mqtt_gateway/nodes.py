@@ -1,51 +1,336 @@
+import ast
+import builtins
+import hashlib
+import json
+import marshal
+import os
 import struct
-import yaml
+import symtable
+import sys
 import logging
+from collections.abc import Mapping
+from .publishfilter import publish_policy
 logger = logging.getLogger(__name__)
 
+_ALLOWED_NAMES = frozenset(['x']) | frozenset(dir(builtins))
+
+# Compiled code of expressions, keyed by (source, filename), which can be
+# saved and loaded with the definitions cache
+_compiled = {}
+
+_CACHE_VERSION = 1
+
+# Batches of at least this many payloads are decoded with NumPy, if it is
+# installed and the node's expressions allow
+VECTORISE_MIN_BATCH = 128
+
+
+def compile_expression(source, filename='<expression>'):
+    """Compile an expression of `x` into a function.
+
+    The expression is parsed once here, so syntax errors are raised
+    immediately (as ValueError) rather than each time it is used.
+    """
+    code = _compiled.get((source, filename))
+    if code is None:
+        try:
+            ast.parse(source, filename, 'eval')
+        except SyntaxError as err:
+            raise ValueError("Invalid expression '{}' in {}: {}"
+                             .format(source, filename, err.msg))
+        # The source is known to be a single expression, so it is safe to
+        # wrap it in a lambda. Names other than `x` and builtins are looked
+        # up as globals and raise NameError when called, as with eval().
+        code = compile('lambda x: (\n{}\n)'.format(source), filename, 'eval')
+        _compiled[source, filename] = code
+    return eval(code, {})
+
+
+def compile_expressions(sources, filename='<expressions>'):
+    """Compile expressions of `x` into one function returning their values.
+
+    The function returns a list of the values of the expressions, which
+    is much faster than calling a function for each one. The expressions
+    should already have been checked by compile_expression.
+    """
+    text = _expressions_text(sources)
+    code = _compiled.get((text, filename))
+    if code is None:
+        code = compile(text, filename, 'eval')
+        _compiled[text, filename] = code
+    return eval(code, {})
+
+
+def _expressions_text(sources):
+    return 'lambda x: [\n{}]'.format(''.join('(\n{}\n),\n'.format(source)
+                                            for source in sources))
+
+
+def _keep_compiled(nodes):
+    """Forget compiled code not used by `nodes`, and return what is used"""
+    keys = set()
+    for node in nodes:
+        keys.update(node._code_keys())
+    for key in set(_compiled) - keys:
+        del _compiled[key]
+    return {key: _compiled[key] for key in keys if key in _compiled}
+
+
+def undefined_names(source):
+    """Return names used in expression `source` other than `x` and builtins.
+
+    Names bound within the expression, by comprehensions, lambdas and
+    assignment expressions, are allowed.
+    """
+    ast.parse(source, mode='eval')
+    # Names which aren't bound anywhere in the expression are globals
+    tables = [symtable.symtable('lambda x: (\n{}\n)'.format(source),
+                                '<expression>', 'eval')]
+    names = set()
+    while tables:
+        table = tables.pop()
+        tables.extend(table.get_children())
+        names.update(symbol.get_name() for symbol in table.get_symbols()
+                     if symbol.is_global() and symbol.is_referenced())
+    return sorted(names - _ALLOWED_NAMES)
+
+
+def frame_encoder(frame_format):
+    """Return a function to encode whole-frame messages in `frame_format`"""
+    if frame_format == 'json':
+        return json.dumps
+    elif frame_format == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            raise ValueError("Frame format 'msgpack' needs the msgpack "
+                             "package to be installed")
+        return msgpack.packb
+    elif frame_format == 'cbor':
+        try:
+            import cbor2
+        except ImportError:
+            raise ValueError("Frame format 'cbor' needs the cbor2 "
+                             "package to be installed")
+        return cbor2.dumps
+    raise ValueError("Unknown frame format '{}'".format(frame_format))
+
+
+class ChannelDefinition(object):
+    """A channel of a node: its position in the node's decoded values, the
+    expression giving its value, and its units and description."""
+    __slots__ = ('name', 'index', 'value', 'units', 'description', 'func')
+
+    def __init__(self, name, index, value, units='', description='',
+                 func=None):
+        self.name = name
+        self.index = index
+        self.value = value
+        self.units = units
+        self.description = description
+        self.func = func
+
+    def __repr__(self):
+        return '<ChannelDefinition {} {}>'.format(self.index, self.name)
+
+
+class DecodedFrame(Mapping):
+    """Values decoded from a frame.
+
+    This can be used as a read-only dict of channel name to value, but
+    only holds a list of the values, in the order of the node's channel
+    table.
+    """
+    __slots__ = ('node', 'data')
+
+    def __init__(self, node, data):
+        self.node = node
+        self.data = data
+
+    def __getitem__(self, name):
+        return self.data[self.node.channel_index[name]]
+
+    def __iter__(self):
+        return iter(self.node.channel_names)
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        return zip(self.node.channel_names, self.data)
+
+    def as_dict(self):
+        return dict(zip(self.node.channel_names, self.data))
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
 
 class NodeDefinition:
+    __slots__ = ('name', 'id', 'payload_format', 'channels', 'commands',
+                 'frame_format', 'publish_channels', 'channel_table',
+                 'channel_names', 'channel_index', 'publish_policies',
+                 '_vectorised', '_encode_frame', '_struct', '_decode',
+                 '_publish_templates', '_command_funcs')
+
     def __init__(self, name, node_id, payload_format,
-                 channels=None, commands=None):
+                 channels=None, commands=None, frame_format=None,
+                 publish_channels=True):
         self.name = name
         self.id = node_id
         self.payload_format = payload_format
         self.channels = channels if channels is not None else {}
         self.commands = commands if commands is not None else {}
+        self.frame_format = frame_format
+        self.publish_channels = publish_channels
 
-    def parse_values(self, values):
-        result = {}
+        # Created when first needed, as importing NumPy is slow
+        self._vectorised = None
+
+        self._encode_frame = (frame_encoder(frame_format)
+                              if frame_format is not None else None)
+
+        self._struct = struct.Struct('<' + payload_format)
+        self.channel_table = tuple(
+            ChannelDefinition(k, i, channel['value'],
+                              channel.get('units', ''),
+                              channel.get('description', ''),
+                              compile_expression(
+                                  channel['value'],
+                                  '<{} channel {}>'.format(name, k)))
+            for i, (k, channel) in enumerate(self.channels.items()))
+        self.channel_names = tuple(c.name for c in self.channel_table)
+        self.channel_index = {c.name: c.index for c in self.channel_table}
+        # All the channels are decoded by one function
+        self._decode = compile_expressions(
+            [c.value for c in self.channel_table],
+            '<{} channels>'.format(name))
+        # Everything in the published message except the time and value
+        self._publish_templates = {
+            c.name: ('{}/{}'.format(name, c.name),
+                     ', "units": {}, "description": {}}}'.format(
+                         json.dumps(c.units), json.dumps(c.description)))
+            for c in self.channel_table
+        }
+        self.publish_policies = {}
         for k, channel in self.channels.items():
             try:
-                logger.debug("eval '%s' with %s", channel['value'], values)
-                value = eval(channel['value'], dict(x=values))
-            except IndexError:
-                raise ValueError("Not enough values")
-            except NameError:
-                raise RuntimeError("Expression used name other than 'x'")
-            else:
-                result[k] = value
-        return result
-
-    def parse_payload(self, payload):
-        # Unpack the data
-        fmt = '<' + self.payload_format
-        expected_len = struct.calcsize(fmt)
-        if len(payload) != expected_len:
+                policy = publish_policy(channel)
+            except ValueError as err:
+                raise ValueError("Channel '{}' of node '{}': {}"
+                                 .format(k, name, err))
+            if policy is not None:
+                self.publish_policies[k] = policy
+        self._command_funcs = {
+            k: compile_expression(command['values'],
+                                  '<{} command {}>'.format(name, k))
+            for k, command in self.commands.items()
+        }
+
+    def _code_keys(self):
+        """Return the keys of this node's compiled code in `_compiled`"""
+        keys = [(c.value, '<{} channel {}>'.format(self.name, c.name))
+                for c in self.channel_table]
+        keys.append((_expressions_text([c.value for c in self.channel_table]),
+                     '<{} channels>'.format(self.name)))
+        keys.extend((command['values'],
+                     '<{} command {}>'.format(self.name, k))
+                    for k, command in self.commands.items())
+        return keys
+
+    def check_expressions(self):
+        """Raise ValueError if any expression uses names other than `x`"""
+        sources = ([('channel', k, c['value'])
+                    for k, c in self.channels.items()] +
+                   [('command', k, c['values'])
+                    for k, c in self.commands.items()])
+        for kind, k, source in sources:
+            names = undefined_names(source)
+            if names:
+                raise ValueError(
+                    "Expression for {} '{}' of node '{}' used name other "
+                    "than 'x': {}".format(kind, k, self.name,
+                                          ', '.join(names)))
+
+    def parse_values(self, values):
+        """Return a DecodedFrame of the channel values, given the values
+        unpacked from the payload"""
+        try:
+            return DecodedFrame(self, self._decode(values))
+        except IndexError:
+            raise ValueError("Not enough values")
+        except NameError:
+            raise RuntimeError("Expression used name other than 'x'")
+
+    @property
+    def payload_size(self):
+        return self._struct.size
+
+    def _check_payload_length(self, payload, offset=0):
+        if len(payload) - offset != self._struct.size:
             raise ValueError(
                 "Bad payload length (expected {} bytes for format '{}', got {}"
-                .format(expected_len, fmt, len(payload)))
-        data = struct.unpack(fmt, payload)
+                .format(self._struct.size, self._struct.format,
+                        len(payload) - offset))
+
+    def parse_payload(self, payload, offset=0):
+        """Parse the payload starting at `offset` in the buffer `payload`"""
+        # Unpack the data
+        self._check_payload_length(payload, offset)
+        data = self._struct.unpack_from(payload, offset)
         logger.debug("Node %d: parsed payload %s", self.id, data)
 
         # Process into final values dictionary
         return self.parse_values(data)
 
+    def parse_payloads(self, payloads):
+        """Parse a sequence of payloads, returning a list of values dicts.
+
+        The payloads are unpacked together, which is much faster than
+        calling parse_payload for each one. Large batches are decoded with
+        NumPy if it is installed (see vectorised.py); the results are the
+        same either way.
+        """
+        for payload in payloads:
+            self._check_payload_length(payload)
+        if not payloads or not self._struct.size:
+            return [self.parse_values(()) for payload in payloads]
+        if len(payloads) >= VECTORISE_MIN_BATCH:
+            if self._vectorised is None:
+                from .vectorised import decoder_for
+                self._vectorised = decoder_for(self) or False
+            if self._vectorised:
+                return self._vectorised.decode(payloads)
+        return [self.parse_values(data) for data in
+                self._struct.iter_unpack(b''.join(payloads))]
+
+    def format_messages(self, time, values):
+        """Return a list of (topic, payload) MQTT messages for `values`.
+
+        Each payload is the JSON object
+        {"at": time, "value": value, "units": ..., "description": ...}.
+        """
+        prefix = '{"at": ' + json.dumps(time) + ', "value": '
+        templates = self._publish_templates
+        messages = []
+        for k, v in values.items():
+            topic, suffix = templates[k]
+            messages.append((topic, prefix + json.dumps(v) + suffix))
+        return messages
+
+    def format_frame_message(self, time, values):
+        """Return a (topic, payload) message with all the frame's values.
+
+        The payload is {"at": time, "values": values}, encoded in the
+        node's frame format.
+        """
+        return self.name, self._encode_frame({'at': time,
+                                              'values': dict(values)})
+
     def encode_command(self, command_name, values):
         command = self.commands[command_name]
         try:
-            logger.debug("eval '%s' with %s", command['values'], values)
-            values = eval(command['values'], dict(x=values))
+            values = self._command_funcs[command_name](values)
         except IndexError:
             raise ValueError("Not enough values")
         except NameError:
@@ -64,8 +349,12 @@ class NodeDefinition:
     def __repr__(self):
         return "<NodeDefinition #{} {}>".format(self.id, self.name)
 
+    def _key(self):
+        return (self.name, self.id, self.payload_format, self.channels,
+                self.commands, self.frame_format, self.publish_channels)
+
     def __eq__(self, other):
-        return type(self) == type(other) and self.__dict__ == other.__dict__
+        return type(self) == type(other) and self._key() == other._key()
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -80,11 +369,100 @@ def _ensure_values_are_strings(channels):
     return channels
 
 
-def load_definitions_from_yaml(stream):
+def _reuse_or_create(previous, args, check=False):
+    """Return the node from `previous` (a dict by name) matching `args`,
+    or a new one"""
+    node = previous.get(args[0])
+    if node is not None and node._key() == args:
+        return node
+    node = NodeDefinition(*args)
+    if check:
+        node.check_expressions()
+    return node
+
+
+def load_definitions_from_yaml(stream, previous=None):
+    """Load node definitions from YAML.
+
+    All channel and command expressions are compiled and checked here, so
+    mistakes in the definitions are reported at startup.
+
+    If `previous` definitions are given, those which are unchanged are
+    reused rather than compiled again.
+    """
+    import yaml
     data = yaml.safe_load(stream)
-    return [
-        NodeDefinition(d['name'], d['node_id'], d['payload'],
-                       _ensure_values_are_strings(d.get('channels', {})),
-                       _ensure_values_are_strings(d.get('commands', {})))
-        for d in data
-    ]
+    previous = {node.name: node for node in (previous or [])}
+    nodes = []
+    for d in data:
+        args = (d['name'], d['node_id'], d['payload'],
+                _ensure_values_are_strings(d.get('channels', {})),
+                _ensure_values_are_strings(d.get('commands', {})),
+                d.get('frame_format'),
+                d.get('publish_channels', True))
+        nodes.append(_reuse_or_create(previous, args, check=True))
+
+    for attr in ('id', 'name'):
+        seen = set()
+        for node in nodes:
+            if getattr(node, attr) in seen:
+                raise ValueError("Duplicate node {} {!r}"
+                                 .format(attr, getattr(node, attr)))
+            seen.add(getattr(node, attr))
+    return nodes
+
+
+def _cache_key(text):
+    # Compiled code can only be loaded by the same Python version
+    return '{}:{}:{}'.format(_CACHE_VERSION, sys.implementation.cache_tag,
+                             hashlib.sha256(text).hexdigest())
+
+
+def load_definitions(path, cache_path=None, previous=None):
+    """Load node definitions from the YAML file at `path`.
+
+    If `cache_path` is given, the parsed definitions and compiled
+    expressions are saved there, and loaded from there next time as long
+    as the YAML file hasn't changed. This is much faster than parsing the
+    YAML and compiling the expressions again.
+    """
+    with open(path, 'rb') as f:
+        text = f.read()
+    key = _cache_key(text)
+
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                cache = marshal.load(f)
+            if cache['key'] == key:
+                _compiled.update(cache['code'])
+                previous = {node.name: node for node in (previous or [])}
+                nodes = [_reuse_or_create(previous, args)
+                         for args in cache['nodes']]
+                _keep_compiled(nodes)
+                logger.info('Loaded %d node definitions from cache %s',
+                            len(nodes), cache_path)
+                return nodes
+        except Exception as err:
+            logger.warning('Ignoring bad definitions cache %s: %s',
+                           cache_path, err)
+
+    nodes = load_definitions_from_yaml(text.decode('utf8'), previous)
+    # Code compiled for definitions which have changed isn't needed again
+    code = _keep_compiled(nodes)
+
+    if cache_path is not None:
+        cache = {
+            'key': key,
+            'nodes': [node._key() for node in nodes],
+            'code': code,
+        }
+        try:
+            data = marshal.dumps(cache)
+            with open(cache_path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(cache_path + '.tmp', cache_path)
+        except (ValueError, OSError) as err:
+            logger.warning('Could not save definitions cache %s: %s',
+                           cache_path, err)
+    return nodes
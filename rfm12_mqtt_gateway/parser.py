@@ -1,3 +1,4 @@
+from collections import OrderedDict
 import logging
 logger = logging.getLogger(__name__)
 
@@ -19,15 +20,19 @@ class FrameParser:
         """
         logger.debug("Frame: %s", f)
 
+        fields = f.split()
+
         # Just return command echos and responses
-        if f.strip().startswith(('>', '->')):
+        if fields and fields[0].startswith(('>', '->')):
             return None, f.strip().lstrip('>- ')
 
         # Try to process frame - expect space-separated integers
         try:
-            buffer = bytes([int(val) for val in f.strip().split()])
+            buffer = bytes(map(int, fields))
         except ValueError:
             raise ValueError("Misformed frame: %s" % f.strip())
+        if not buffer:
+            raise ValueError("Empty frame")
 
         # Look up node id
         node_id = buffer[0]
@@ -37,4 +42,59 @@ class FrameParser:
             logger.warning("Unknown node id %d" % node_id)
             return None, {}
 
-        return node, node.parse_payload(buffer[1:])
+        return node, node.parse_payload(buffer, 1)
+
+    def process_frames(self, frames):
+        """Process many frames of data at once.
+
+        frames is either a sequence of frame strings, as passed to
+        process_frame, or a bytes buffer of newline-separated frames.
+        Frames from the same node are unpacked together. Command echos,
+        misformed frames and frames from unknown nodes are skipped.
+
+        Returns a list of (node, results) pairs in order of each node's
+        first frame, where results is a list of (index, values_dict) and
+        index is the position of the frame in `frames`.
+        """
+        if isinstance(frames, (bytes, bytearray)):
+            frames = frames.decode('ascii').splitlines()
+
+        grouped = OrderedDict()
+        for i, f in enumerate(frames):
+            fields = f.split()
+            if not fields or fields[0].startswith(('>', '->')):
+                continue
+            try:
+                buffer = bytes(map(int, fields))
+            except ValueError:
+                logger.warning("Misformed frame: %s", f.strip())
+                continue
+            try:
+                indices, payloads = grouped[buffer[0]]
+            except KeyError:
+                if buffer[0] not in self.nodes:
+                    logger.warning("Unknown node id %d", buffer[0])
+                    continue
+                indices, payloads = grouped[buffer[0]] = [], []
+            indices.append(i)
+            payloads.append(buffer[1:])
+
+        results = []
+        for node_id, (indices, payloads) in grouped.items():
+            node = self.nodes[node_id]
+            size = node.payload_size
+            good = [k for k, p in enumerate(payloads) if len(p) == size]
+            if len(good) < len(payloads):
+                logger.warning("Node %d: skipped %d frames with bad length",
+                               node_id, len(payloads) - len(good))
+                indices = [indices[k] for k in good]
+                payloads = [payloads[k] for k in good]
+                if not payloads:
+                    continue
+            try:
+                values = node.parse_payloads(payloads)
+            except (ValueError, RuntimeError) as err:
+                logger.error("Node %d: error parsing frames: %s", node_id, err)
+                continue
+            results.append((node, list(zip(indices, values))))
+        return results
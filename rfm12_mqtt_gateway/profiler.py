@@ -0,0 +1,133 @@
+"""Sampling profiler which can be run in a live gateway.
+
+While running, a thread looks at the stacks of all the other threads
+every `interval` seconds and counts how often each stack is seen.
+Nothing is installed in the interpreter, so it costs nothing when it
+isn't running, and little when it is.
+
+The stacks are written in the "collapsed" format used by flamegraph.pl
+and speedscope: one line per stack, with frames from the thread name
+down to the running function separated by semicolons, then the count.
+"""
+
+from collections import Counter
+import logging
+import os
+import os.path
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _describe(code, cache):
+    try:
+        return cache[code]
+    except KeyError:
+        text = cache[code] = '{} ({}:{})'.format(
+            code.co_name, os.path.basename(code.co_filename),
+            code.co_firstlineno)
+        return text
+
+
+def _is_idle(code):
+    # The event loop waiting for something to do
+    return (code.co_name in ('select', 'poll') and
+            code.co_filename.endswith('selectors.py'))
+
+
+class SamplingProfiler(object):
+    """Sample the stacks of all threads every `interval` seconds.
+
+    `main_thread` is the ident of the thread summarised by summary(),
+    by default the one which created the profiler.
+    """
+    def __init__(self, interval=0.005, main_thread=None):
+        self.interval = interval
+        self.main_thread = (main_thread if main_thread is not None
+                            else threading.get_ident())
+        self.samples = 0
+        self.stacks = Counter()
+        # Samples of the main thread: [(codes from leaf to root)]
+        self._main_stacks = Counter()
+        self._names = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='sampling-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        names = self._names
+        while not self._stop.wait(self.interval):
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes = tuple(codes)
+                if ident == self.main_thread:
+                    self._main_stacks[codes] += 1
+                stack = ';'.join([thread_names.get(ident, str(ident))] +
+                                 [_describe(code, names)
+                                  for code in reversed(codes)])
+                self.stacks[stack] += 1
+            self.samples += 1
+            del frame
+
+    def collapsed(self):
+        """Return the stacks seen as lines of the collapsed format"""
+        return ['{} {}'.format(stack, n)
+                for stack, n in sorted(self.stacks.items())]
+
+    def write_collapsed(self, filename):
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'wt') as f:
+            f.write(''.join(line + '\n' for line in self.collapsed()))
+
+    def summary(self, n=10):
+        """Return a summary of where the main thread spent its time.
+
+        Functions are listed with the fraction of samples in which they
+        were running ('self') and anywhere on the stack ('total'), not
+        counting samples in which the event loop was idle.
+        """
+        own = Counter()
+        total = Counter()
+        busy = 0
+        for codes, count in self._main_stacks.items():
+            if not codes or _is_idle(codes[0]):
+                continue
+            busy += count
+            own[codes[0]] += count
+            for code in set(codes):
+                total[code] += count
+        samples = sum(self._main_stacks.values())
+        top = [{'function': _describe(code, self._names),
+                'self': round(count / busy, 4),
+                'total': round(total[code] / busy, 4)}
+               for code, count in own.most_common(n)]
+        return {
+            'samples': samples,
+            'busy': round(busy / samples, 4) if samples else None,
+            'top': top,
+        }
@@ -0,0 +1,101 @@
+from collections import namedtuple
+
+PublishPolicy = namedtuple('PublishPolicy',
+                           'on_change deadband min_interval max_silence')
+
+_POLICY_KEYS = ('publish_on_change', 'deadband', 'min_interval',
+                'max_silence')
+
+
+def publish_policy(channel):
+    """Return the PublishPolicy for a channel definition, or None.
+
+    The channel options are:
+
+    - publish_on_change: only publish when the value changes
+    - deadband: only publish when the value has changed by more than this
+      since it was last published (implies publish_on_change)
+    - min_interval: never publish more often than this (seconds)
+    - max_silence: always publish if nothing has been published for this
+      long (seconds), even if the value hasn't changed
+    """
+    if not any(k in channel for k in _POLICY_KEYS):
+        return None
+    numbers = {}
+    for k in _POLICY_KEYS[1:]:
+        value = channel.get(k)
+        if value is not None:
+            if not isinstance(value, (int, float)) or value < 0:
+                raise ValueError("'{}' must be a non-negative number, not {!r}"
+                                 .format(k, value))
+        numbers[k] = value
+    on_change = bool(channel.get('publish_on_change', False) or
+                     numbers['deadband'] is not None)
+    return PublishPolicy(on_change, numbers['deadband'] or 0,
+                         numbers['min_interval'] or 0,
+                         numbers['max_silence'])
+
+
+class _LastPublished(object):
+    __slots__ = ('value', 'time')
+
+    def __init__(self, value, time):
+        self.value = value
+        self.time = time
+
+
+def _changed(policy, last, value):
+    if not policy.on_change:
+        return True
+    if policy.deadband:
+        try:
+            return abs(value - last) > policy.deadband
+        except TypeError:
+            pass
+    return value != last
+
+
+class PublishFilter(object):
+    """Decide which decoded values to publish, using the channels' policies.
+
+    The last published value and time of each channel with a policy are
+    kept, keyed by node name and channel name.
+    """
+    def __init__(self):
+        self._last = {}
+
+    def __len__(self):
+        return len(self._last)
+
+    def forget(self, node_name):
+        """Forget the last values for a node"""
+        for key in [key for key in self._last if key[0] == node_name]:
+            del self._last[key]
+
+    def filter(self, node, values, now):
+        """Return the subset of `values` which should be published now"""
+        policies = node.publish_policies
+        if not policies:
+            return values
+        last_values = self._last
+        result = {}
+        for k, v in values.items():
+            policy = policies.get(k)
+            if policy is None:
+                result[k] = v
+                continue
+            key = (node.name, k)
+            last = last_values.get(key)
+            if last is None:
+                last_values[key] = _LastPublished(v, now)
+                result[k] = v
+                continue
+            elapsed = now - last.time
+            if ((policy.max_silence is not None and
+                 elapsed >= policy.max_silence) or
+                    (elapsed >= policy.min_interval and
+                     _changed(policy, last.value, v))):
+                last.value = v
+                last.time = now
+                result[k] = v
+        return result
@@ -0,0 +1,138 @@
+import os
+import os.path
+import struct
+from collections import OrderedDict, deque
+import logging
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop-oldest', 'coalesce', 'spill')
+
+# payload is bytes, topic length, payload length
+_RECORD_HEADER = struct.Struct('<?HI')
+
+
+class PublishQueue(object):
+    """Bounded queue of outgoing MQTT messages.
+
+    At most `maxlen` messages are kept in memory. What happens when the
+    queue is full depends on `policy`:
+
+    - 'drop-oldest': the oldest message is dropped.
+    - 'coalesce': only the latest message for each topic is kept, and if
+      there are still too many topics the oldest is dropped.
+    - 'spill': the oldest message is appended to a journal file at
+      `journal_path`. Messages in the journal are returned first, in
+      order, and the journal survives restarts. If the gateway stops
+      while the journal is being emptied, some messages may be sent
+      twice.
+    """
+    def __init__(self, maxlen=10000, policy='drop-oldest',
+                 journal_path=None):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy '{}'".format(policy))
+        if policy == 'spill' and journal_path is None:
+            raise ValueError("A journal path is needed to spill messages")
+        self.maxlen = maxlen
+        self.policy = policy
+        self.dropped = 0
+        if policy == 'coalesce':
+            self._messages = OrderedDict()
+        else:
+            self._messages = deque()
+
+        self._journal = None
+        self._journal_count = 0
+        self._journal_offset = 0
+        if policy == 'spill':
+            self._open_journal(journal_path)
+
+    def __len__(self):
+        return len(self._messages) + self._journal_count
+
+    def put(self, topic, payload):
+        messages = self._messages
+        if self.policy == 'coalesce':
+            if topic in messages:
+                del messages[topic]
+            elif len(messages) >= self.maxlen:
+                messages.popitem(last=False)
+                self.dropped += 1
+            messages[topic] = payload
+            return
+
+        if len(messages) >= self.maxlen:
+            oldest = messages.popleft()
+            if self.policy == 'spill':
+                self._spill(*oldest)
+            else:
+                self.dropped += 1
+        messages.append((topic, payload))
+
+    def get(self):
+        """Remove and return the oldest (topic, payload), or None"""
+        if self._journal_count:
+            return self._unspill()
+        if not self._messages:
+            return None
+        if self.policy == 'coalesce':
+            return self._messages.popitem(last=False)
+        return self._messages.popleft()
+
+    def _open_journal(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._journal = open(path, 'a+b')
+        self._journal.seek(0)
+        end = 0
+        while True:
+            header = self._journal.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            is_bytes, topic_len, payload_len = _RECORD_HEADER.unpack(header)
+            if len(self._journal.read(topic_len + payload_len)) < \
+                    topic_len + payload_len:
+                break
+            self._journal_count += 1
+            end = self._journal.tell()
+        if self._journal.seek(0, os.SEEK_END) > end:
+            # Part of a record written when the gateway stopped: remove
+            # it, or messages spilled after it couldn't be read
+            logger.warning('Removing incomplete message from journal %s',
+                           path)
+            self._journal.truncate(end)
+            self._journal.flush()
+        if self._journal_count:
+            logger.info('%d messages waiting in journal %s',
+                        self._journal_count, path)
+
+    def _spill(self, topic, payload):
+        is_bytes = isinstance(payload, bytes)
+        topic = topic.encode('utf8')
+        if not is_bytes:
+            payload = payload.encode('utf8')
+        self._journal.seek(0, os.SEEK_END)
+        self._journal.write(_RECORD_HEADER.pack(is_bytes, len(topic),
+                                                len(payload)))
+        self._journal.write(topic)
+        self._journal.write(payload)
+        self._journal.flush()
+        self._journal_count += 1
+
+    def _unspill(self):
+        journal = self._journal
+        journal.seek(self._journal_offset)
+        is_bytes, topic_len, payload_len = _RECORD_HEADER.unpack(
+            journal.read(_RECORD_HEADER.size))
+        topic = journal.read(topic_len).decode('utf8')
+        payload = journal.read(payload_len)
+        if not is_bytes:
+            payload = payload.decode('utf8')
+        self._journal_offset = journal.tell()
+        self._journal_count -= 1
+        if not self._journal_count:
+            journal.truncate(0)
+            journal.flush()
+            self._journal_offset = 0
+        return topic, payload
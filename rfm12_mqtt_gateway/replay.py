@@ -0,0 +1,171 @@
+"""Replay frame logs through the frame parser.
+
+Frames are read from text frame logs or archives, decoded with the
+current node definitions and written to stdout, a CSV file or MQTT.
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime
+
+from .parser import FrameParser
+from .nodes import load_definitions_from_yaml
+from .archive import FrameArchiveReader
+from .sinks import Sink, StdoutSink, CSVSink
+
+logger = logging.getLogger(__name__)
+
+
+def read_frame_log(filenames):
+    """Yield (time, frame) from text frame logs and archive files"""
+    for fn in filenames:
+        if fn.endswith('.rfa'):
+            for record in FrameArchiveReader(fn).query():
+                yield record
+        else:
+            with open(fn, 'rt') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split(' ', 1)
+                    if len(parts) == 2:
+                        yield parts[0], parts[1]
+
+
+def decode_frames(parser, records, batch_size=1000):
+    """Yield (time, node, values) for each frame in `records`.
+
+    Frames are decoded in batches with FrameParser.process_frames, and
+    returned in their original order.
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            for result in _decode_batch(parser, batch):
+                yield result
+            batch = []
+    for result in _decode_batch(parser, batch):
+        yield result
+
+
+def _decode_batch(parser, batch):
+    decoded = [None] * len(batch)
+    for node, results in parser.process_frames([f for t, f in batch]):
+        for i, values in results:
+            decoded[i] = (batch[i][0], node, values)
+    return [d for d in decoded if d is not None]
+
+
+def parse_time(t):
+    if '.' in t:
+        return datetime.strptime(t, '%Y-%m-%dT%H:%M:%S.%f')
+    return datetime.strptime(t, '%Y-%m-%dT%H:%M:%S')
+
+
+def pace(decoded, speed):
+    """Delay items so they are yielded `speed` times faster than real time"""
+    start_clock = start_time = None
+    for item in decoded:
+        t = parse_time(item[0])
+        if start_time is None:
+            start_clock, start_time = time.monotonic(), t
+        else:
+            delay = ((t - start_time).total_seconds() / speed -
+                     (time.monotonic() - start_clock))
+            if delay > 0:
+                time.sleep(delay)
+        yield item
+
+
+def report_throughput(decoded, interval=5.0):
+    """Pass items through, logging the rate at which they go by"""
+    count = 0
+    start = last_report = time.monotonic()
+    for item in decoded:
+        yield item
+        count += 1
+        if count % 1000 == 0:
+            now = time.monotonic()
+            if now - last_report >= interval:
+                logger.info("%d frames, %.0f frames/sec",
+                            count, count / (now - start))
+                last_report = now
+    elapsed = time.monotonic() - start
+    logger.info("Finished: %d frames in %.1f s (%.0f frames/sec)",
+                count, elapsed, count / elapsed if elapsed else 0)
+
+
+class ReplayMQTTSink(Sink):
+    """Publish decoded values with a separate, threaded MQTT client"""
+    def __init__(self, host, port=1883):
+        import paho.mqtt.client as paho
+        self.client = paho.Client()
+        self.client.connect(host, port)
+        self.client.loop_start()
+        self._last = None
+
+    def write(self, records):
+        for t, node, values, received in records:
+            for topic, payload in node.format_messages(t, values):
+                self._last = self.client.publish(topic, payload)
+
+    def close(self):
+        if self._last is not None:
+            self._last.wait_for_publish()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+def replay(filenames, nodes, sink, speed=None, batch_size=500):
+    """Decode frames from `filenames` and write them to `sink`"""
+    decoded = decode_frames(FrameParser(nodes), read_frame_log(filenames))
+    if speed is not None:
+        decoded = pace(decoded, speed)
+        batch_size = 1
+    try:
+        batch = []
+        for t, node, values in report_throughput(decoded):
+            batch.append((t, node, values, time.perf_counter()))
+            if len(batch) >= batch_size:
+                sink.write(batch)
+                batch = []
+        if batch:
+            sink.write(batch)
+    finally:
+        sink.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay frame logs')
+    parser.add_argument('files', nargs='+',
+                        help='frame log files (.txt or .rfa)')
+    parser.add_argument('-n', '--nodes', default='nodes.yaml',
+                        help='node definitions file')
+    parser.add_argument('-o', '--output', default='stdout',
+                        choices=['stdout', 'csv', 'mqtt'])
+    parser.add_argument('--csv-file', default='replay.csv')
+    parser.add_argument('--mqtt-host', default='localhost')
+    parser.add_argument('-s', '--speed', type=float,
+                        help='replay at this multiple of real time '
+                        '(default: as fast as possible)')
+    parser.add_argument('-L', '--log-level', default='info')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, args.log_level.upper()),
+        format="%(asctime)s %(name)s [%(levelname)s] %(message)s")
+
+    with open(args.nodes, 'rt') as f:
+        nodes = load_definitions_from_yaml(f.read())
+
+    if args.output == 'csv':
+        sink = CSVSink(args.csv_file, append=False)
+    elif args.output == 'mqtt':
+        sink = ReplayMQTTSink(args.mqtt_host)
+    else:
+        sink = StdoutSink()
+    replay(args.files, nodes, sink, args.speed)
+
+
+if __name__ == '__main__':
+    main()
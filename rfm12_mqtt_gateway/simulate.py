@@ -0,0 +1,351 @@
+"""Load test the gateway without a radio or MQTT server.
+
+A pseudo-terminal stands in for the radio's serial port, writing
+synthetic frames for every node in a nodes.yaml file at a chosen rate,
+optionally in bursts and with some malformed and unknown-node frames
+mixed in. An in-process stand-in for the MQTT client accepts everything
+the gateway publishes.
+
+The gateway is run at each rate in turn, reporting the frames decoded,
+messages published, serial-to-publish latency and memory use, so the
+rate at which it stops keeping up can be found. The simulated radio
+runs in the same event loop as the gateway, so when the loop is busy it
+can't write frames as fast as asked; this also counts as not keeping
+up.
+
+    rfm12-mqtt-simulate -n nodes.yaml --rates 10,100,1000 --duration 10
+"""
+
+import argparse
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tty
+
+from .nodes import load_definitions
+
+logger = logging.getLogger(__name__)
+
+
+def make_frame(node, rng):
+    """Return a frame string for `node` with a random payload"""
+    payload = [rng.randrange(256) for i in range(node.payload_size)]
+    return ' '.join(str(b) for b in [node.id] + payload)
+
+
+class FrameGenerator(object):
+    """Synthetic frames from randomly chosen nodes.
+
+    A fraction `malformed` of frames have the wrong payload length or
+    aren't numbers, and a fraction `unknown` come from node ids which
+    aren't defined.
+    """
+    def __init__(self, nodes, malformed=0.0, unknown=0.0, seed=0):
+        self.nodes = list(nodes)
+        self.malformed = malformed
+        self.unknown = unknown
+        self._rng = random.Random(seed)
+        known = set(node.id for node in self.nodes)
+        self._unknown_ids = [i for i in range(1, 31) if i not in known]
+
+    def frame(self):
+        """Return (kind, frame), where kind is good, malformed or unknown"""
+        rng = self._rng
+        x = rng.random()
+        if x < self.malformed:
+            node = rng.choice(self.nodes)
+            if rng.random() < 0.5:
+                return 'malformed', make_frame(node, rng) + ' 1'
+            return 'malformed', '{} ?? garbage'.format(node.id)
+        if x < self.malformed + self.unknown and self._unknown_ids:
+            return 'unknown', '{} 1 2 3'.format(
+                rng.choice(self._unknown_ids))
+        return 'good', make_frame(rng.choice(self.nodes), rng)
+
+
+class SerialSimulator(object):
+    """Write frames to a pseudo-terminal, as the radio would.
+
+    Every `burst / rate` seconds, `burst` frames are written at once. If
+    the reader falls so far behind that the terminal's buffer is full,
+    frames are lost, like a serial port overrun; these are counted in
+    `overruns`.
+    """
+    def __init__(self, loop, generator, rate=10.0, burst=1):
+        self._loop = loop
+        self.generator = generator
+        self.rate = rate
+        self.burst = burst
+        self.counts = {'good': 0, 'malformed': 0, 'unknown': 0}
+        self.overruns = 0
+        self._handle = None
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        flags = fcntl.fcntl(self._master, fcntl.F_GETFL)
+        fcntl.fcntl(self._master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.port = os.ttyname(self._slave)
+
+    def start(self):
+        self._next = self._loop.time()
+        self._tick()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def close(self):
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _tick(self):
+        frames = []
+        for i in range(self.burst):
+            kind, frame = self.generator.frame()
+            frames.append(frame)
+            self.counts[kind] += 1
+        self.write(frames)
+
+        # Keep to the schedule even if a tick is late
+        self._next += self.burst / float(self.rate)
+        self._handle = self._loop.call_at(max(self._next, self._loop.time()),
+                                          self._tick)
+
+    def write(self, frames):
+        """Write lines to the port now, as if received by the radio"""
+        data = ''.join(frame + '\r\n' for frame in frames).encode('ascii')
+        try:
+            written = os.write(self._master, data)
+        except BlockingIOError:
+            written = 0
+        if written < len(data):
+            # Count frames not completely written, and finish the line
+            # so the next frame isn't mangled
+            self.overruns += data[written:].count(b'\n')
+            try:
+                os.write(self._master, b'\r\n')
+            except BlockingIOError:
+                pass
+
+    def read(self):
+        """Return the text written to the port since the last read"""
+        data = b''
+        while True:
+            try:
+                chunk = os.read(self._master, 4096)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        return data.decode('ascii')
+
+
+class FakeMQTTClient(object):
+    """In-process stand-in for paho's Client, for testing.
+
+    It connects straight away, and every published message is counted
+    and acknowledged with on_publish, as if it had been sent.
+    inject() delivers a message to on_message as if it came from the
+    server.
+    """
+    def __init__(self, loop):
+        self._loop = loop
+        self.on_connect = None
+        self.on_message = None
+        self.on_publish = None
+        self.connected = False
+        self.subscriptions = []
+        self.published = 0
+        self.published_bytes = 0
+        self.last_messages = {}
+        self._mid = 0
+
+    def connect(self, host, port=1883, keepalive=60):
+        self._loop.call_soon(self._connected)
+
+    def _connected(self):
+        self.connected = True
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+
+    def disconnect(self):
+        self.connected = False
+
+    def is_connected(self):
+        return self.connected
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self._mid += 1
+        self.published += 1
+        self.published_bytes += len(payload or '')
+        self.last_messages[topic] = payload
+        if self.on_publish is not None:
+            self._loop.call_soon(self.on_publish, self, None, self._mid)
+        return self._mid
+
+    def inject(self, topic, payload):
+        if isinstance(payload, str):
+            payload = payload.encode('utf8')
+        message = Message(topic, payload)
+        if self.on_message is not None:
+            self.on_message(self, None, message)
+
+
+class Message(object):
+    __slots__ = ('topic', 'payload')
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def rss_bytes():
+    """Return the resident memory of this process, if known"""
+    try:
+        with open('/proc/self/statm', 'rt') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def run_load_test(nodes_path, rates, duration=10.0, burst=1, malformed=0.0,
+                  unknown=0.0, stop_when_behind=True, workdir=None):
+    """Run the gateway at each frame rate, and return a list of results"""
+    from .gateway import EmonMQTTGateway
+    from .metrics import Histogram
+
+    loop = asyncio.get_event_loop()
+    own_workdir = workdir is None
+    if own_workdir:
+        workdir = tempfile.mkdtemp()
+    generator = FrameGenerator(load_definitions(nodes_path), malformed,
+                               unknown)
+    simulator = SerialSimulator(loop, generator, burst=burst)
+    client = FakeMQTTClient(loop)
+    gateway = EmonMQTTGateway(
+        loop, nodes_path=nodes_path, reload_interval=0,
+        metrics_interval=3600.0,
+        radios=[{'name': 'simulated', 'port': simulator.port}],
+        frame_log_path=os.path.join(workdir, 'frame_log'),
+        journal_path=os.path.join(workdir, 'publish_journal'),
+        mqtt_client=client)
+    task = loop.create_task(gateway.run_input())
+    metrics = gateway.metrics
+
+    results = []
+    try:
+        # Let the gateway open the port and connect
+        loop.run_until_complete(asyncio.sleep(0.5))
+        if task.done():
+            task.result()
+        for rate in rates:
+            simulator.rate = rate
+            before = (dict(simulator.counts), simulator.overruns,
+                      metrics.frames_decoded, client.published)
+            metrics.serial_to_publish = Histogram()
+            simulator.start()
+            loop.run_until_complete(asyncio.sleep(duration))
+            simulator.stop()
+            # Give the gateway a moment to catch up with what was sent
+            loop.run_until_complete(asyncio.sleep(min(1.0, duration)))
+
+            counts, overruns, decoded, published = before
+            good = simulator.counts['good'] - counts['good']
+            emitted = sum(simulator.counts.values()) - sum(counts.values())
+            result = {
+                'rate': rate,
+                'frames_emitted': emitted,
+                'frames_lost': simulator.overruns - overruns,
+                'frames_decoded': metrics.frames_decoded - decoded,
+                'messages_published': client.published - published,
+                'publish_backlog': len(gateway.publish_queue),
+                'serial_to_publish': metrics.serial_to_publish.as_dict(),
+                'rss_bytes': rss_bytes(),
+            }
+            # The simulator shares the event loop with the gateway, so
+            # falling short of the rate means the loop is saturated
+            result['keeping_up'] = (
+                result['frames_lost'] == 0 and
+                result['frames_decoded'] >= 0.99 * good and
+                emitted >= 0.95 * rate * duration)
+            results.append(result)
+            logger.info('Rate %s: %s', rate, result)
+            if stop_when_behind and not result['keeping_up']:
+                break
+    finally:
+        task.cancel()
+        loop.run_until_complete(asyncio.wait([task]))
+        # Let the port readers finish and close the frame logs
+        loop.run_until_complete(asyncio.sleep(0.1))
+        simulator.close()
+        if own_workdir:
+            shutil.rmtree(workdir)
+    return results
+
+
+def print_results(results, stream=sys.stdout):
+    stream.write('{:>8} {:>9} {:>7} {:>9} {:>10} {:>8} {:>8} {:>8} {:>8}\n'
+                 .format('rate', 'emitted', 'lost', 'decoded', 'published',
+                         'p50 ms', 'p99 ms', 'RSS MB', 'ok'))
+    for r in results:
+        latency = r['serial_to_publish']
+        stream.write(
+            '{:>8} {:>9} {:>7} {:>9} {:>10} {:>8} {:>8} {:>8} {:>8}\n'.format(
+                r['rate'], r['frames_emitted'], r['frames_lost'],
+                r['frames_decoded'], r['messages_published'],
+                _ms(latency['p50']), _ms(latency['p99']),
+                '{:.1f}'.format(r['rss_bytes'] / 1e6)
+                if r['rss_bytes'] is not None else '-',
+                'yes' if r['keeping_up'] else 'NO'))
+
+
+def _ms(seconds):
+    return '-' if seconds is None else '{:.1f}'.format(1000 * seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='load test the gateway with a simulated radio')
+    parser.add_argument('-n', '--nodes', default='nodes.yaml',
+                        help='node definitions file')
+    parser.add_argument('--rates', default='10,100,1000',
+                        help='comma-separated frame rates (per second)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds to run at each rate')
+    parser.add_argument('--burst', type=int, default=1,
+                        help='frames written at once')
+    parser.add_argument('--malformed', type=float, default=0.01,
+                        help='fraction of malformed frames')
+    parser.add_argument('--unknown', type=float, default=0.01,
+                        help='fraction of frames from unknown nodes')
+    parser.add_argument('--keep-going', action='store_true',
+                        help="carry on after the gateway can't keep up")
+    parser.add_argument('--json', help='save results to this JSON file')
+    parser.add_argument('-L', '--log-level', default='warning')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+    results = run_load_test(
+        args.nodes, [float(r) for r in args.rates.split(',')],
+        args.duration, args.burst, args.malformed, args.unknown,
+        not args.keep_going)
+    print_results(results)
+    if args.json:
+        with open(args.json, 'wt') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""Outputs for decoded frames.
+
+A sink receives lists of records (time, node, values, received), where
+`time` is the ISO format timestamp of the frame and `received` is the
+perf_counter() time it was read from the serial port.
+
+In the gateway each sink is fed by a SinkRunner, which keeps a bounded
+queue of records for it. Sinks which may block (files, databases) are
+written from their own worker thread, so a slow sink can't hold up the
+serial port or the other sinks.
+"""
+
+import csv
+import json
+import logging
+import sqlite3
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from .framing import iso_to_timestamp
+from .store import TimeSeriesStore
+
+logger = logging.getLogger(__name__)
+
+
+class Sink(object):
+    #: Whether write() may block, and so must run in a worker thread
+    blocking = True
+
+    def write(self, records):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MQTTSink(Sink):
+    """Publish decoded values through the gateway's publish queue"""
+    blocking = False
+
+    def __init__(self, publish_queue, publish_filter, flush, metrics=None):
+        self.publish_queue = publish_queue
+        self.publish_filter = publish_filter
+        self.flush = flush
+        self.metrics = metrics
+
+    def write(self, records):
+        queue = self.publish_queue
+        for t, node, values, received in records:
+            if node.frame_format is not None:
+                queue.put(*node.format_frame_message(t, values))
+            if node.publish_channels:
+                values = self.publish_filter.filter(node, values, received)
+                for topic, payload in node.format_messages(t, values):
+                    logger.debug('Publishing [%s] %s', topic, payload)
+                    queue.put(topic, payload)
+        self.flush()
+        if self.metrics is not None:
+            now = perf_counter()
+            for record in records:
+                self.metrics.serial_to_publish.add(now - record[3])
+
+
+class StdoutSink(Sink):
+    """Write "topic payload" lines, as they would be published"""
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+
+    def write(self, records):
+        self.stream.write(''.join(
+            '{} {}\n'.format(topic, payload)
+            for t, node, values, received in records
+            for topic, payload in node.format_messages(t, values)))
+        self.stream.flush()
+
+
+class CSVSink(Sink):
+    """Write rows of time, node, channel, value to a CSV file"""
+    def __init__(self, path, append=True):
+        self.file = open(path, 'at' if append else 'wt', newline='')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(['time', 'node', 'channel', 'value'])
+
+    def write(self, records):
+        self.writer.writerows([(t, node.name, k, v)
+                               for t, node, values, received in records
+                               for k, v in values.items()])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _escape_key(s):
+    return (s.replace('\\', '\\\\').replace(',', '\\,')
+            .replace('=', '\\=').replace(' ', '\\ '))
+
+
+def _field_value(v):
+    if isinstance(v, bool):
+        return 'true' if v else 'false'
+    if isinstance(v, int):
+        return '{}i'.format(v)
+    if isinstance(v, float):
+        return repr(v)
+    return json.dumps(str(v))
+
+
+class LineProtocolSink(Sink):
+    """Write InfluxDB line protocol, one line per frame"""
+    def __init__(self, path, measurement='rfm12'):
+        self.file = open(path, 'at')
+        self.measurement = _escape_key(measurement)
+
+    def write(self, records):
+        lines = []
+        for t, node, values, received in records:
+            if not values:
+                continue
+            fields = ','.join('{}={}'.format(_escape_key(k), _field_value(v))
+                              for k, v in sorted(values.items()))
+            lines.append('{},node={} {} {}\n'.format(
+                self.measurement, _escape_key(node.name), fields,
+                int(round(iso_to_timestamp(t) * 1e9))))
+        self.file.write(''.join(lines))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SQLiteSink(Sink):
+    """Store samples in a local SQLite database.
+
+    The table is samples(time, node, channel, value), where time is in
+    seconds since the epoch.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    def _connect(self):
+        # Connect in the thread which writes
+        db = sqlite3.connect(self.path)
+        db.execute('CREATE TABLE IF NOT EXISTS samples '
+                   '(time REAL, node TEXT, channel TEXT, value)')
+        db.execute('CREATE INDEX IF NOT EXISTS samples_node_channel_time '
+                   'ON samples (node, channel, time)')
+        return db
+
+    def write(self, records):
+        if self._db is None:
+            self._db = self._connect()
+        with self._db:
+            self._db.executemany(
+                'INSERT INTO samples VALUES (?, ?, ?, ?)',
+                [(iso_to_timestamp(t), node.name, k, v)
+                 for t, node, values, received in records
+                 for k, v in values.items()
+                 if v is None or isinstance(v, (int, float, str))])
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class StoreSink(Sink):
+    """Keep recent history of numeric values in a TimeSeriesStore.
+
+    The store is memory-mapped, so writing doesn't block and queries can
+    be answered from the event loop.
+    """
+    blocking = False
+
+    def __init__(self, path, sizes=None):
+        self.store = TimeSeriesStore(path, sizes)
+
+    def write(self, records):
+        store = self.store
+        for t, node, values, received in records:
+            timestamp = iso_to_timestamp(t)
+            for k, v in values.items():
+                store.add(node.name, k, timestamp, v)
+
+    def close(self):
+        self.store.close()
+
+
+class SinkRunner(object):
+    """Feed a sink from a bounded queue of records.
+
+    Records are written in batches of up to `batch_size`, either in the
+    event loop (for non-blocking sinks) or in a worker thread. If
+    `maxsize` records are already waiting, new ones are dropped.
+    """
+    def __init__(self, name, sink, loop, maxsize=10000, batch_size=500):
+        self.name = name
+        self.sink = sink
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._loop = loop
+        self._queue = deque()
+        self._busy = False
+        self._executor = ThreadPoolExecutor(1) if sink.blocking else None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, record):
+        if len(self._queue) >= self.maxsize:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning("Sink '%s' is falling behind, %d records "
+                               "dropped", self.name, self.dropped)
+            return
+        self._queue.append(record)
+        if not self._busy:
+            self._busy = True
+            self._loop.call_soon(self._run)
+
+    def _run(self):
+        queue = self._queue
+        batch = [queue.popleft()
+                 for i in range(min(len(queue), self.batch_size))]
+        if not batch:
+            self._busy = False
+            return
+        if self._executor is None:
+            self._write(batch)
+            self._loop.call_soon(self._run)
+        else:
+            future = self._loop.run_in_executor(self._executor, self._write,
+                                                batch)
+            future.add_done_callback(lambda f: self._run())
+
+    def _write(self, batch):
+        try:
+            self.sink.write(batch)
+        except Exception:
+            logger.exception("Error writing %d records to sink '%s'",
+                             len(batch), self.name)
+
+    def close(self):
+        """Write the records still queued, then close the sink"""
+        queue = self._queue
+        batches = []
+        while queue:
+            batches.append([queue.popleft()
+                            for i in range(min(len(queue), self.batch_size))])
+        if self._executor is not None:
+            for batch in batches:
+                self._executor.submit(self._write, batch)
+            self._executor.submit(self.sink.close)
+            self._executor.shutdown()
+        else:
+            for batch in batches:
+                self._write(batch)
+            self.sink.close()
+
+
+SINK_TYPES = {
+    'stdout': StdoutSink,
+    'csv': CSVSink,
+    'line_protocol': LineProtocolSink,
+    'sqlite': SQLiteSink,
+    'store': StoreSink,
+}
+
+
+def create_sink(config):
+    """Create a sink from a config dict with 'type' and its options.
+
+    MQTT sinks need parts of the gateway, so are created by the gateway.
+    """
+    options = dict(config)
+    sink_type = options.pop('type')
+    options.pop('queue_size', None)
+    try:
+        cls = SINK_TYPES[sink_type]
+    except KeyError:
+        raise ValueError("Unknown sink type '{}'".format(sink_type))
+    return cls(**options)
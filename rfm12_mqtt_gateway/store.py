@@ -0,0 +1,220 @@
+"""Rolling store of recent decoded values.
+
+Each node channel has its own file of fixed size, holding ring buffers
+of the most recent raw samples and of min/mean/max rollups at 1 minute,
+1 hour and 1 day resolution. The files are memory-mapped, so writing a
+sample is only a few memory writes and the history survives restarts,
+and the oldest entries are overwritten so the disk and memory used stay
+the same however long the gateway runs.
+
+Only numeric values are stored. Values which aren't finite are kept as
+raw samples (and returned as None) but left out of the rollups, as are
+samples older than the latest rollup bucket.
+"""
+
+import logging
+import math
+import mmap
+import os
+import struct
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Resolutions of rollups, and the default number kept of each
+RESOLUTIONS = [('1m', 60), ('1h', 3600), ('1d', 86400)]
+DEFAULT_SIZES = {'raw': 4096, '1m': 1440, '1h': 2160, '1d': 1000}
+
+_MAGIC = b'RFTS'
+_VERSION = 1
+# magic, version, then the capacity of the raw and each rollup ring
+_HEADER = struct.Struct('<4sI' + 'I' * (1 + len(RESOLUTIONS)))
+# time, value
+_SAMPLE = struct.Struct('<dd')
+# bucket start time, count, min, max, sum
+_BUCKET = struct.Struct('<dIddd')
+
+
+class _Ring(object):
+    """Fixed number of records in a buffer, overwriting the oldest"""
+    _STATE = struct.Struct('<II')
+
+    def __init__(self, buf, offset, record, capacity):
+        self.buf = buf
+        self.offset = offset
+        self.record = record
+        self.capacity = capacity
+        self._data = offset + self._STATE.size
+        self.next, self.count = self._STATE.unpack_from(buf, offset)
+        if self.next >= capacity or self.count > capacity:
+            self.next = self.count = 0
+
+    @classmethod
+    def nbytes(cls, record, capacity):
+        return cls._STATE.size + record.size * capacity
+
+    def _position(self, i):
+        return self._data + self.record.size * i
+
+    def append(self, *values):
+        self.record.pack_into(self.buf, self._position(self.next), *values)
+        self.next = (self.next + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        self._STATE.pack_into(self.buf, self.offset, self.next, self.count)
+
+    def last(self):
+        if not self.count:
+            return None
+        i = (self.next - 1) % self.capacity
+        return self.record.unpack_from(self.buf, self._position(i))
+
+    def replace_last(self, *values):
+        i = (self.next - 1) % self.capacity
+        self.record.pack_into(self.buf, self._position(i), *values)
+
+    def items(self):
+        """Return the records, oldest first"""
+        start = (self.next - self.count) % self.capacity
+        unpack = self.record.unpack_from
+        return [unpack(self.buf, self._position((start + i) % self.capacity))
+                for i in range(self.count)]
+
+
+class _Series(object):
+    """Ring buffers of samples and rollups for one channel, in one file"""
+    def __init__(self, filename, sizes):
+        capacities = [sizes['raw']] + [sizes[k] for k, r in RESOLUTIONS]
+        header = _HEADER.pack(_MAGIC, _VERSION, *capacities)
+        length = (_HEADER.size +
+                  _Ring.nbytes(_SAMPLE, capacities[0]) +
+                  sum(_Ring.nbytes(_BUCKET, n) for n in capacities[1:]))
+
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.read(fd, _HEADER.size)
+            if existing != header:
+                if existing:
+                    logger.warning('Layout of %s has changed, starting it '
+                                   'again', filename)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, length)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, header)
+            self.mmap = mmap.mmap(fd, length)
+        finally:
+            os.close(fd)
+
+        offset = _HEADER.size
+        self.raw = _Ring(self.mmap, offset, _SAMPLE, capacities[0])
+        offset += _Ring.nbytes(_SAMPLE, capacities[0])
+        self.rollups = []
+        for (name, seconds), n in zip(RESOLUTIONS, capacities[1:]):
+            self.rollups.append((name, seconds,
+                                 _Ring(self.mmap, offset, _BUCKET, n)))
+            offset += _Ring.nbytes(_BUCKET, n)
+
+    def add(self, time, value):
+        self.raw.append(time, value)
+        if not math.isfinite(value):
+            return
+        for name, seconds, ring in self.rollups:
+            start = math.floor(time / seconds) * seconds
+            last = ring.last()
+            if last is not None and start < last[0]:
+                # Rollups only move forward
+                continue
+            if last is not None and last[0] == start:
+                t, n, lo, hi, total = last
+                ring.replace_last(start, n + 1, min(lo, value),
+                                  max(hi, value), total + value)
+            else:
+                ring.append(start, 1, value, value, value)
+
+    def query(self, resolution):
+        if resolution == 'raw':
+            return [[t, v if math.isfinite(v) else None]
+                    for t, v in self.raw.items()]
+        for name, seconds, ring in self.rollups:
+            if name == resolution:
+                return [[t, lo, total / n, hi, n]
+                        for t, n, lo, hi, total in ring.items()]
+        raise ValueError("Unknown resolution '{}'".format(resolution))
+
+    def close(self):
+        self.mmap.close()
+
+
+class TimeSeriesStore(object):
+    """Recent history of node channels, in files in directory `path`.
+
+    `sizes` gives the number of entries kept for 'raw' samples and each
+    rollup resolution; see DEFAULT_SIZES.
+    """
+    COLUMNS = {
+        'raw': ['time', 'value'],
+        'rollup': ['time', 'min', 'mean', 'max', 'count'],
+    }
+
+    def __init__(self, path, sizes=None):
+        self.path = path
+        self.sizes = dict(DEFAULT_SIZES)
+        if sizes is not None:
+            unknown = set(sizes) - set(DEFAULT_SIZES)
+            if unknown:
+                raise ValueError('Unknown store sizes: {}'
+                                 .format(', '.join(sorted(unknown))))
+            self.sizes.update(sizes)
+        self._series = {}
+        os.makedirs(path, exist_ok=True)
+
+    def _filename(self, node_name, channel):
+        return os.path.join(self.path, quote(
+            '{}/{}'.format(node_name, channel), safe='') + '.ts')
+
+    def _get(self, node_name, channel, create):
+        key = (node_name, channel)
+        series = self._series.get(key)
+        if series is None:
+            filename = self._filename(node_name, channel)
+            if not create and not os.path.exists(filename):
+                return None
+            series = self._series[key] = _Series(filename, self.sizes)
+        return series
+
+    def add(self, node_name, channel, time, value):
+        """Add a sample of `channel` at `time` (seconds since the epoch)"""
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return
+        self._get(node_name, channel, True).add(time, float(value))
+
+    def query(self, node_name, channel, resolution='raw', start=None,
+              end=None, limit=None):
+        """Return stored history of a channel, oldest first.
+
+        Raw samples are [time, value] and rollups are [time, min, mean,
+        max, count], where time is the start of the bucket. Raises
+        KeyError if nothing is stored for the channel.
+        """
+        series = self._get(node_name, channel, False)
+        if series is None:
+            raise KeyError('Nothing stored for {} {}'.format(node_name,
+                                                             channel))
+        rows = series.query(resolution)
+        if start is not None:
+            rows = [row for row in rows if row[0] >= start]
+        if end is not None:
+            rows = [row for row in rows if row[0] < end]
+        if limit is not None:
+            rows = rows[-limit:] if limit > 0 else []
+        return rows
+
+    def flush(self):
+        for series in self._series.values():
+            series.mmap.flush()
+
+    def close(self):
+        self.flush()
+        for series in self._series.values():
+            series.close()
+        self._series.clear()
@@ -1,36 +1,176 @@
 import os
 import os.path
+import time
+import queue
+import threading
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+DURABILITY_POLICIES = ('none', 'flush', 'fsync')
+
 
 class TextFileWriter(object):
-    def __init__(self, path, prefix, header=None):
+    """Write lines to daily text files.
+
+    `durability` controls what happens after lines are written: 'none'
+    leaves them in Python's buffers, 'flush' flushes them to the OS, and
+    'fsync' also calls fsync() at most every `fsync_interval` seconds.
+    """
+    def __init__(self, path, prefix, header=None, durability='flush',
+                 fsync_interval=10.0):
+        self.file = None
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError("Unknown durability policy '{}'"
+                             .format(durability))
         self.path = path
         self.pattern = "%Y/%m/{}-%Y-%m-%d.txt".format(prefix)
         self.header = header
-        self.file = None
+        self.durability = durability
+        self.fsync_interval = fsync_interval
+        self._filename = None
+        self._rollover = None
+        self._last_fsync = 0
+        # Whether lines have been written since the last fsync
+        self._unsynced = False
 
     def __del__(self):
         if self.file is not None:
             self.file.close()
 
+    def close(self):
+        if self.file is not None:
+            if self._unsynced:
+                self._fsync()
+            self.file.close()
+            self.file = None
+
     def writeline(self, line):
-        fn = os.path.join(self.path,
-                          format(datetime.utcnow(), self.pattern))
-        if self.file is None or self.file.name != fn:
-            if self.file is not None:
-                self.file.close()
-            if not os.path.exists(os.path.dirname(fn)):
-                os.makedirs(os.path.dirname(fn))
-            file_already_existed = os.path.exists(fn)
-            self.file = open(fn, 'at')
-            if self.header and not file_already_existed:
-                self.file.write(self.header + '\n')
-            logger.info("Opened %s file %s",
-                        "existing" if file_already_existed else "new",
-                        fn)
-        self.file.write(line + '\n')
+        self._write_batch([(time.time(), line)])
+
+    def _filename_for(self, when):
+        # File names only change at midnight (UTC), so don't format the
+        # date again until then
+        if self._rollover is None or when >= self._rollover:
+            self._filename = os.path.join(
+                self.path, format(datetime.utcfromtimestamp(when),
+                                  self.pattern))
+            self._rollover = when - (when % 86400) + 86400
+        return self._filename
+
+    def _open(self, fn):
+        if self.file is not None:
+            self.file.close()
+        if not os.path.exists(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        file_already_existed = os.path.exists(fn)
+        self.file = open(fn, 'at')
+        if self.header and not file_already_existed:
+            self.file.write(self.header + '\n')
+        logger.info("Opened %s file %s",
+                    "existing" if file_already_existed else "new",
+                    fn)
+
+    def _write_batch(self, batch):
+        """Write a list of (time, line) pairs"""
+        chunk = []
+        for when, line in batch:
+            fn = self._filename_for(when)
+            if self.file is None or self.file.name != fn:
+                if chunk:
+                    self.file.write(''.join(chunk))
+                    chunk = []
+                self._open(fn)
+            chunk.append(line + '\n')
+        if chunk:
+            self.file.write(''.join(chunk))
+        self._sync()
+
+    def _sync(self):
+        if self.durability == 'none' or self.file is None:
+            return
         self.file.flush()
+        if self.durability == 'fsync':
+            self._unsynced = True
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+
+    def _fsync(self):
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+
+
+class BufferedTextFileWriter(TextFileWriter):
+    """TextFileWriter which writes from a background thread.
+
+    writeline() only adds the line to a queue, so it never waits for the
+    disk. Lines are written in batches of up to `max_lines`, at most
+    `max_delay` seconds after they were queued. If more than `max_queued`
+    lines are waiting, new lines are dropped.
+    """
+    def __init__(self, path, prefix, header=None, durability='flush',
+                 fsync_interval=10.0, max_lines=100, max_delay=1.0,
+                 max_queued=10000):
+        super().__init__(path, prefix, header, durability, fsync_interval)
+        self.max_lines = max_lines
+        self.max_delay = max_delay
+        self.dropped = 0
+        self._queue = queue.Queue(max_queued)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def writeline(self, line):
+        try:
+            self._queue.put_nowait((time.time(), line))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning("Write queue full, %d lines dropped",
+                               self.dropped)
+
+    def close(self):
+        """Write any queued lines and wait for the thread to finish"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        finished = False
+        while not finished:
+            batch = []
+            try:
+                # Lines not yet fsynced when no more arrive are synced
+                # after max_delay, rather than waiting for the next batch
+                item = self._queue.get(
+                    timeout=self.max_delay if self._unsynced else None)
+            except queue.Empty:
+                try:
+                    self._fsync()
+                except OSError as err:
+                    logger.error("Error syncing file: %s", err)
+                    self._unsynced = False
+                continue
+            deadline = time.monotonic() + self.max_delay
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.max_lines:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            finished = item is None
+
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except OSError as err:
+                    logger.error("Error writing %d lines: %s",
+                                 len(batch), err)
+        TextFileWriter.close(self)
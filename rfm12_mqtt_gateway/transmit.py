@@ -0,0 +1,147 @@
+from collections import OrderedDict, deque
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+
+def format_command(node_id, payload):
+    """Format a payload as a send command for the RFM12 firmware"""
+    return ','.join(['%02d' % x for x in payload]) + ',%ds' % node_id
+
+
+def command_key(line):
+    """Return the numbers and command letter of a command line or echo.
+
+    The firmware's echo is rebuilt from the numbers it parsed, so it
+    isn't always the same text as the command written (e.g. "1,2,10s"
+    for "01,02,10s").
+    """
+    match = re.match(r'^\s*([\d,\s]*?)\s*([a-z])\s*$', line)
+    if match is None:
+        return None
+    return (tuple(int(x) for x in re.findall(r'\d+', match.group(1))),
+            match.group(2))
+
+
+class PendingCommand(object):
+    __slots__ = ('node', 'command_name', 'payload', 'line', 'key', 'queued',
+                 'written', 'echoed', 'timeout_handle')
+
+    def __init__(self, node, command_name, payload, queued):
+        self.node = node
+        self.command_name = command_name
+        self.payload = payload
+        self.line = None
+        self.key = None
+        self.queued = queued
+        self.written = None
+        self.echoed = None
+        self.timeout_handle = None
+
+
+class TransmitQueue(object):
+    """Pace commands written to the radio and track their delivery.
+
+    Commands are written with `write` no more often than `min_interval`
+    seconds plus `byte_time` seconds per character, and at most `window`
+    commands are waiting for a response at once. A command submitted
+    while an earlier one for the same node and command is still queued
+    replaces it.
+
+    Responses from the radio are passed to handle_response(). The
+    firmware echoes the command line when it accepts it, and reports
+    "N b" when it has sent N bytes. When a command is sent, or after
+    `timeout` seconds, `on_result(command, status, latency)` is called
+    with status 'sent', 'accepted' (echoed but not reported sent) or
+    'timeout'.
+    """
+    def __init__(self, loop, write, on_result=None, min_interval=0.1,
+                 byte_time=0.001, timeout=2.0, window=1):
+        self._loop = loop
+        self._write = write
+        self._on_result = on_result
+        self.min_interval = min_interval
+        self.byte_time = byte_time
+        self.timeout = timeout
+        self.window = window
+        self.coalesced = 0
+
+        self._queue = OrderedDict()
+        self._in_flight = deque()
+        self._next_write = 0
+        self._write_handle = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, node, command_name, payload):
+        key = (node.id, command_name)
+        if key in self._queue:
+            logger.info("Replacing queued command '%s' for node '%s'",
+                        command_name, node.name)
+            self._queue[key].payload = payload
+            self.coalesced += 1
+        else:
+            self._queue[key] = PendingCommand(node, command_name, payload,
+                                              self._loop.time())
+        self._schedule()
+
+    def handle_response(self, response):
+        """Match a response from the radio to a command.
+
+        Returns True if the response belonged to a command.
+        """
+        now = self._loop.time()
+        key = command_key(response)
+        for command in self._in_flight:
+            if command.echoed is None and key == command.key:
+                command.echoed = now
+                return True
+            if response == '{} b'.format(len(command.payload)):
+                self._finish(command, 'sent')
+                return True
+        return False
+
+    def _schedule(self):
+        if (self._write_handle is not None or not self._queue or
+                len(self._in_flight) >= self.window):
+            return
+        delay = max(0, self._next_write - self._loop.time())
+        self._write_handle = self._loop.call_later(delay, self._write_next)
+
+    def _write_next(self):
+        self._write_handle = None
+        key, command = self._queue.popitem(last=False)
+        command.line = format_command(command.node.id, command.payload)
+        command.key = command_key(command.line)
+        now = self._loop.time()
+        try:
+            self._write(command.line)
+        except Exception as err:
+            logger.error("Error writing command: %r", err)
+            self._report(command, 'error')
+        else:
+            command.written = now
+            command.timeout_handle = self._loop.call_later(
+                self.timeout, self._finish, command, None)
+            self._in_flight.append(command)
+        self._next_write = (now + self.min_interval +
+                            self.byte_time * len(command.line))
+        self._schedule()
+
+    def _finish(self, command, status):
+        if status is None:
+            status = 'accepted' if command.echoed is not None else 'timeout'
+        else:
+            command.timeout_handle.cancel()
+        self._in_flight.remove(command)
+        self._report(command, status)
+        self._schedule()
+
+    def _report(self, command, status):
+        latency = self._loop.time() - command.queued
+        logger.info("Command '%s' for node '%s': %s after %.3f s",
+                    command.command_name, command.node.name, status, latency)
+        if self._on_result is not None:
+            self._on_result(command, status, latency)
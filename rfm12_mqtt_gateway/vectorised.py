@@ -0,0 +1,335 @@
+"""Decode batches of payloads with NumPy.
+
+The payloads of one node are viewed as an array with a structured dtype
+matching the node's payload format, and each channel expression is
+evaluated once on whole columns instead of once per frame.
+
+The results must be exactly the same as NodeDefinition.parse_values, so
+only expressions which are known to give the same answer are evaluated
+on columns: indexing `x` with a constant, number constants, arithmetic
+and bitwise operators, and bool(), float() and abs(). Integers are
+worked on as int64, and an expression is only used if its intermediate
+values can't overflow. Other expressions are evaluated per frame as
+usual.
+"""
+
+import ast
+import operator
+import re
+import struct
+
+from .nodes import DecodedFrame
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# struct format codes: (numpy format, kind, largest magnitude)
+_CODES = {
+    'b': ('i1', 'int', 2 ** 7),
+    'B': ('u1', 'int', 2 ** 8 - 1),
+    '?': ('?', 'bool', 1),
+    'h': ('<i2', 'int', 2 ** 15),
+    'H': ('<u2', 'int', 2 ** 16 - 1),
+    'i': ('<i4', 'int', 2 ** 31),
+    'I': ('<u4', 'int', 2 ** 32 - 1),
+    'l': ('<i4', 'int', 2 ** 31),
+    'L': ('<u4', 'int', 2 ** 32 - 1),
+    'q': ('<i8', 'int', 2 ** 63),
+    # Can't be held in int64
+    'Q': ('<u8', 'other', None),
+    'e': ('<f2', 'float', None),
+    'f': ('<f4', 'float', None),
+    'd': ('<f8', 'float', None),
+}
+
+_TOKEN = re.compile(r'\s*(\d*)([a-zA-Z?])')
+
+_INT_LIMIT = 2 ** 63
+# Integers which convert to float exactly
+_EXACT_FLOAT_LIMIT = 2 ** 53
+
+_BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.RShift: operator.rshift,
+}
+
+_UNARY_OPS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+
+class NotVectorisable(Exception):
+    pass
+
+
+def payload_dtype(payload_format):
+    """Return (dtype, kinds) for a struct payload format.
+
+    `kinds` lists (field name, kind, largest magnitude) for each value
+    unpacked by struct, where kind is 'int', 'float', 'bool' or 'other'.
+    """
+    names, formats, offsets, kinds = [], [], [], []
+    prefix = '<'
+    pos = 0
+    while pos < len(payload_format):
+        match = _TOKEN.match(payload_format, pos)
+        if match is None:
+            raise ValueError("Bad payload format '{}'".format(payload_format))
+        pos = match.end()
+        count, code = match.groups()
+        count = int(count) if count else 1
+        if code == 'x':
+            prefix += match.group()
+            continue
+        if code in 'sp':
+            fields = [('S{}'.format(count), 'other', None)]
+            item = code
+        elif code == 'c':
+            fields = [('S1', 'other', None)] * count
+            item = 'c'
+        elif code in _CODES:
+            fields = [_CODES[code]] * count
+            item = code
+        else:
+            raise ValueError("Unsupported payload format code '{}'"
+                             .format(code))
+        for fmt, kind, bound in fields:
+            name = 'f{}'.format(len(names))
+            names.append(name)
+            formats.append(fmt)
+            offsets.append(struct.calcsize(prefix))
+            kinds.append((name, kind, bound))
+            prefix += (str(count) + item) if code in 'sp' else item
+    dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                      'itemsize': struct.calcsize('<' + payload_format)})
+    return dtype, kinds
+
+
+def _constant(node):
+    # ast.Num before Python 3.8, ast.Constant after
+    if type(node).__name__ == 'Num':
+        return True, node.n
+    if type(node).__name__ == 'Constant':
+        return True, node.value
+    return False, None
+
+
+def _index(node):
+    index = node.slice
+    if type(index).__name__ == 'Index':  # before Python 3.9
+        index = index.value
+    sign = 1
+    if isinstance(index, ast.UnaryOp) and isinstance(index.op, ast.USub):
+        sign, index = -1, index.operand
+    is_constant, value = _constant(index)
+    if not is_constant or type(value) is not int:
+        raise NotVectorisable('index is not a constant')
+    return sign * value
+
+
+def _number(kind, bound):
+    if kind not in ('int', 'float'):
+        raise NotVectorisable('arithmetic on {} values'.format(kind))
+    if kind == 'int' and bound >= _INT_LIMIT:
+        raise NotVectorisable('integers may overflow')
+    return kind, bound
+
+
+def _nonzero_constant(node):
+    is_constant, value = _constant(node)
+    if (not is_constant or type(value) not in (int, float) or
+            value == 0):
+        raise NotVectorisable('divisor is not a non-zero constant')
+    return value
+
+
+def check(node, kinds):
+    """Return (kind, largest magnitude) of expression `node`'s result.
+
+    Raises NotVectorisable if it can't be evaluated exactly on columns.
+    """
+    is_constant, value = _constant(node)
+    if is_constant:
+        if type(value) is int:
+            return 'int', abs(value)
+        if type(value) is float:
+            return 'float', None
+        raise NotVectorisable('constant {!r}'.format(value))
+
+    if isinstance(node, ast.Subscript):
+        if not (isinstance(node.value, ast.Name) and node.value.id == 'x'):
+            raise NotVectorisable('subscript of something other than x')
+        index = _index(node)
+        if not -len(kinds) <= index < len(kinds):
+            raise NotVectorisable('index out of range')
+        name, kind, bound = kinds[index]
+        if kind == 'other':
+            raise NotVectorisable('value is not a number')
+        return kind, bound
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        return _number(*check(node.operand, kinds))
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        left, a = _number(*check(node.left, kinds))
+        right, b = _number(*check(node.right, kinds))
+        op = type(node.op)
+        if op in (ast.Div, ast.FloorDiv, ast.Mod):
+            divisor = _nonzero_constant(node.right)
+            if op is ast.Div:
+                if left == right == 'int' and max(a, b) > _EXACT_FLOAT_LIMIT:
+                    raise NotVectorisable('integers too large to divide')
+                return 'float', None
+            if left == right == 'int':
+                return _number('int', a + 1 if op is ast.FloorDiv
+                               else abs(divisor))
+            return 'float', None
+        if op in (ast.BitAnd, ast.BitOr, ast.BitXor, ast.RShift):
+            if left != 'int' or right != 'int':
+                raise NotVectorisable('bitwise operator on floats')
+            if op is ast.RShift:
+                is_constant, shift = _constant(node.right)
+                if not is_constant or not 0 <= shift < 63:
+                    raise NotVectorisable('shift is not a small constant')
+                return 'int', a
+            return 'int', 2 ** max(a, b).bit_length()
+        if left == right == 'int':
+            return _number('int', a * b if op is ast.Mult else a + b)
+        return 'float', None
+
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+            node.func.id in ('bool', 'float', 'abs') and
+            len(node.args) == 1 and not node.keywords):
+        kind, bound = check(node.args[0], kinds)
+        if node.func.id == 'bool':
+            if kind == 'other':
+                raise NotVectorisable('bool() of something other than a '
+                                      'number')
+            return 'bool', 1
+        kind, bound = _number(kind, bound)
+        if node.func.id == 'float':
+            return 'float', None
+        return kind, bound
+
+    raise NotVectorisable('unsupported expression {}'
+                          .format(type(node).__name__))
+
+
+def evaluate(node, columns):
+    """Evaluate an expression which has passed check() on `columns`"""
+    is_constant, value = _constant(node)
+    if is_constant:
+        return value
+    if isinstance(node, ast.Subscript):
+        return columns[_index(node)]
+    if isinstance(node, ast.UnaryOp):
+        return _UNARY_OPS[type(node.op)](evaluate(node.operand, columns))
+    if isinstance(node, ast.BinOp):
+        return _BINARY_OPS[type(node.op)](evaluate(node.left, columns),
+                                          evaluate(node.right, columns))
+    # One of the calls allowed by check()
+    value = evaluate(node.args[0], columns)
+    if node.func.id == 'bool':
+        return np.not_equal(value, 0)
+    if node.func.id == 'float':
+        return np.asarray(value, dtype=np.float64)
+    return np.abs(value)
+
+
+class _Columns(object):
+    """Values of each field in the payloads, converted when first used"""
+    def __init__(self, data, kinds):
+        self.data = data
+        self.kinds = kinds
+        self._cache = {}
+
+    def __getitem__(self, index):
+        try:
+            return self._cache[index]
+        except KeyError:
+            pass
+        name, kind, bound = self.kinds[index]
+        column = self.data[name]
+        if kind == 'int':
+            column = column.astype(np.int64)
+        elif kind == 'float':
+            column = column.astype(np.float64)
+        self._cache[index] = column
+        return column
+
+
+class VectorisedDecoder(object):
+    """Decode batches of payloads for `node` using NumPy"""
+    def __init__(self, node):
+        self.node = node
+        self.dtype, self.kinds = payload_dtype(node.payload_format)
+        self.channels = []
+        for channel in node.channel_table:
+            k, func = channel.name, channel.func
+            tree = None
+            try:
+                tree = ast.parse(channel.value, mode='eval').body
+                check(tree, self.kinds)
+                if not any(isinstance(n, ast.Subscript)
+                           for n in ast.walk(tree)):
+                    raise NotVectorisable('does not depend on x')
+            except (NotVectorisable, SyntaxError):
+                tree = None
+            self.channels.append((k, func, tree))
+
+    @property
+    def vectorised_channels(self):
+        return [k for k, func, tree in self.channels if tree is not None]
+
+    def decode(self, payloads):
+        """Return a list of values dicts, as NodeDefinition.parse_payloads"""
+        buffer = b''.join(payloads)
+        columns = _Columns(np.frombuffer(buffer, self.dtype), self.kinds)
+        unpacked = None
+        results = []
+        for k, func, tree in self.channels:
+            if tree is not None:
+                # Python gives inf and nan without warnings for floats
+                with np.errstate(all='ignore'):
+                    results.append(evaluate(tree, columns).tolist())
+                continue
+            if unpacked is None:
+                unpacked = list(self.node._struct.iter_unpack(buffer))
+            try:
+                results.append([func(x) for x in unpacked])
+            except IndexError:
+                raise ValueError("Not enough values")
+            except NameError:
+                raise RuntimeError("Expression used name other than 'x'")
+        node = self.node
+        if not results:
+            return [DecodedFrame(node, []) for payload in payloads]
+        return [DecodedFrame(node, list(row)) for row in zip(*results)]
+
+
+def decoder_for(node):
+    """Return a VectorisedDecoder for `node`, or None if it wouldn't help.
+
+    None is returned if NumPy isn't installed, the payload format isn't
+    supported, or none of the node's channels can be vectorised.
+    """
+    if np is None:
+        return None
+    try:
+        decoder = VectorisedDecoder(node)
+    except ValueError:
+        return None
+    if not decoder.vectorised_channels:
+        return None
+    return decoder
@@ -41,7 +41,7 @@ setup(
         'Programming Language :: Python :: 3',
         # 'Programming Language :: Python :: 3.2',
         # 'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.5',
     ],
 
     # What does your project relate to?
@@ -51,10 +51,13 @@ setup(
     # simple. Or you can use find_packages().
     packages=['rfm12_mqtt_gateway'],
 
-    install_requires=['PyYAML', 'pyserial', 'paho-mqtt'],
+    install_requires=['PyYAML', 'pyserial', 'paho-mqtt>=1.5,<2'],
 
     extras_require={
         'test': ['coverage'],
+        'msgpack': ['msgpack'],
+        'cbor': ['cbor2'],
+        'numpy': ['numpy'],
     },
 
     # To provide executable scripts, use entry points in preference to the
@@ -63,6 +66,9 @@ setup(
     entry_points={
         'console_scripts': [
             'rfm12-mqtt-gateway=rfm12_mqtt_gateway.__main__:main',
+            'rfm12-mqtt-replay=rfm12_mqtt_gateway.replay:main',
+            'rfm12-mqtt-bulk-decode=rfm12_mqtt_gateway.bulk:main',
+            'rfm12-mqtt-simulate=rfm12_mqtt_gateway.simulate:main',
         ],
     },
 )
@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from rfm12_mqtt_gateway.archive import (FrameArchiveWriter,
+                                        BufferedFrameArchiveWriter,
+                                        FrameArchiveReader, find_archives,
+                                        query_archives)
+
+LINES = [
+    '2015-06-01T10:00:00 10 34 0 23 0',
+    '2015-06-01T10:00:05 20 1 2',
+    '2015-06-01T11:00:00 10 35 0 23 0',
+    '2015-06-01T11:00:05 -> 4 b',
+    '2015-06-01T12:00:00 10 36 0 23 0',
+    '2015-06-01T12:00:05 20 3 4',
+    '2015-06-02T00:00:00 10 37 0 23 0',
+]
+
+
+class TestFrameArchive(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        writer = FrameArchiveWriter(self.path, 'frames', block_lines=2)
+        for line in LINES:
+            writer.writeline(line)
+        writer.close()
+        self.filename = os.path.join(self.path,
+                                     '2015/06/frames-2015-06-01.rfa')
+        self.reader = FrameArchiveReader(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_files_are_split_by_day(self):
+        self.assertEqual(find_archives(self.path, 'frames'), [
+            self.filename,
+            os.path.join(self.path, '2015/06/frames-2015-06-02.rfa'),
+        ])
+        self.assertEqual(find_archives(self.path, 'frames',
+                                       start='2015-06-02T00:00:00'),
+                         [os.path.join(self.path,
+                                       '2015/06/frames-2015-06-02.rfa')])
+
+    def test_other_prefixes_are_not_found(self):
+        writer = FrameArchiveWriter(self.path, 'frames-radio1')
+        writer.writeline('2015-06-03T10:00:00 10 1 0')
+        writer.close()
+        self.assertEqual(len(find_archives(self.path, 'frames')), 2)
+        self.assertEqual(find_archives(self.path, 'frames',
+                                       end='2015-06-01T12:00:00'),
+                         [self.filename])
+        self.assertEqual(len(find_archives(self.path, 'frames-radio1')), 1)
+
+    def test_block_index(self):
+        blocks = self.reader.blocks()
+        self.assertEqual([(b.start, b.end, b.count) for b in blocks], [
+            ('2015-06-01T10:00:00', '2015-06-01T10:00:05', 2),
+            ('2015-06-01T11:00:00', '2015-06-01T11:00:05', 2),
+            ('2015-06-01T12:00:00', '2015-06-01T12:00:05', 2),
+        ])
+        self.assertEqual(blocks[0].node_ids, {10, 20})
+        self.assertEqual(blocks[1].node_ids, {10})
+
+    def test_query_everything(self):
+        filenames = find_archives(self.path, 'frames')
+        self.assertEqual(['{} {}'.format(*x)
+                          for x in query_archives(filenames)], LINES)
+
+    def test_query_time_range(self):
+        self.assertEqual(list(self.reader.query('2015-06-01T10:00:05',
+                                                '2015-06-01T11:00:00')), [
+            ('2015-06-01T10:00:05', '20 1 2'),
+            ('2015-06-01T11:00:00', '10 35 0 23 0'),
+        ])
+
+    def test_query_node_ids(self):
+        self.assertEqual(list(self.reader.query(node_ids=[20])), [
+            ('2015-06-01T10:00:05', '20 1 2'),
+            ('2015-06-01T12:00:05', '20 3 4'),
+        ])
+
+    def test_appending_to_existing_file(self):
+        writer = FrameArchiveWriter(self.path, 'frames')
+        writer.writeline('2015-06-01T13:00:00 20 5 6')
+        writer.close()
+        self.assertEqual(list(self.reader.query(start='2015-06-01T12:30')),
+                         [('2015-06-01T13:00:00', '20 5 6')])
+
+    def test_buffered_writer_writes_lines_on_close(self):
+        writer = BufferedFrameArchiveWriter(self.path, 'buffered')
+        for line in LINES:
+            writer.writeline(line)
+        writer.close()
+        filenames = find_archives(self.path, 'buffered')
+        self.assertEqual(['{} {}'.format(*x)
+                          for x in query_archives(filenames)], LINES)
+
+    def test_buffered_writer_writes_old_blocks(self):
+        writer = BufferedFrameArchiveWriter(self.path, 'buffered',
+                                            max_block_age=0.05)
+        writer.writeline(LINES[0])
+        deadline = time.time() + 5
+        filename = os.path.join(self.path, '2015/06/buffered-2015-06-01.rfa')
+        while time.time() < deadline:
+            # The file is written in one go with the first block
+            if os.path.exists(filename) and os.path.getsize(filename):
+                break
+            time.sleep(0.01)
+        self.assertEqual(list(FrameArchiveReader(filename).query()),
+                         [('2015-06-01T10:00:00', '10 34 0 23 0')])
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from array import array
+from unittest.mock import patch
+from rfm12_mqtt_gateway import bulk
+from rfm12_mqtt_gateway.bulk import bulk_decode
+from rfm12_mqtt_gateway.framing import iso_to_timestamp
+
+NODES = """
+- node_id: 10
+  name: /home/power
+  payload: h
+  channels:
+    power:
+      value: x[0] * 10
+- node_id: 20
+  name: /home/temp
+  payload: b
+  channels:
+    temp:
+      value: x[0] / 2
+"""
+
+LOGS = {
+    'frames-2015-06-02.txt': ('2015-06-02T10:00:00 10 1 0\n'
+                              '2015-06-02T10:00:01 20 5\n'),
+    'frames-2015-06-01.txt': ('2015-06-01T23:00:00 10 2 0\n'
+                              '2015-06-01T23:00:01 10 3 0\n'
+                              '2015-06-01T23:00:02 99 3 0\n'),
+}
+
+
+def _read(path):
+    a = array('d')
+    with open(path, 'rb') as f:
+        a.frombytes(f.read())
+    return list(a)
+
+
+class TestBulkDecode(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.files = []
+        for name, text in LOGS.items():
+            self.files.append(os.path.join(self.path, name))
+            with open(self.files[-1], 'wt') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_files_are_decoded_and_merged_in_time_order(self):
+        output = os.path.join(self.path, 'out')
+        bulk_decode(self.files, NODES, output, processes=2)
+
+        with open(os.path.join(output, 'columns.json'), 'rt') as f:
+            index = json.load(f)
+        self.assertEqual(index['/home/power'],
+                         {'path': '%2Fhome%2Fpower', 'rows': 3,
+                          'channels': ['power']})
+        self.assertEqual(sorted(os.listdir(output)),
+                         ['%2Fhome%2Fpower', '%2Fhome%2Ftemp',
+                          'columns.json'])
+
+        times = _read(os.path.join(output, '%2Fhome%2Fpower', 'time.f64'))
+        self.assertEqual(times, [iso_to_timestamp('2015-06-01T23:00:00'),
+                                 iso_to_timestamp('2015-06-01T23:00:01'),
+                                 iso_to_timestamp('2015-06-02T10:00:00')])
+        self.assertEqual(_read(os.path.join(output, '%2Fhome%2Fpower',
+                                            'power.f64')), [20, 30, 10])
+        self.assertEqual(_read(os.path.join(output, '%2Fhome%2Ftemp',
+                                            'temp.f64')), [2.5])
+
+    def test_overlapping_files_are_merged(self):
+        # Frames logged on the 2nd after the other file's frames
+        with open(os.path.join(self.path, 'frames-2015-06-01.txt'),
+                  'at') as f:
+            f.write('2015-06-02T09:00:00 10 4 0\n'
+                    '2015-06-02T12:00:00 10 5 0\n')
+        output = os.path.join(self.path, 'out')
+        with patch.object(bulk, 'CHUNK_SIZE', 2):
+            bulk_decode(self.files, NODES, output, processes=2)
+        self.assertEqual(_read(os.path.join(output, '%2Fhome%2Fpower',
+                                            'power.f64')),
+                         [20, 30, 40, 10, 50])
+        times = _read(os.path.join(output, '%2Fhome%2Fpower', 'time.f64'))
+        self.assertEqual(times, sorted(times))
+
+    def test_similar_names_are_kept_apart(self):
+        nodes = NODES.replace('/home/temp', 'home_power').replace(
+            'temp:', 'time:')
+        output = os.path.join(self.path, 'out')
+        bulk_decode(self.files, nodes, output, processes=1)
+        with open(os.path.join(output, 'columns.json'), 'rt') as f:
+            index = json.load(f)
+        path = os.path.join(output, index['home_power']['path'])
+        self.assertEqual(_read(os.path.join(path, '%74ime.f64')), [2.5])
+        self.assertEqual(len(_read(os.path.join(path, 'time.f64'))), 1)
+        self.assertEqual(_read(os.path.join(
+            output, index['/home/power']['path'], 'power.f64')), [20, 30, 10])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import unittest
+from rfm12_mqtt_gateway.dedup import Deduplicator
+
+
+def claim(frame, at, instance):
+    return json.dumps({'frame': frame, 'at': at,
+                       'instance': instance}).encode('utf8')
+
+
+class TestDeduplicator(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.dispatched = []
+        self.claims = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _run(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_local_duplicates_within_window(self):
+        d = Deduplicator(self.loop, self.dispatched.append, window=2.0)
+        d.submit('10 1 2', 'a', now=100.0)
+        d.submit('10 1 2', 'b', now=101.0)
+        d.submit('10 1 3', 'c', now=101.0)
+        d.submit('10 1 2', 'd', now=102.5)
+        self.assertEqual(self.dispatched, ['a', 'c', 'd'])
+        self.assertEqual(d.duplicates, 1)
+
+    def test_bounded(self):
+        d = Deduplicator(self.loop, self.dispatched.append, maxlen=10)
+        for i in range(100):
+            d.submit('10 {}'.format(i), i, now=100.0)
+        self.assertEqual(len(d), 10)
+        self.assertEqual(len(self.dispatched), 100)
+
+    def _shared(self, **kwargs):
+        return Deduplicator(self.loop, self.dispatched.append,
+                            publish_claim=self.claims.append,
+                            instance='pi1', hold=0.05, **kwargs)
+
+    def test_shared_publishes_claim_and_holds(self):
+        d = self._shared()
+        d.submit('10 1 2', 'a')
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(json.loads(self.claims[0])['frame'], '10 1 2')
+        self.assertEqual(json.loads(self.claims[0])['instance'], 'pi1')
+        # Own claims coming back are ignored
+        d.handle_claim(self.claims[0].encode('utf8'))
+        self._run(0.1)
+        self.assertEqual(self.dispatched, ['a'])
+
+    def test_earlier_claim_from_other_gateway_wins(self):
+        d = self._shared()
+        d.submit('10 1 2', 'a', now=100.0)
+        d.handle_claim(claim('10 1 2', 99.99, 'pi2'))
+        self._run(0.1)
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(d.duplicates, 1)
+
+    def test_later_claim_from_other_gateway_loses(self):
+        d = self._shared(window=1e10)
+        d.submit('10 1 2', 'a', now=100.0)
+        d.handle_claim(claim('10 1 2', 100.01, 'pi2'))
+        self._run(0.1)
+        self.assertEqual(self.dispatched, ['a'])
+
+    def test_frame_claimed_before_heard(self):
+        d = self._shared()
+        d.handle_claim(claim('10 1 2', 1e12, 'pi2'))
+        d.submit('10 1 2', 'a')
+        self._run(0.1)
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(self.claims, [])
+
+    def test_claims_from_the_future_expire(self):
+        d = self._shared(window=0.05, maxlen=100)
+        d.handle_claim(claim('10 1 2', 1e12, 'pi2'))
+        d.handle_claim(claim('10 1 3', 1.0, 'pi2'))
+        self.assertEqual(len(d), 2)
+        self._run(0.1)
+        d.handle_claim(claim('10 1 4', 1.0, 'pi2'))
+        self.assertEqual(len(d), 1)
+
+    def test_bad_claim(self):
+        d = self._shared()
+        d.handle_claim(b'nonsense')
+        d.handle_claim(b'{"frame": "10 1"}')
+        self.assertEqual(len(d), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from calendar import timegm
+from datetime import datetime
+from rfm12_mqtt_gateway.framing import (LineFramer, Timestamper,
+                                        iso_to_timestamp)
+
+
+class TestLineFramer(unittest.TestCase):
+    def test_complete_lines_are_returned(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b'10 1 2\r\n20 3 4\r\n'),
+                         ['10 1 2', '20 3 4'])
+
+    def test_partial_lines_are_kept(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b'10 1'), [])
+        self.assertEqual(framer.feed(b' 2\r\n20 3'), ['10 1 2'])
+        self.assertEqual(framer.feed(b' 4\r\n'), ['20 3 4'])
+
+    def test_blank_lines_are_dropped(self):
+        framer = LineFramer()
+        self.assertEqual(framer.feed(b'\r\n10 1 2\n\n \r\n'), ['10 1 2'])
+
+    def test_long_garbage_is_discarded(self):
+        framer = LineFramer(max_line_length=10)
+        self.assertEqual(framer.feed(b'x' * 20), [])
+        self.assertEqual(framer.feed(b'10 1 2\n'), ['10 1 2'])
+
+
+class TestTimestamper(unittest.TestCase):
+    def test_whole_seconds(self):
+        now = 1433162096.75
+        self.assertEqual(Timestamper()(now),
+                         datetime.utcfromtimestamp(now)
+                         .replace(microsecond=0).isoformat())
+
+    def test_subsecond_precision(self):
+        stamp = Timestamper(precision=3)
+        self.assertEqual(stamp(1433162096.25), '2015-06-01T12:34:56.250')
+        self.assertEqual(stamp(1433162097.5), '2015-06-01T12:34:57.500')
+
+    def test_bad_precision(self):
+        with self.assertRaises(ValueError):
+            Timestamper(precision=7)
+
+
+class TestIsoToTimestamp(unittest.TestCase):
+    def test_conversion(self):
+        self.assertEqual(iso_to_timestamp('2015-06-01T12:34:56'),
+                         timegm((2015, 6, 1, 12, 34, 56)))
+        self.assertEqual(iso_to_timestamp('2015-06-01T12:34:56.25'),
+                         timegm((2015, 6, 1, 12, 34, 56)) + 0.25)
+
+    def test_round_trip(self):
+        stamp = Timestamper(precision=3)
+        self.assertEqual(iso_to_timestamp(stamp(1433162096.25)),
+                         1433162096.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from rfm12_mqtt_gateway.gateway import EmonMQTTGateway
+from rfm12_mqtt_gateway.simulate import (SerialSimulator, FrameGenerator,
+                                         FakeMQTTClient)
+
+NODES_YAML = """
+- node_id: 10
+  name: /home/power
+  payload: hh
+  channels:
+    power: {value: 'x[0]', units: W}
+    ratio: {value: 'x[0] / x[1]'}
+  commands:
+    set:
+      payload: bb
+      values: '[x[0], x[1]]'
+- node_id: 20
+  name: /home/room
+  payload: h
+  channels:
+    temp: {value: 'x[0] / 10.0', units: degC}
+"""
+
+
+class TestGateway(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.nodes_path = os.path.join(self.path, 'nodes.yaml')
+        with open(self.nodes_path, 'wt') as f:
+            f.write(NODES_YAML)
+        self.loop = asyncio.new_event_loop()
+        self.radios = [SerialSimulator(self.loop, FrameGenerator([]))
+                       for i in range(2)]
+        self.client = FakeMQTTClient(self.loop)
+        self.gateway = EmonMQTTGateway(
+            self.loop, nodes_path=self.nodes_path, reload_interval=0,
+            metrics_interval=3600.0,
+            sinks=[{'type': 'mqtt'},
+                   {'type': 'store', 'path': os.path.join(self.path, 'db')}],
+            radios=[{'name': 'a', 'port': self.radios[0].port},
+                    {'name': 'b', 'port': self.radios[1].port}],
+            frame_log_path=os.path.join(self.path, 'frame_log'),
+            journal_path=os.path.join(self.path, 'journal'),
+            mqtt_client=self.client)
+        self.task = self.loop.create_task(self.gateway.run_input())
+        self._run(0.1)
+
+    def tearDown(self):
+        self.task.cancel()
+        self.loop.run_until_complete(asyncio.wait([self.task]))
+        for radio in self.radios:
+            radio.close()
+        self.loop.close()
+        shutil.rmtree(self.path)
+
+    def _run(self, seconds=0.05):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+        if self.task.done():
+            self.task.result()
+
+    def _message(self, topic):
+        return json.loads(self.client.last_messages[topic])
+
+    def test_frames_are_published(self):
+        self.assertIn('/send_command/#', self.client.subscriptions)
+        self.radios[0].write(['10 44 1 2 0', '20 215 0'])
+        self._run()
+        self.assertEqual(self._message('/home/power/power')['value'], 300)
+        self.assertEqual(self._message('/home/power/ratio')['value'], 150)
+        self.assertEqual(self._message('/home/room/temp')['value'], 21.5)
+        self.assertEqual(self.gateway.metrics.frames_decoded, 2)
+
+    def test_frames_are_logged_per_radio(self):
+        self.radios[0].write(['10 1 0 1 0'])
+        self.radios[1].write(['20 1 0', '20 2 0'])
+        self._run()
+        self.assertEqual(dict(self.gateway.metrics.radio_frames),
+                         {'a': 1, 'b': 2})
+        self.task.cancel()
+        self.loop.run_until_complete(asyncio.wait([self.task]))
+        logs = []
+        for root, dirs, files in os.walk(os.path.join(self.path,
+                                                      'frame_log')):
+            logs.extend(files)
+        self.assertEqual(sorted(name.split('-')[1] for name in logs),
+                         ['a', 'b'])
+
+    def test_bad_frames_are_skipped(self):
+        # Dividing by zero in an expression, as well as unparseable
+        # frames, must not stop the gateway reading
+        self.radios[0].write(['10 5 0 0 0', '10 ?? 1', '20 215 0'])
+        self._run()
+        self.assertFalse(self.task.done())
+        self.assertEqual(self.gateway.metrics.frames_malformed, 2)
+        self.assertEqual(self._message('/home/room/temp')['value'], 21.5)
+
+    def test_commands_go_to_the_radio_node_was_heard_on(self):
+        self.client.inject('/send_command/home/power/set', '[1, 2]')
+        self._run(0.2)
+        self.assertEqual(self.radios[0].read(), '01,02,10s')
+
+        self.radios[1].write(['10 1 0 1 0'])
+        self._run()
+        self.client.inject('/send_command/home/power/set', '[3, 4]')
+        self._run(0.2)
+        self.assertEqual(self.radios[1].read(), '03,04,10s')
+        # The firmware's echo is not zero-padded
+        self.radios[1].write(['> 3,4,10s', '-> 2 b'])
+        self._run()
+        self.assertEqual(self._message('/command_result/home/power/set')
+                         ['status'], 'sent')
+
+    def test_messages_are_queued_while_disconnected(self):
+        self.client.connected = False
+        self.radios[0].write(['20 1 0'])
+        self._run()
+        self.assertNotIn('/home/room/temp', self.client.last_messages)
+        self.assertEqual(len(self.gateway.publish_queue), 1)
+        self.client.connect('localhost')
+        self._run()
+        self.assertEqual(self._message('/home/room/temp')['value'], 0.1)
+
+    def test_reload_definitions(self):
+        with open(self.nodes_path, 'wt') as f:
+            f.write(NODES_YAML.replace("'x[0] / 10.0'", "'x[0] / 100.0'"))
+        self.assertTrue(self.gateway.reload_definitions())
+        self.radios[0].write(['20 215 0'])
+        self._run()
+        self.assertEqual(self._message('/home/room/temp')['value'], 2.15)
+
+    def test_query_history(self):
+        self.radios[0].write(['20 215 0'])
+        self._run()
+        self.client.inject('/query_history/home/room/temp', '{"id": 3}')
+        result = self._message('/history_result/home/room/temp')
+        self.assertEqual(result['id'], 3)
+        self.assertEqual([row[1] for row in result['data']], [21.5])
+
+    def test_profile(self):
+        self.client.inject('/gateway/profile',
+                           '{"seconds": 0.1, "interval": 0.005}')
+        self.assertIsNotNone(self.gateway.profiler)
+        self._run(0.3)
+        result = self._message('/gateway/profile_result')
+        self.assertGreater(result['samples'], 0)
+        self.assertTrue(os.path.exists(result['file']))
+        self.assertIsNone(self.gateway.profiler)
+
+    def test_bad_profile_requests_are_ignored(self):
+        for payload in ['{"seconds": NaN}', '{"interval": Infinity}',
+                        '{"seconds": "soon"}', '[]', 'rubbish']:
+            self.client.inject('/gateway/profile', payload)
+            self.assertIsNone(self.gateway.profiler)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from rfm12_mqtt_gateway.metrics import Histogram, GatewayMetrics
+
+
+class TestHistogram(unittest.TestCase):
+    def test_empty(self):
+        h = Histogram()
+        self.assertEqual(h.as_dict(), {'count': 0, 'mean': None, 'max': 0.0,
+                                       'p50': None, 'p90': None, 'p99': None})
+
+    def test_percentiles_are_bin_edges(self):
+        h = Histogram()
+        for i in range(90):
+            h.add(0.0015)
+        for i in range(10):
+            h.add(0.3)
+        self.assertEqual(h.count, 100)
+        self.assertEqual(h.percentile(50), 0.002)
+        self.assertEqual(h.percentile(90), 0.002)
+        self.assertEqual(h.percentile(99), 0.5)
+        self.assertAlmostEqual(h.as_dict()['mean'], 0.03135)
+
+    def test_values_above_last_bin(self):
+        h = Histogram()
+        h.add(30.0)
+        self.assertEqual(h.percentile(50), 30.0)
+
+
+class TestGatewayMetrics(unittest.TestCase):
+    def test_snapshot(self):
+        m = GatewayMetrics()
+        m.frames_received = 5
+        m.messages_published = 10
+        m.messages_sent = 7
+        m.node_frames['bob'] += 3
+        snapshot = m.snapshot()
+        self.assertEqual(snapshot['frames']['received'], 5)
+        self.assertEqual(snapshot['messages']['queue_depth'], 3)
+        self.assertGreater(snapshot['node_frames_per_minute']['bob'], 0)
+
+        # Rates are since the last snapshot
+        snapshot = m.snapshot()
+        self.assertEqual(snapshot['node_frames_per_minute']['bob'], 0)
+
+    def test_snapshot_without_reset_keeps_rates(self):
+        m = GatewayMetrics()
+        m.node_frames['bob'] += 3
+        m.parse_time.add(0.001)
+        m.snapshot(reset=False)
+        snapshot = m.snapshot()
+        self.assertGreater(snapshot['node_frames_per_minute']['bob'], 0)
+        self.assertEqual(snapshot['parse_time']['count'], 1)
+
+    def test_timings_are_since_last_snapshot(self):
+        m = GatewayMetrics()
+        m.serial_to_publish.add(5.0)
+        self.assertEqual(m.snapshot()['serial_to_publish']['p99'], 5.0)
+        m.serial_to_publish.add(0.001)
+        snapshot = m.snapshot()
+        self.assertEqual(snapshot['serial_to_publish']['count'], 1)
+        self.assertEqual(snapshot['serial_to_publish']['p99'], 1e-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
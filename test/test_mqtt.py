@@ -0,0 +1,102 @@
+import asyncio
+import socket
+import unittest
+from unittest.mock import Mock
+from rfm12_mqtt_gateway.mqtt import AsyncioMQTTAdapter
+
+
+class TestSocketRegistration(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = Mock()
+        self.adapter = AsyncioMQTTAdapter(self.client, self.loop)
+        self.sock, self.other = socket.socketpair()
+
+    def tearDown(self):
+        self.sock.close()
+        self.other.close()
+        self.loop.close()
+
+    def _run(self, seconds=0.01):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_socket_is_read_when_ready(self):
+        self.client.on_socket_open(self.client, None, self.sock)
+        self._run()
+        self.client.loop_read.assert_not_called()
+        self.other.send(b'x')
+        self._run()
+        self.client.loop_read.assert_called_with()
+
+        self.client.on_socket_close(self.client, None, self.sock)
+        self.client.loop_read.reset_mock()
+        self._run()
+        self.client.loop_read.assert_not_called()
+
+    def test_socket_is_written_while_registered(self):
+        self.client.on_socket_open(self.client, None, self.sock)
+        self.client.on_socket_register_write(self.client, None, self.sock)
+        self._run()
+        self.client.loop_write.assert_called_with()
+
+        self.client.on_socket_unregister_write(self.client, None, self.sock)
+        self.client.loop_write.reset_mock()
+        self._run()
+        self.client.loop_write.assert_not_called()
+        self.client.on_socket_close(self.client, None, self.sock)
+
+
+class TestReconnection(unittest.TestCase):
+    def setUp(self):
+        self.loop = Mock()
+        self.client = Mock()
+        self.client.connect.side_effect = OSError('refused')
+        self.client.reconnect.side_effect = OSError('refused')
+        self.client.is_connected.return_value = False
+        self.adapter = AsyncioMQTTAdapter(self.client, self.loop,
+                                          min_delay=0.2, max_delay=1.0)
+
+    def _reconnect_delays(self):
+        return [c[0][0] for c in self.loop.call_later.call_args_list
+                if c[0][1] == self.adapter._reconnect]
+
+    def _run_reconnect(self):
+        # As the event loop would when the delay is over
+        self.assertIsNotNone(self.adapter._reconnect_handle)
+        self.adapter._reconnect()
+
+    def test_failed_connections_back_off(self):
+        self.adapter.connect('localhost')
+        for i in range(4):
+            self._run_reconnect()
+        self.assertEqual(self._reconnect_delays(),
+                         [0.2, 0.4, 0.8, 1.0, 1.0])
+        self.assertEqual(self.client.reconnect.call_count, 4)
+
+    def test_only_one_reconnect_is_scheduled(self):
+        self.adapter.connect('localhost')
+        self.client.on_disconnect(self.client, None, 1)
+        self.assertEqual(self._reconnect_delays(), [0.2])
+
+    def test_delay_is_reset_after_connecting(self):
+        self.adapter.connect('localhost')
+        self._run_reconnect()
+        self._run_reconnect()
+        self.client.reconnect.side_effect = None
+        self._run_reconnect()
+        self.client.is_connected.return_value = True
+        self.adapter._misc()
+        self.client.loop_misc.assert_called_with()
+
+        self.client.on_disconnect(self.client, None, 7)
+        self.assertEqual(self._reconnect_delays(), [0.2, 0.4, 0.8, 0.2])
+
+    def test_clean_disconnect_does_not_reconnect(self):
+        self.client.connect.side_effect = None
+        self.adapter.connect('localhost')
+        self.client.on_disconnect(self.client, None, 0)
+        self.assertEqual(self._reconnect_delays(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,19 @@
 import unittest
-from rfm12_mqtt_gateway.nodes import NodeDefinition, load_definitions_from_yaml
+import json
+import marshal
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+from rfm12_mqtt_gateway import nodes as nodes_module
+from rfm12_mqtt_gateway.nodes import (NodeDefinition, DecodedFrame,
+                                      load_definitions,
+                                      load_definitions_from_yaml)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 TEST_YAML = """
 - node_id: 10
@@ -78,6 +92,41 @@ class TestNodeDefinition(unittest.TestCase):
             'value3': 6.1,
         })
 
+    def test_parse_values_returns_compact_frame(self):
+        result = self.node.parse_values([1, 2, 3])
+        self.assertIsInstance(result, DecodedFrame)
+        self.assertFalse(hasattr(result, '__dict__'))
+        self.assertEqual(result.data, [1, 1, 6.1])
+        self.assertEqual(list(result), ['value1', 'value2', 'value3'])
+        self.assertEqual(list(result.items()),
+                         [('value1', 1), ('value2', 1), ('value3', 6.1)])
+        self.assertEqual(result['value3'], 6.1)
+        self.assertEqual(len(result), 3)
+        self.assertEqual(result.as_dict(),
+                         {'value1': 1, 'value2': 1, 'value3': 6.1})
+        with self.assertRaises(KeyError):
+            result['value4']
+
+    def test_channel_table(self):
+        self.assertFalse(hasattr(self.node, '__dict__'))
+        channels = self.node.channel_table
+        self.assertEqual([c.name for c in channels],
+                         ['value1', 'value2', 'value3'])
+        self.assertEqual([c.index for c in channels], [0, 1, 2])
+        self.assertEqual(channels[1].value, '2 * x[1] - x[2]')
+        self.assertEqual(channels[1].units, 'deg/s')
+        self.assertEqual(channels[1].description, 'Long description')
+        self.assertEqual(channels[2].units, '')
+        self.assertEqual(channels[1].func([0, 3, 1]), 5)
+        self.assertEqual(self.node.channel_index['value2'], 1)
+
+    def test_parse_payload_at_offset(self):
+        self.assertEqual(
+            self.node.parse_payload(bytes((10, 34, 0, 23, 0, 1, 0)), 1),
+            {'value1': 34, 'value2': 2 * 23 - 1, 'value3': 6.1})
+        with self.assertRaises(ValueError):
+            self.node.parse_payload(bytes((10, 34, 0, 23, 0, 1, 0)))
+
     def test_parse_values_cannot_access_namespace(self):
         node = NodeDefinition('bob', 66, 'h', {'bad': {'value': 'unittest'}})
         with self.assertRaises(RuntimeError):
@@ -119,6 +168,57 @@ class TestNodeDefinition(unittest.TestCase):
         with self.assertRaises(ValueError):
             node.encode_command('name', [1, 2, 3])
 
+    def test_syntax_errors_are_raised_on_creation(self):
+        with self.assertRaises(ValueError):
+            NodeDefinition('bob', 66, 'h', {'bad': {'value': 'x[0] +'}})
+        with self.assertRaises(ValueError):
+            NodeDefinition('bob', 66, 'h', commands={
+                'bad': {'payload': 'b', 'values': '[x[0]'}
+            })
+
+    def test_format_messages_matches_json_dumps(self):
+        values = {'value1': 34, 'value2': -2.5, 'value3': 6.1}
+        time = '2015-06-01T12:34:56'
+        messages = self.node.format_messages(time, values)
+        self.assertEqual(len(messages), 3)
+        for topic, payload in messages:
+            k = topic.split('/')[-1]
+            self.assertEqual(topic, 'name/' + k)
+            self.assertEqual(payload, json.dumps({
+                'at':    time,
+                'value': values[k],
+                'units': TEST_CHANNELS[k].get('units', ''),
+                'description': TEST_CHANNELS[k].get('description', ''),
+            }))
+
+    def test_format_frame_message_json(self):
+        node = NodeDefinition('name', 10, 'hhh', TEST_CHANNELS,
+                              frame_format='json')
+        values = {'value1': 34, 'value2': -2.5, 'value3': 6.1}
+        topic, payload = node.format_frame_message('2015-06-01T12:34:56',
+                                                   values)
+        self.assertEqual(topic, 'name')
+        self.assertEqual(json.loads(payload), {'at': '2015-06-01T12:34:56',
+                                               'values': values})
+        topic, payload = node.format_frame_message(
+            '2015-06-01T12:34:56', node.parse_values([34, 0, 2.5]))
+        self.assertEqual(json.loads(payload), {'at': '2015-06-01T12:34:56',
+                                               'values': values})
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_format_frame_message_msgpack(self):
+        node = NodeDefinition('name', 10, 'hhh', TEST_CHANNELS,
+                              frame_format='msgpack')
+        values = {'value1': 34, 'value2': -2.5, 'value3': 6.1}
+        topic, payload = node.format_frame_message('2015-06-01T12:34:56',
+                                                   values)
+        self.assertEqual(msgpack.unpackb(payload, raw=False),
+                         {'at': '2015-06-01T12:34:56', 'values': values})
+
+    def test_unknown_frame_format(self):
+        with self.assertRaises(ValueError):
+            NodeDefinition('name', 10, 'hhh', frame_format='xml')
+
     def test_comparisons(self):
         self.assertEqual(
             NodeDefinition('bob', 10, 'h', {'name': {'value': '1'}}),
@@ -145,3 +245,104 @@ class TestNodeDefinitionsFromYaml(unittest.TestCase):
             NodeDefinition('/home/electricity', 10, 'hhh',
                            TEST_CHANNELS, TEST_COMMANDS)
         ])
+
+    def test_loading_rejects_unknown_names(self):
+        bad_channel = TEST_YAML.replace('2 * x[1] - x[2]', '2 * y[1]')
+        with self.assertRaises(ValueError):
+            load_definitions_from_yaml(bad_channel)
+
+        bad_command = TEST_YAML.replace("x['hours']", "hours")
+        with self.assertRaises(ValueError):
+            load_definitions_from_yaml(bad_command)
+
+    def test_loading_rejects_duplicates(self):
+        node2 = TEST_YAML.replace('node_id: 10', 'node_id: 11').replace(
+            '/home/electricity', '/home/gas')
+        load_definitions_from_yaml(TEST_YAML + node2)
+        with self.assertRaises(ValueError):
+            load_definitions_from_yaml(TEST_YAML + TEST_YAML.replace(
+                '/home/electricity', '/home/gas'))
+        with self.assertRaises(ValueError):
+            load_definitions_from_yaml(TEST_YAML + node2.replace(
+                'node_id: 11', 'node_id: 10'))
+
+    def test_unchanged_definitions_are_reused(self):
+        node2 = TEST_YAML.replace('node_id: 10', 'node_id: 11').replace(
+            '/home/electricity', '/home/gas')
+        previous = load_definitions_from_yaml(TEST_YAML + node2)
+        nodes = load_definitions_from_yaml(
+            TEST_YAML + node2.replace('units: m', 'units: cm'), previous)
+        self.assertIs(nodes[0], previous[0])
+        self.assertIsNot(nodes[1], previous[1])
+        self.assertEqual(nodes[1].channels['value1']['units'], 'cm')
+
+    def test_loading_allows_builtins(self):
+        nodes = load_definitions_from_yaml(
+            TEST_YAML.replace('2 * x[1] - x[2]', 'round(x[1] / 3.0, 1)'))
+        self.assertEqual(nodes[0].parse_payload(bytes((0, 0, 10, 0, 0, 0))),
+                         {'value1': 0, 'value2': 3.3, 'value3': 6.1})
+
+    def test_loading_allows_names_bound_in_expressions(self):
+        nodes = load_definitions_from_yaml(TEST_YAML.replace(
+            "\"[0, x['hours'], x['minutes'], x['seconds']]\"",
+            "'[int(v) for v in x]'"))
+        self.assertEqual(nodes[0].encode_command('set_time', ['1', 2, 3, 4]),
+                         bytes((1, 2, 3, 4)))
+        load_definitions_from_yaml(TEST_YAML.replace(
+            '2 * x[1] - x[2]', '"(y := x[1]) * y - (lambda a: a)(x[2])"'))
+
+        with self.assertRaises(ValueError):
+            load_definitions_from_yaml(TEST_YAML.replace(
+                '2 * x[1] - x[2]', 'sum(v * k for v in x)'))
+
+
+class TestDefinitionsCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.yaml_path = os.path.join(self.path, 'nodes.yaml')
+        self.cache_path = os.path.join(self.path, 'nodes.cache')
+        with open(self.yaml_path, 'wt') as f:
+            f.write(TEST_YAML)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_cached_definitions_are_used(self):
+        nodes = load_definitions(self.yaml_path, self.cache_path)
+        self.assertTrue(os.path.exists(self.cache_path))
+
+        nodes_module._compiled.clear()
+        with patch.object(nodes_module, 'load_definitions_from_yaml') as m, \
+                patch.object(nodes_module.ast, 'parse') as parse:
+            cached = load_definitions(self.yaml_path, self.cache_path)
+            self.assertFalse(m.called)
+            self.assertFalse(parse.called)
+        self.assertEqual(cached, nodes)
+        payload = bytes((34, 0, 23, 0, 1, 0))
+        self.assertEqual(cached[0].parse_payload(payload),
+                         nodes[0].parse_payload(payload))
+
+    def test_cache_is_ignored_when_yaml_changes(self):
+        load_definitions(self.yaml_path, self.cache_path)
+        with open(self.yaml_path, 'wt') as f:
+            f.write(TEST_YAML.replace('units: m', 'units: cm'))
+        nodes = load_definitions(self.yaml_path, self.cache_path)
+        self.assertEqual(nodes[0].channels['value1']['units'], 'cm')
+
+    def test_code_for_changed_definitions_is_forgotten(self):
+        previous = load_definitions(self.yaml_path, self.cache_path)
+        with open(self.yaml_path, 'wt') as f:
+            f.write(TEST_YAML.replace('2 * x[1] - x[2]', '3 * x[1]'))
+        load_definitions(self.yaml_path, self.cache_path, previous)
+        sources = set(k[0] for k in nodes_module._compiled)
+        self.assertIn('3 * x[1]', sources)
+        self.assertNotIn('2 * x[1] - x[2]', sources)
+        with open(self.cache_path, 'rb') as f:
+            cache = marshal.load(f)
+        self.assertEqual(set(cache['code']), set(nodes_module._compiled))
+
+    def test_bad_cache_is_ignored(self):
+        with open(self.cache_path, 'wb') as f:
+            f.write(b'rubbish')
+        nodes = load_definitions(self.yaml_path, self.cache_path)
+        self.assertEqual(nodes, load_definitions_from_yaml(TEST_YAML))
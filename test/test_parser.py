@@ -6,25 +6,20 @@ from rfm12_mqtt_gateway.nodes import NodeDefinition
 
 class TestFrameParser(unittest.TestCase):
     def setUp(self):
-        nodes = [
-            NodeDefinition('bob', 10, 'hh'),
-            NodeDefinition('joe', 20, 'hh'),
-            NodeDefinition('fred', 30, 'bl'),
-        ]
-        for n in nodes:
-            n.parse_payload = Mock()
+        # NodeDefinition has slots, so stand-ins are used to check calls
+        nodes = [Mock(id=10), Mock(id=20), Mock(id=30)]
         self.parser = FrameParser(nodes)
 
     def test_frames_dispatched_to_nodes(self):
         self.parser.process_frame('10 34 0 23 0')
         self.parser.nodes[10].parse_payload.assert_called_once_with(
-            bytes((34, 0, 23, 0)))
+            bytes((10, 34, 0, 23, 0)), 1)
         self.assertFalse(self.parser.nodes[20].parse_payload.called)
         self.assertFalse(self.parser.nodes[30].parse_payload.called)
 
         self.parser.process_frame('20 12 0 17 1')
         self.parser.nodes[20].parse_payload.assert_called_once_with(
-            bytes((12, 0, 17, 1)))
+            bytes((20, 12, 0, 17, 1)), 1)
         self.assertFalse(self.parser.nodes[30].parse_payload.called)
 
     def test_messages_are_discarded(self):
@@ -39,6 +34,8 @@ class TestFrameParser(unittest.TestCase):
         tests = [
             # Non-integer values
             '10 21 aa',
+            # Empty
+            '\r\n',
         ]
         for frame in tests:
             with self.assertRaises(ValueError):
@@ -48,5 +45,52 @@ class TestFrameParser(unittest.TestCase):
         self.assertEqual(self.parser.process_frame('15 34 0 23 0'), (None, {}))
 
 
+class TestFrameParserBatch(unittest.TestCase):
+    def setUp(self):
+        self.bob = NodeDefinition('bob', 10, 'hh', {'a': {'value': 'x[0]'},
+                                                    'b': {'value': 'x[1]'}})
+        self.joe = NodeDefinition('joe', 20, 'b', {'c': {'value': 'x[0]'}})
+        self.parser = FrameParser([self.bob, self.joe])
+
+    def test_frames_are_grouped_by_node(self):
+        frames = [
+            '10 34 0 23 0',
+            '20 5',
+            '-> 4 b',
+            '10 1 1 2 0\n',
+        ]
+        self.assertEqual(self.parser.process_frames(frames), [
+            (self.bob, [(0, {'a': 34, 'b': 23}), (3, {'a': 257, 'b': 2})]),
+            (self.joe, [(1, {'c': 5})]),
+        ])
+
+    def test_accepts_bytes_buffer(self):
+        buf = b'20 5\n20 251\n'
+        self.assertEqual(self.parser.process_frames(buf), [
+            (self.joe, [(0, {'c': 5}), (1, {'c': -5})]),
+        ])
+
+    def test_bad_frames_are_skipped(self):
+        frames = [
+            '10 21 aa',       # Non-integer values
+            '15 34 0 23 0',   # Unknown node
+            '10 34 0 23',     # Wrong length
+            '',
+            '20 7',
+        ]
+        self.assertEqual(self.parser.process_frames(frames), [
+            (self.joe, [(4, {'c': 7})]),
+        ])
+
+    def test_matches_process_frame(self):
+        frames = ['10 34 0 23 0', '20 5', '10 135 243 0 0']
+        batch = {(node.id, i): values
+                 for node, results in self.parser.process_frames(frames)
+                 for i, values in results}
+        for i, f in enumerate(frames):
+            node, values = self.parser.process_frame(f)
+            self.assertEqual(batch[node.id, i], values)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from rfm12_mqtt_gateway.profiler import SamplingProfiler
+
+
+def busy_inner(deadline):
+    x = 0
+    while time.time() < deadline:
+        x += 1
+    return x
+
+
+def busy_outer(seconds):
+    return busy_inner(time.time() + seconds)
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_no_thread_until_started(self):
+        threads = threading.active_count()
+        profiler = SamplingProfiler()
+        self.assertFalse(profiler.running)
+        self.assertEqual(threading.active_count(), threads)
+        profiler.start()
+        self.assertTrue(profiler.running)
+        profiler.stop()
+        self.assertFalse(profiler.running)
+        self.assertEqual(threading.active_count(), threads)
+
+    def test_profile_busy_function(self):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        busy_outer(0.3)
+        profiler.stop()
+        self.assertGreater(profiler.samples, 10)
+
+        summary = profiler.summary(5)
+        self.assertGreater(summary['samples'], 10)
+        self.assertGreater(summary['busy'], 0.9)
+        hottest = summary['top'][0]
+        self.assertTrue(hottest['function'].startswith(
+            'busy_inner (test_profiler.py:'))
+        self.assertGreater(hottest['self'], 0.9)
+        self.assertLessEqual(hottest['self'], hottest['total'])
+        self.assertLessEqual(len(summary['top']), 5)
+
+        filename = os.path.join(self.tmpdir, 'new', 'profile.folded')
+        profiler.write_collapsed(filename)
+        with open(filename) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in lines),
+                         sum(profiler.stacks.values()))
+        main = [line for line in lines if line.startswith('MainThread;')]
+        self.assertTrue(any(';busy_outer (test_profiler.py:' in line and
+                            ';busy_inner (test_profiler.py:' in line
+                            for line in main))
+
+    def test_empty_summary(self):
+        summary = SamplingProfiler().summary()
+        self.assertEqual(summary, {'samples': 0, 'busy': None, 'top': []})
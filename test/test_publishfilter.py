@@ -0,0 +1,68 @@
+import unittest
+from rfm12_mqtt_gateway.nodes import NodeDefinition
+from rfm12_mqtt_gateway.publishfilter import (PublishFilter, PublishPolicy,
+                                              publish_policy)
+
+
+class TestPublishPolicy(unittest.TestCase):
+    def test_no_options(self):
+        self.assertIsNone(publish_policy({'value': 'x[0]'}))
+
+    def test_deadband_implies_on_change(self):
+        self.assertEqual(publish_policy({'value': 'x[0]', 'deadband': 0.5}),
+                         PublishPolicy(True, 0.5, 0, None))
+
+    def test_bad_options(self):
+        with self.assertRaises(ValueError):
+            publish_policy({'value': 'x[0]', 'min_interval': 'often'})
+        with self.assertRaises(ValueError):
+            NodeDefinition('bob', 10, 'h', {
+                'temp': {'value': 'x[0]', 'deadband': -1}})
+
+
+class TestPublishFilter(unittest.TestCase):
+    def setUp(self):
+        self.node = NodeDefinition('bob', 10, 'hh', {
+            'always': {'value': 'x[0]'},
+            'changes': {'value': 'x[0]', 'publish_on_change': True},
+            'deadband': {'value': 'x[0]', 'deadband': 1.0},
+            'interval': {'value': 'x[0]', 'min_interval': 10},
+            'heartbeat': {'value': 'x[0]', 'publish_on_change': True,
+                          'max_silence': 60},
+        })
+        self.filter = PublishFilter()
+
+    def _published(self, value, now):
+        values = {k: value for k in self.node.channels}
+        return sorted(self.filter.filter(self.node, values, now))
+
+    def test_nodes_without_policies_are_unchanged(self):
+        node = NodeDefinition('joe', 20, 'h', {'a': {'value': 'x[0]'}})
+        values = {'a': 1}
+        self.assertIs(self.filter.filter(node, values, 0), values)
+
+    def test_first_values_are_published(self):
+        self.assertEqual(self._published(20.0, 0), sorted(self.node.channels))
+
+    def test_policies(self):
+        self._published(20.0, 0)
+        self.assertEqual(self._published(20.0, 5), ['always'])
+        self.assertEqual(self._published(20.5, 6),
+                         ['always', 'changes', 'heartbeat'])
+        self.assertEqual(self._published(21.5, 7),
+                         ['always', 'changes', 'deadband', 'heartbeat'])
+        self.assertEqual(self._published(21.5, 11), ['always', 'interval'])
+        self.assertEqual(self._published(21.5, 67),
+                         ['always', 'heartbeat', 'interval'])
+        self.assertEqual(self._published(22.5, 68),
+                         ['always', 'changes', 'heartbeat'])
+
+    def test_forget(self):
+        self._published(20.0, 0)
+        self.assertEqual(len(self.filter), 4)
+        self.filter.forget('bob')
+        self.assertEqual(len(self.filter), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+from rfm12_mqtt_gateway.publishqueue import PublishQueue
+
+
+def _drain(queue):
+    result = []
+    while True:
+        message = queue.get()
+        if message is None:
+            return result
+        result.append(message)
+
+
+class TestPublishQueue(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.journal = os.path.join(self.path, 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            PublishQueue(policy='keep-everything')
+
+    def test_drop_oldest(self):
+        queue = PublishQueue(3)
+        for i in range(5):
+            queue.put('a', str(i))
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(_drain(queue), [('a', '2'), ('a', '3'), ('a', '4')])
+
+    def test_coalesce(self):
+        queue = PublishQueue(2, 'coalesce')
+        queue.put('a', '1')
+        queue.put('b', '2')
+        queue.put('a', '3')
+        self.assertEqual(queue.dropped, 0)
+        queue.put('c', '4')
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(_drain(queue), [('a', '3'), ('c', '4')])
+
+    def test_spill_keeps_order(self):
+        queue = PublishQueue(2, 'spill', self.journal)
+        for i in range(5):
+            queue.put('t/{}'.format(i), str(i))
+        queue.put('bin', b'\x00\xff')
+        self.assertEqual(len(queue), 6)
+        self.assertEqual(_drain(queue), [('t/{}'.format(i), str(i))
+                                         for i in range(5)] +
+                         [('bin', b'\x00\xff')])
+        self.assertEqual(os.path.getsize(self.journal), 0)
+
+    def test_journal_survives_restart(self):
+        queue = PublishQueue(1, 'spill', self.journal)
+        for i in range(4):
+            queue.put('t', str(i))
+        del queue
+
+        queue = PublishQueue(1, 'spill', self.journal)
+        self.assertEqual(len(queue), 3)
+        queue.put('t', 'new')
+        self.assertEqual(_drain(queue), [('t', '0'), ('t', '1'), ('t', '2'),
+                                         ('t', 'new')])
+
+    def test_incomplete_message_is_removed_from_journal(self):
+        queue = PublishQueue(1, 'spill', self.journal)
+        for i in range(3):
+            queue.put('t', str(i))
+        del queue
+        # As if the gateway stopped part way through spilling a message
+        with open(self.journal, 'ab') as f:
+            f.write(b'\x00\x01\x00')
+
+        queue = PublishQueue(1, 'spill', self.journal)
+        self.assertEqual(len(queue), 2)
+        for i in range(3):
+            queue.put('u', str(i))
+        del queue
+
+        queue = PublishQueue(1, 'spill', self.journal)
+        self.assertEqual(_drain(queue), [('t', '0'), ('t', '1'), ('u', '0'),
+                                         ('u', '1')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from rfm12_mqtt_gateway.nodes import NodeDefinition
+from rfm12_mqtt_gateway.parser import FrameParser
+from rfm12_mqtt_gateway.replay import read_frame_log, decode_frames, replay
+from rfm12_mqtt_gateway.sinks import StdoutSink
+
+LOG = """2015-06-01T10:00:00 10 34 0
+2015-06-01T10:00:01 20 5
+2015-06-01T10:00:02 -> 4 b
+2015-06-01T10:00:03 15 1 2
+2015-06-01T10:00:04 10 35 0
+"""
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'frames-2015-06-01.txt')
+        with open(self.filename, 'wt') as f:
+            f.write(LOG)
+        self.nodes = [
+            NodeDefinition('bob', 10, 'h', {'a': {'value': 'x[0]'}}),
+            NodeDefinition('joe', 20, 'b', {'b': {'value': 'x[0] / 2'}}),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_frames_are_decoded_in_order(self):
+        records = read_frame_log([self.filename])
+        decoded = decode_frames(FrameParser(self.nodes), records,
+                                batch_size=2)
+        self.assertEqual([(t, node.name, values)
+                          for t, node, values in decoded], [
+            ('2015-06-01T10:00:00', 'bob', {'a': 34}),
+            ('2015-06-01T10:00:01', 'joe', {'b': 2.5}),
+            ('2015-06-01T10:00:04', 'bob', {'a': 35}),
+        ])
+
+    def test_replay_to_stream(self):
+        stream = io.StringIO()
+        replay([self.filename], self.nodes, StdoutSink(stream))
+        self.assertEqual(stream.getvalue().splitlines()[1],
+                         'joe/b {"at": "2015-06-01T10:00:01", "value": 2.5, '
+                         '"units": "", "description": ""}')
+
+
+if __name__ == '__main__':
+    unittest.main()
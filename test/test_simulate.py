@@ -0,0 +1,107 @@
+import asyncio
+import os
+import unittest
+from rfm12_mqtt_gateway.nodes import NodeDefinition
+from rfm12_mqtt_gateway.parser import FrameParser
+from rfm12_mqtt_gateway.simulate import (FrameGenerator, SerialSimulator,
+                                         FakeMQTTClient)
+
+NODES = [
+    NodeDefinition('/a', 10, 'hh', {'x': {'value': 'x[0]'}}),
+    NodeDefinition('/b', 11, 'B', {'y': {'value': 'x[0]'}}),
+]
+
+
+class TestFrameGenerator(unittest.TestCase):
+    def test_frames(self):
+        generator = FrameGenerator(NODES, malformed=0.1, unknown=0.1)
+        parser = FrameParser(NODES)
+        counts = {'good': 0, 'malformed': 0, 'unknown': 0}
+        for i in range(1000):
+            kind, frame = generator.frame()
+            counts[kind] += 1
+            if kind == 'malformed':
+                with self.assertRaises(ValueError):
+                    parser.process_frame(frame)
+            else:
+                node, values = parser.process_frame(frame)
+                self.assertEqual(node is None, kind == 'unknown')
+        self.assertGreater(counts['malformed'], 50)
+        self.assertGreater(counts['unknown'], 50)
+        self.assertGreater(counts['good'], 700)
+
+
+class TestSerialSimulator(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.simulator = SerialSimulator(self.loop, FrameGenerator(NODES),
+                                         rate=200, burst=2)
+
+    def tearDown(self):
+        self.simulator.close()
+        self.loop.close()
+
+    def test_writes_frames_to_port(self):
+        port = os.open(self.simulator.port, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            self.simulator.start()
+            self.loop.run_until_complete(asyncio.sleep(0.1))
+            self.simulator.stop()
+            data = b''
+            while True:
+                try:
+                    data += os.read(port, 65536)
+                except BlockingIOError:
+                    break
+        finally:
+            os.close(port)
+        lines = data.decode('ascii').splitlines()
+        self.assertEqual(len(lines), self.simulator.counts['good'])
+        self.assertGreaterEqual(len(lines), 16)
+        self.assertEqual(len(lines) % 2, 0)
+        parser = FrameParser(NODES)
+        for line in lines:
+            node, values = parser.process_frame(line)
+            self.assertIn(node, NODES)
+
+    def test_overruns_when_not_read(self):
+        self.simulator.rate = 100000
+        self.simulator.burst = 1000
+        self.simulator.start()
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.simulator.stop()
+        self.assertGreater(self.simulator.overruns, 0)
+
+
+class TestFakeMQTTClient(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.client = FakeMQTTClient(self.loop)
+        self.events = []
+        self.client.on_connect = lambda *args: self.events.append('connect')
+        self.client.on_publish = lambda c, u, mid: self.events.append(mid)
+        self.client.on_message = lambda c, u, m: self.events.append(
+            (m.topic, m.payload))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_connect_and_publish(self):
+        self.client.connect('localhost')
+        self.assertFalse(self.client.is_connected())
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertTrue(self.client.is_connected())
+        self.client.publish('/a/x', '{"value": 1}')
+        self.client.publish('/a/x', '{"value": 2}')
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.assertEqual(self.events, ['connect', 1, 2])
+        self.assertEqual(self.client.published, 2)
+        self.assertEqual(self.client.last_messages, {'/a/x': '{"value": 2}'})
+
+    def test_inject(self):
+        self.client.inject('/send_command/a/go', '[1]')
+        self.assertEqual(self.events, [('/send_command/a/go', b'[1]')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from rfm12_mqtt_gateway.nodes import NodeDefinition
+from rfm12_mqtt_gateway.sinks import (Sink, SinkRunner, CSVSink,
+                                      LineProtocolSink, SQLiteSink,
+                                      create_sink)
+from rfm12_mqtt_gateway.config import load_config
+
+NODE = NodeDefinition('/home/room one', 10, 'hh', {
+    'temp': {'value': 'x[0] / 10.0'},
+    'count': {'value': 'x[1]'},
+})
+
+RECORDS = [
+    ('2015-06-01T12:00:00', NODE, {'temp': 21.5, 'count': 3}, 0),
+    ('2015-06-01T12:00:01.5', NODE, {'temp': 21.0, 'count': 4}, 0),
+]
+
+
+class _ListSink(Sink):
+    def __init__(self, blocking, delay=0):
+        self.blocking = blocking
+        self.delay = delay
+        self.records = []
+        self.threads = set()
+        self.closed = False
+
+    def write(self, records):
+        self.threads.add(threading.current_thread())
+        if self.delay:
+            threading.Event().wait(self.delay)
+        self.records.extend(records)
+
+    def close(self):
+        self.closed = True
+
+
+class TestFileSinks(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name), 'rt') as f:
+            return f.read()
+
+    def test_csv(self):
+        sink = CSVSink(os.path.join(self.path, 'out.csv'))
+        sink.write(RECORDS[:1])
+        sink.close()
+        sink = CSVSink(os.path.join(self.path, 'out.csv'))
+        sink.write(RECORDS[1:])
+        sink.close()
+        self.assertEqual(sorted(self._read('out.csv').splitlines()), [
+            '2015-06-01T12:00:00,/home/room one,count,3',
+            '2015-06-01T12:00:00,/home/room one,temp,21.5',
+            '2015-06-01T12:00:01.5,/home/room one,count,4',
+            '2015-06-01T12:00:01.5,/home/room one,temp,21.0',
+            'time,node,channel,value',
+        ])
+
+    def test_line_protocol(self):
+        sink = LineProtocolSink(os.path.join(self.path, 'out.txt'))
+        sink.write(RECORDS)
+        sink.close()
+        self.assertEqual(self._read('out.txt').splitlines(), [
+            r'rfm12,node=/home/room\ one count=3i,temp=21.5 '
+            '1433160000000000000',
+            r'rfm12,node=/home/room\ one count=4i,temp=21.0 '
+            '1433160001500000000',
+        ])
+
+    def test_sqlite(self):
+        filename = os.path.join(self.path, 'samples.db')
+        sink = SQLiteSink(filename)
+        sink.write(RECORDS)
+        sink.close()
+        db = sqlite3.connect(filename)
+        rows = db.execute('SELECT time, node, channel, value FROM samples '
+                          'WHERE channel = "temp" ORDER BY time').fetchall()
+        db.close()
+        self.assertEqual(rows, [
+            (1433160000.0, '/home/room one', 'temp', 21.5),
+            (1433160001.5, '/home/room one', 'temp', 21.0),
+        ])
+
+    def test_create_sink(self):
+        sink = create_sink({'type': 'csv', 'queue_size': 10,
+                            'path': os.path.join(self.path, 'x.csv')})
+        self.assertIsInstance(sink, CSVSink)
+        sink.close()
+        with self.assertRaises(ValueError):
+            create_sink({'type': 'carrier-pigeon'})
+
+    def test_config(self):
+        self.assertEqual(load_config()['sinks'], [{'type': 'mqtt'}])
+        filename = os.path.join(self.path, 'gateway.yaml')
+        with open(filename, 'wt') as f:
+            f.write('sinks:\n  - type: mqtt\n  - {type: sqlite, path: x}\n')
+        self.assertEqual(load_config(filename)['sinks'][1],
+                         {'type': 'sqlite', 'path': 'x'})
+        with open(filename, 'wt') as f:
+            f.write('sunks: []\n')
+        with self.assertRaises(ValueError):
+            load_config(filename)
+
+    def test_config_radios(self):
+        self.assertEqual(load_config()['radios'], [
+            {'name': 'ttyAMA0', 'port': '/dev/ttyAMA0', 'baudrate': 9600}])
+        filename = os.path.join(self.path, 'gateway.yaml')
+        with open(filename, 'wt') as f:
+            f.write('radios:\n'
+                    '  - {name: 868mhz, port: /dev/ttyAMA0}\n'
+                    '  - {port: /dev/ttyUSB0, baudrate: 57600}\n')
+        self.assertEqual(load_config(filename)['radios'], [
+            {'name': '868mhz', 'port': '/dev/ttyAMA0', 'baudrate': 9600},
+            {'name': 'ttyUSB0', 'port': '/dev/ttyUSB0', 'baudrate': 57600},
+        ])
+        with open(filename, 'wt') as f:
+            f.write('radios:\n'
+                    '  - {port: /dev/ttyUSB0}\n'
+                    '  - {port: /dev/ttyUSB0}\n')
+        with self.assertRaises(ValueError):
+            load_config(filename)
+
+
+class TestSinkRunner(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _run(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_non_blocking_sink_runs_in_loop(self):
+        sink = _ListSink(blocking=False)
+        runner = SinkRunner('list', sink, self.loop)
+        for record in RECORDS:
+            runner.put(record)
+        self._run(0.01)
+        self.assertEqual(sink.records, RECORDS)
+        self.assertEqual(sink.threads, {threading.current_thread()})
+
+    def test_slow_sink_does_not_block_and_drops_when_full(self):
+        slow = _ListSink(blocking=True, delay=0.05)
+        fast = _ListSink(blocking=True)
+        slow_runner = SinkRunner('slow', slow, self.loop, maxsize=5,
+                                 batch_size=1)
+        fast_runner = SinkRunner('fast', fast, self.loop, maxsize=5)
+        for i in range(10):
+            slow_runner.put(i)
+            fast_runner.put(i)
+        self._run(0.02)
+        self.assertEqual(fast.records, list(range(5)))
+        self.assertEqual(slow.records, [])
+        self.assertEqual(slow_runner.dropped, 5)
+        self.assertNotIn(threading.current_thread(), fast.threads)
+        self._run(0.3)
+        self.assertEqual(slow.records, list(range(5)))
+        slow_runner.close()
+        fast_runner.close()
+
+    def test_close_writes_queued_records(self):
+        for blocking in (False, True):
+            sink = _ListSink(blocking=blocking, delay=0.01)
+            runner = SinkRunner('list', sink, self.loop, batch_size=1)
+            for record in RECORDS:
+                runner.put(record)
+            runner.close()
+            self.assertEqual(sink.records, RECORDS)
+            self.assertTrue(sink.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
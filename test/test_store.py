@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import unittest
+from rfm12_mqtt_gateway.store import TimeSeriesStore
+
+SIZES = {'raw': 4, '1m': 3, '1h': 2, '1d': 2}
+
+
+class TestTimeSeriesStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = TimeSeriesStore(self.path, SIZES)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.path)
+
+    def test_raw_samples_oldest_first(self):
+        for i in range(3):
+            self.store.add('/home/room', 'temp', 1000.0 + i, 20 + i)
+        self.assertEqual(self.store.query('/home/room', 'temp'),
+                         [[1000.0, 20.0], [1001.0, 21.0], [1002.0, 22.0]])
+
+    def test_raw_ring_overwrites_oldest(self):
+        for i in range(10):
+            self.store.add('/home/room', 'temp', 1000.0 + i, i)
+        rows = self.store.query('/home/room', 'temp')
+        self.assertEqual([v for t, v in rows],
+                         [6.0, 7.0, 8.0, 9.0])
+
+    def test_rollups(self):
+        for t, v in [(60, 1), (90, 3), (119, 2), (120, 10), (170, 4)]:
+            self.store.add('/home/room', 'temp', float(t), v)
+        self.assertEqual(self.store.query('/home/room', 'temp', '1m'), [
+            [60.0, 1.0, 2.0, 3.0, 3],
+            [120.0, 4.0, 7.0, 10.0, 2],
+        ])
+        self.assertEqual(self.store.query('/home/room', 'temp', '1h'), [
+            [0.0, 1.0, 4.0, 10.0, 5],
+        ])
+
+    def test_query_range_and_limit(self):
+        for i in range(4):
+            self.store.add('/home/room', 'temp', 60.0 * i, i)
+        rows = self.store.query('/home/room', 'temp', '1m', start=60, end=180)
+        self.assertEqual([row[0] for row in rows], [60.0, 120.0])
+        rows = self.store.query('/home/room', 'temp', limit=1)
+        self.assertEqual(rows, [[180.0, 3.0]])
+
+    def test_out_of_order_samples_left_out_of_rollups(self):
+        for t, v in [(120, 1), (60, 5), (130, 3)]:
+            self.store.add('/home/room', 'temp', float(t), v)
+        self.assertEqual(len(self.store.query('/home/room', 'temp')), 3)
+        self.assertEqual(self.store.query('/home/room', 'temp', '1m'), [
+            [120.0, 1.0, 2.0, 3.0, 2],
+        ])
+        # Still in the latest hour
+        self.assertEqual(self.store.query('/home/room', 'temp', '1h'), [
+            [0.0, 1.0, 3.0, 5.0, 3],
+        ])
+
+    def test_nan_is_returned_as_none(self):
+        self.store.add('/home/room', 'temp', 60.0, 1)
+        self.store.add('/home/room', 'temp', 61.0, float('nan'))
+        self.assertEqual(self.store.query('/home/room', 'temp'),
+                         [[60.0, 1.0], [61.0, None]])
+        self.assertEqual(self.store.query('/home/room', 'temp', '1m'),
+                         [[60.0, 1.0, 1.0, 1.0, 1]])
+
+    def test_non_numeric_values_ignored(self):
+        self.store.add('/home/room', 'label', 1000.0, 'on')
+        self.store.add('/home/room', 'label', 1000.0, None)
+        with self.assertRaises(KeyError):
+            self.store.query('/home/room', 'label')
+
+    def test_bad_resolution(self):
+        self.store.add('/home/room', 'temp', 1000.0, 1)
+        with self.assertRaises(ValueError):
+            self.store.query('/home/room', 'temp', '1w')
+
+    def test_persists_with_fixed_size(self):
+        for i in range(3):
+            self.store.add('/home/room', 'temp', 1000.0 + i, i)
+        self.store.close()
+        filenames = os.listdir(self.path)
+        size = os.path.getsize(os.path.join(self.path, filenames[0]))
+
+        self.store = TimeSeriesStore(self.path, SIZES)
+        for i in range(3, 100):
+            self.store.add('/home/room', 'temp', 1000.0 + i, i)
+        rows = self.store.query('/home/room', 'temp')
+        self.assertEqual([v for t, v in rows],
+                         [96.0, 97.0, 98.0, 99.0])
+        self.assertEqual(self.store.query('/home/room', 'temp', '1m'), [
+            [960.0, 0.0, 9.5, 19.0, 20],
+            [1020.0, 20.0, 49.5, 79.0, 60],
+            [1080.0, 80.0, 89.5, 99.0, 20],
+        ])
+        self.assertEqual(os.listdir(self.path), filenames)
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.path, filenames[0])), size)
+
+    def test_changed_sizes_start_again(self):
+        self.store.add('/home/room', 'temp', 1000.0, 1)
+        self.store.close()
+        self.store = TimeSeriesStore(self.path, {'raw': 8})
+        with self.assertRaises(KeyError):
+            self.store.query('/home/other', 'temp')
+        self.assertEqual(self.store.query('/home/room', 'temp'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+from rfm12_mqtt_gateway.textfilewriter import (TextFileWriter,
+                                               BufferedTextFileWriter)
+
+
+def _read(path):
+    with open(path, 'rt') as f:
+        return f.read()
+
+
+def _timestamp(*args):
+    return (datetime(*args) - datetime(1970, 1, 1)).total_seconds()
+
+
+class TestTextFileWriter(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _today(self, prefix):
+        return os.path.join(self.path, format(
+            datetime.utcnow(), "%Y/%m/{}-%Y-%m-%d.txt".format(prefix)))
+
+    def test_lines_are_written_with_header(self):
+        writer = TextFileWriter(self.path, 'test', header='# header')
+        writer.writeline('line 1')
+        writer.writeline('line 2')
+        self.assertEqual(_read(self._today('test')),
+                         '# header\nline 1\nline 2\n')
+        writer.close()
+
+    def test_unknown_durability_policy(self):
+        with self.assertRaises(ValueError):
+            TextFileWriter(self.path, 'test', durability='sometimes')
+
+    def test_batch_is_split_at_midnight(self):
+        writer = TextFileWriter(self.path, 'test')
+        writer._write_batch([
+            (_timestamp(2015, 6, 1, 23, 59, 59), 'a'),
+            (_timestamp(2015, 6, 1, 23, 59, 59, 500000), 'b'),
+            (_timestamp(2015, 6, 2, 0, 0, 0), 'c'),
+        ])
+        writer.close()
+        self.assertEqual(
+            _read(os.path.join(self.path, '2015/06/test-2015-06-01.txt')),
+            'a\nb\n')
+        self.assertEqual(
+            _read(os.path.join(self.path, '2015/06/test-2015-06-02.txt')),
+            'c\n')
+
+    def test_buffered_writer_writes_lines_on_close(self):
+        writer = BufferedTextFileWriter(self.path, 'test', max_delay=60)
+        for i in range(250):
+            writer.writeline('line {}'.format(i))
+        writer.close()
+        self.assertEqual(_read(self._today('test')),
+                         ''.join('line {}\n'.format(i) for i in range(250)))
+
+    def test_buffered_writer_syncs_last_lines_after_max_delay(self):
+        with patch('rfm12_mqtt_gateway.textfilewriter.os.fsync') as fsync:
+            writer = BufferedTextFileWriter(self.path, 'test',
+                                            durability='fsync',
+                                            fsync_interval=60, max_delay=0.05)
+            writer.writeline('line 1')
+            time.sleep(0.1)
+            self.assertEqual(fsync.call_count, 1)
+            # Too soon after the last fsync, so synced once no more lines
+            # have arrived for max_delay
+            writer.writeline('line 2')
+            time.sleep(0.02)
+            self.assertEqual(fsync.call_count, 1)
+            time.sleep(0.2)
+            self.assertEqual(fsync.call_count, 2)
+            writer.close()
+            self.assertEqual(fsync.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+from rfm12_mqtt_gateway.nodes import NodeDefinition
+from rfm12_mqtt_gateway.transmit import (TransmitQueue, format_command,
+                                         command_key)
+
+
+class TestTransmitQueue(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.written = []
+        self.results = []
+        self.queue = TransmitQueue(
+            self.loop, self.written.append,
+            lambda c, status, latency: self.results.append(
+                (c.node.name, c.command_name, status)),
+            min_interval=0.01, timeout=0.05)
+        self.bob = NodeDefinition('bob', 10, 'h')
+        self.joe = NodeDefinition('joe', 20, 'h')
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _run(self, seconds):
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+
+    def test_format_command(self):
+        self.assertEqual(format_command(10, bytes((0, 12, 5))),
+                         '00,12,05,10s')
+
+    def test_command_key(self):
+        self.assertEqual(command_key('00,12,05,10s'), ((0, 12, 5, 10), 's'))
+        self.assertEqual(command_key('0,12,5,10s'), ((0, 12, 5, 10), 's'))
+        self.assertIsNone(command_key('OK'))
+
+    def test_commands_wait_for_response(self):
+        self.queue.submit(self.bob, 'a', bytes((1, 2)))
+        self.queue.submit(self.joe, 'b', bytes((3,)))
+        self._run(0.02)
+        self.assertEqual(self.written, ['01,02,10s'])
+
+        # The firmware echoes the numbers it parsed, without padding
+        self.assertTrue(self.queue.handle_response('1,2,10s'))
+        self.assertTrue(self.queue.handle_response('2 b'))
+        self.assertEqual(self.results, [('bob', 'a', 'sent')])
+        self._run(0.02)
+        self.assertEqual(self.written, ['01,02,10s', '03,20s'])
+
+    def test_duplicate_commands_are_coalesced(self):
+        self.queue.submit(self.bob, 'a', bytes((1,)))
+        self.queue.submit(self.bob, 'a', bytes((2,)))
+        self.assertEqual(self.queue.coalesced, 1)
+        self._run(0.02)
+        self.assertEqual(self.written, ['02,10s'])
+
+    def test_timeouts(self):
+        self.queue.submit(self.bob, 'a', bytes((1,)))
+        self.queue.submit(self.joe, 'b', bytes((2,)))
+        self._run(0.02)
+        self.assertTrue(self.queue.handle_response('1,10s'))
+        self._run(0.1)
+        self.assertEqual(self.written, ['01,10s', '02,20s'])
+        self.assertEqual(self.results[0], ('bob', 'a', 'accepted'))
+        self._run(0.05)
+        self.assertEqual(self.results[1], ('joe', 'b', 'timeout'))
+
+    def test_unrelated_responses(self):
+        self.assertFalse(self.queue.handle_response('OK'))
+        self.queue.submit(self.bob, 'a', bytes((1,)))
+        self._run(0.02)
+        self.assertFalse(self.queue.handle_response('1,20s'))
+        self._run(0.1)
+        self.assertEqual(self.results, [('bob', 'a', 'timeout')])
+
+
+if __name__ == '__main__':
+    unittest.main()
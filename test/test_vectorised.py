@@ -0,0 +1,118 @@
+import math
+import os.path
+import random
+import struct
+import unittest
+from rfm12_mqtt_gateway.nodes import NodeDefinition, load_definitions
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+else:
+    from rfm12_mqtt_gateway.vectorised import VectorisedDecoder, decoder_for
+
+BENCHMARK_NODES = os.path.join(os.path.dirname(__file__), '..', 'benchmarks',
+                               'nodes.yaml')
+
+
+def random_payloads(node, count, seed=0):
+    rng = random.Random(seed)
+    return [bytes(rng.randrange(256) for i in range(node.payload_size))
+            for j in range(count)]
+
+
+def same(a, b):
+    """Check values are equal and have the same type (NaN equal to NaN)"""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, float) and math.isnan(a):
+        return math.isnan(b)
+    return a == b
+
+
+@unittest.skipIf(numpy is None, 'needs numpy')
+class TestVectorisedDecoder(unittest.TestCase):
+    def assertMatchesScalar(self, node, payloads):
+        expected = [node.parse_payload(p) for p in payloads]
+        result = VectorisedDecoder(node).decode(payloads)
+        self.assertEqual(len(result), len(expected))
+        for r, e in zip(result, expected):
+            self.assertEqual(list(r), list(e))
+            for k in e:
+                self.assertTrue(same(r[k], e[k]),
+                                '{}: {!r} != {!r}'.format(k, r[k], e[k]))
+
+    def test_expressions(self):
+        channels = {
+            'a': 'x[0]',
+            'b': 'x[1] / 100.0',
+            'c': '50 + x[2] / 1000.0',
+            'd': 'x[2] - x[1]',
+            'e': 'x[3] * 0.01',
+            'f': 'x[4]',
+            'g': 'x[5] // 7',
+            'h': '-x[0] % 10',
+            'i': 'bool(x[6] & 4)',
+            'j': '(x[6] >> 2) | 1',
+            'k': 'x[7] * 1.5 + x[8]',
+            'l': 'abs(x[1]) * x[2] * x[3]',
+            'm': 'float(x[0])',
+            'n': 'x[-1]',
+            'o': 'x[5] / 3',
+            'p': 'x[7] // 0.25 + x[7] % 0.25',
+            # Not vectorised
+            'q': 'round(x[1] / 3.0, 2)',
+            'r': '"on" if x[6] & 1 else "off"',
+            's': 'x[9]',
+            't': 'x[0] ** 2',
+        }
+        node = NodeDefinition('/test', 5, 'hhHiBIB xfd4s?', {
+            k: {'value': v} for k, v in channels.items()})
+        decoder = VectorisedDecoder(node)
+        self.assertEqual(sorted(decoder.vectorised_channels),
+                         sorted(k for k in channels if k < 'q'))
+        self.assertMatchesScalar(node, random_payloads(node, 500))
+
+    def test_integer_overflow_is_not_vectorised(self):
+        node = NodeDefinition('/test', 5, 'qiii', {
+            'a': {'value': 'x[0] + 1'},
+            'b': {'value': 'x[1] * x[2] * x[3]'},
+            'c': {'value': 'x[1] * x[2]'},
+            'd': {'value': 'x[0]'},
+        })
+        self.assertEqual(sorted(VectorisedDecoder(node).vectorised_channels),
+                         ['c', 'd'])
+        self.assertMatchesScalar(node, random_payloads(node, 100))
+
+    def test_benchmark_nodes(self):
+        for node in load_definitions(BENCHMARK_NODES):
+            self.assertMatchesScalar(node, random_payloads(node, 200))
+
+    def test_errors_match_scalar(self):
+        node = NodeDefinition('/test', 5, 'hh', {
+            'a': {'value': 'x[0]'},
+            'b': {'value': 'x[2]'},
+        })
+        with self.assertRaisesRegex(ValueError, 'Not enough values'):
+            VectorisedDecoder(node).decode(random_payloads(node, 10))
+
+    def test_decoder_for(self):
+        node = NodeDefinition('/test', 5, 'h', {'a': {'value': 'str(x[0])'}})
+        self.assertIsNone(decoder_for(node))
+        node = NodeDefinition('/test', 5, 'h', {'a': {'value': 'x[0] / 2'}})
+        self.assertIsNotNone(decoder_for(node))
+
+    def test_parse_payloads_uses_numpy_for_large_batches(self):
+        node = NodeDefinition('/test', 5, 'hh', {
+            'a': {'value': 'x[0] / 10.0'},
+            'b': {'value': 'x[1]'},
+        })
+        payloads = [struct.pack('<hh', i, -i) for i in range(200)]
+        self.assertEqual(node.parse_payloads(payloads),
+                         [{'a': i / 10.0, 'b': -i} for i in range(200)])
+        self.assertIsInstance(node._vectorised, VectorisedDecoder)
+
+
+if __name__ == '__main__':
+    unittest.main()